@@ -135,5 +135,17 @@ ALCRITERION_MODELS = {
                                             'author': '(built-in)',
                                             'description': 'Implementation of the <a href="http://www.jmlr.org/papers/volume6/luo05a/luo05a.pdf" target="_blank">Breaking Ties</a> heuristic (difference of confidence values of highest and second-highest scoring classes).',
                                             'predictionType': ['labels', 'points', 'boundingBoxes', 'segmentationMasks']
+                                        },
+    'ai.al.builtins.leastconfidence.LeastConfidence': {
+                                            'name': 'Least Confidence',
+                                            'author': '(built-in)',
+                                            'description': 'Prioritizes predictions with the lowest confidence value of the highest-scoring class.',
+                                            'predictionType': ['labels', 'points', 'boundingBoxes', 'segmentationMasks']
+                                        },
+    'ai.al.builtins.entropy.Entropy': {
+                                            'name': 'Entropy',
+                                            'author': '(built-in)',
+                                            'description': 'Prioritizes predictions based on the (normalized) entropy of the confidence values of all classes.',
+                                            'predictionType': ['labels', 'points', 'boundingBoxes', 'segmentationMasks']
                                         }
 }
\ No newline at end of file
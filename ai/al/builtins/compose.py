@@ -1,30 +1,62 @@
 '''
     Composes multiple AL criteria and selects the maximum value over all.
+    Heuristics may either be vectorized criteria (see "ai.al.functional.
+    noarch.functional") or functions that receive a single prediction dict
+    and return its priority value.
 
-    2019 Benjamin Kellenberger
+    2019-21 Benjamin Kellenberger
 '''
 
 from util.helpers import get_class_executable
+from ai.al.functional.noarch import functional, ranking
+
+
+# vectorized criteria, and per-prediction built-ins mapped to them
+CRITERIA = (
+    functional.breaking_ties,
+    functional.max_confidence,
+    functional.least_confidence,
+    functional.entropy
+)
+LEGACY = {
+    functional._breaking_ties: functional.breaking_ties,
+    functional._max_confidence: functional.max_confidence
+}
 
 class Compose:
 
     def __init__(self, project, config, dbConnector, fileServer, options):
         
         # parse provided functions
+        self.criteria = []
         self.heuristics = []
         for h in options['rank']['heuristics']:
-            self.heuristics.append(get_class_executable(h))
+            fun = get_class_executable(h)
+            fun = LEGACY.get(fun, fun)
+            if fun in CRITERIA:
+                self.criteria.append(fun)
+            else:
+                self.heuristics.append(fun)
+
+        # per-prediction heuristics require predictions in the legacy dict format
+        self.supportsPredictionChunk = not len(self.heuristics)
 
     
     def rank(self, data, updateStateFun, **kwargs):
         
-        # iterate through the images and predictions
-        for imgID in data.keys():
-            if 'predictions' in data[imgID]:
-                for p in range(len(data[imgID]['predictions'])):
-                    # iterate over heuristics and take the max
-                    val = -1
-                    for h in self.heuristics:
-                        val = max(val, h(data[imgID]['predictions'][p]))
-                    data[imgID]['predictions'][p]['priority'] = val
-        return data
\ No newline at end of file
+        if len(self.criteria):
+            data = ranking.rank(data, self.criteria)
+
+        if len(self.heuristics):
+            # iterate through the images and predictions
+            for imgID in data.keys():
+                if 'predictions' in data[imgID]:
+                    for p in range(len(data[imgID]['predictions'])):
+                        # iterate over heuristics and take the max
+                        val = (data[imgID]['predictions'][p].get('priority', None) if len(self.criteria) else None)
+                        if val is None:
+                            val = -1
+                        for h in self.heuristics:
+                            val = max(val, h(data[imgID]['predictions'][p]))
+                        data[imgID]['predictions'][p]['priority'] = val
+        return data
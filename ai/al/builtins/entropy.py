@@ -0,0 +1,21 @@
+'''
+    Returns the (normalized) Shannon entropy of the class confidences as a
+    'priority' score.
+
+    2021 Benjamin Kellenberger
+'''
+
+from ai.al.functional.noarch.functional import entropy
+from ai.al.functional.noarch import ranking
+
+class Entropy:
+
+    # accepts predictions as a "util.predictionChunk.PredictionChunk"
+    supportsPredictionChunk = True
+
+    def __init__(self, project, config, dbConnector, fileServer, options):
+        pass
+
+    
+    def rank(self, data, updateStateFun, **kwargs):
+        return ranking.rank(data, [entropy])
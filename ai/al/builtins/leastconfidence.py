@@ -0,0 +1,21 @@
+'''
+    Returns one minus the maximum confidence value as a 'priority' score,
+    i.e. prioritizes predictions the model is the least certain about.
+
+    2021 Benjamin Kellenberger
+'''
+
+from ai.al.functional.noarch.functional import least_confidence
+from ai.al.functional.noarch import ranking
+
+class LeastConfidence:
+
+    # accepts predictions as a "util.predictionChunk.PredictionChunk"
+    supportsPredictionChunk = True
+
+    def __init__(self, project, config, dbConnector, fileServer, options):
+        pass
+
+    
+    def rank(self, data, updateStateFun, **kwargs):
+        return ranking.rank(data, [least_confidence])
@@ -1,30 +1,71 @@
 '''
     Helper snippets for built-in AL heuristics on computing the priority score.
 
-    2019-20 Benjamin Kellenberger
+    The vectorized criteria ("breaking_ties", "max_confidence", etc.) receive
+    a NumPy array of class confidences and reduce it along the class axis, so
+    that the priorities of many predictions (stacked as an N x C array) or of
+    all pixels of a segmentation mask (C x H x W) are computed at once. Higher
+    values denote predictions that should be reviewed first.
+
+    2019-21 Benjamin Kellenberger
 '''
 
 import numpy as np
 
 
-def _breaking_ties(prediction):
+def breaking_ties(logits, axis=-1):
     '''
         Computes the Breaking Ties heuristic
         (Luo et al. 2005: "Active Learning to Recognize Multiple Types of Plankton." JMLR 6, 589-613.)
+        as one minus the difference between the highest and second-highest
+        confidence. Only the top two values are located (through a partial
+        sort). With a single class, the second-highest value is zero.
+    '''
+    if logits.shape[axis] < 2:
+        return 1 - np.take(logits, 0, axis)
+    logits = np.partition(logits, -2, axis)
+    return 1 - (np.take(logits, -1, axis) - np.take(logits, -2, axis))
+
+
+def max_confidence(logits, axis=-1):
+    '''
+        Returns the maximum confidence value.
+    '''
+    return np.max(logits, axis)
+
+
+def least_confidence(logits, axis=-1):
+    '''
+        Returns one minus the maximum confidence value, i.e. prioritizes the
+        predictions the model is the least certain about.
+    '''
+    return 1 - np.max(logits, axis)
+
 
+def entropy(logits, axis=-1):
+    '''
+        Returns the Shannon entropy of the confidences, normalized to [0, 1]
+        by the maximum entropy for the given number of classes. Confidences
+        that do not sum up to one (e.g. from sigmoid outputs) are normalized
+        first.
+    '''
+    numClasses = logits.shape[axis]
+    if numClasses < 2:
+        return np.zeros(np.delete(logits.shape, axis), dtype=logits.dtype)
+    probs = np.clip(logits, 1e-12, None)
+    probs = probs / np.sum(probs, axis, keepdims=True)
+    return -np.sum(probs * np.log(probs), axis) / np.log(numClasses)
+
+
+def _breaking_ties(prediction):
+    '''
+        Computes the Breaking Ties heuristic for a single prediction dict.
         In case of segmentation masks, the average BT value is returned.
     '''
     btVal = None
     if 'logits' in prediction:
-        logits = np.array(prediction['logits'].copy())
-
-        if logits.ndim == 3:
-            # spatial prediction
-            logits = np.sort(logits, 0)
-            btVal = 1 - np.mean(logits[-1,...] - logits[-2,...])
-        else:
-            logits = np.sort(logits)
-            btVal = 1 - (logits[-1] - logits[-2])
+        logits = np.asarray(prediction['logits'], dtype=np.float32)
+        btVal = float(np.mean(breaking_ties(logits, 0)))
     return btVal
 
 
@@ -34,4 +75,4 @@ def _max_confidence(prediction):
     '''
     if 'logits' in prediction:
         return max(prediction['logits'])
-    return None
\ No newline at end of file
+    return None
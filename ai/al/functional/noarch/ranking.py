@@ -0,0 +1,70 @@
+'''
+    Vectorized ranking engine for the built-in AL criteria.
+    Instead of converting and sorting the logits of each prediction one by
+    one, the logits of all predictions of an inference chunk are stacked
+    into one array per number of classes and the criteria are evaluated
+    on it at once. Priorities are then written back to the predictions.
+    Segmentation masks (C x H x W logits) are evaluated per image, and the
+    priority is averaged over all pixels.
+    Predictions may either be provided in the legacy dict format or as a
+    "util.predictionChunk.PredictionChunk", whose stacked logits are used
+    directly.
+
+    2021 Benjamin Kellenberger
+'''
+
+import numpy as np
+from util.predictionChunk import PredictionChunk
+
+
+def _is_spatial(logits):
+    if isinstance(logits, np.ndarray):
+        return logits.ndim > 1
+    return len(logits) > 0 and isinstance(logits[0], (list, tuple, np.ndarray))
+
+
+def rank(data, criteria):
+    '''
+        Computes priority values for all predictions in "data" (Prediction-
+        Chunk or dict of image IDs and their predictions, as returned by a
+        model's inference function) and stores them under key "priority" in
+        each prediction.
+        "criteria" is a list of vectorized criteria (see "functional") that
+        receive an array and the class axis; if multiple criteria are given,
+        the maximum value over all of them is used.
+        Predictions without logits are left untouched. Returns "data".
+    '''
+    def _evaluate(logits, axis):
+        values = criteria[0](logits, axis)
+        for c in criteria[1:]:
+            values = np.maximum(values, c(logits, axis))
+        return values
+
+    if isinstance(data, PredictionChunk):
+        if data.logits is not None:
+            data.set_column('priority', _evaluate(data.logits, 1))
+        for mask in data.masks:
+            if mask['logits'] is not None:
+                mask['priority'] = float(np.mean(_evaluate(mask['logits'], 0)))
+        return data
+
+    groups = {}     # number of classes: (predictions, logits)
+    for imgID in data.keys():
+        for prediction in data[imgID].get('predictions', []):
+            logits = prediction.get('logits', None)
+            if logits is None or not len(logits):
+                continue
+            if _is_spatial(logits):
+                # segmentation mask: average over pixels
+                logits = np.asarray(logits, dtype=np.float32)
+                prediction['priority'] = float(np.mean(_evaluate(logits, 0)))
+            else:
+                group = groups.setdefault(len(logits), ([], []))
+                group[0].append(prediction)
+                group[1].append(logits)
+
+    for predictions, logits in groups.values():
+        values = _evaluate(np.array(logits, dtype=np.float32), 1).tolist()
+        for p, prediction in enumerate(predictions):
+            prediction['priority'] = values[p]
+    return data
@@ -100,6 +100,128 @@ class WindowCropper:
         self.maintainAspectRatio = maintainAspectRatio
 
 
+    def _containedBoxes(self, extents, x, y):
+        '''
+            Returns a boolean mask of the boxes (given as arrays of clipped
+            left, top, right and bottom coordinates) that lie entirely inside
+            the patch with top left corner (x, y).
+        '''
+        left, top, right, bottom = extents
+        return (left >= x) * (right < (x + self.patchSize[0])) * \
+                (top >= y) * (bottom < (y + self.patchSize[1]))
+
+
+    def _windowCroppingPositions(self, bboxes, sz):
+        '''
+            Greedy search for the 'windowCropping' mode. Receives bounding
+            boxes in XYWH format (center coordinates) and the image size and
+            returns lists of the left and top coordinates of the patches.
+
+            Boxes are visited cluster by cluster (largest cluster first) and
+            in order of their distance to the cluster center. For each box not
+            yet covered, all patch positions on the search grid around it are
+            evaluated at once: the containment of the remaining boxes is tested
+            separately for the x and y offsets of the grid, so that the number
+            of boxes inside every patch (and the sum of their squared distances
+            to the patch center) is obtained through a matrix product. The
+            patch with the most boxes wins; ties are broken by the smallest
+            mean distance, then by the first position in x-major order.
+        '''
+        coordsX = []
+        coordsY = []
+
+        # box extents, clipped to the image
+        left = np.maximum(0, bboxes[:,0] - bboxes[:,2]/2)
+        top = np.maximum(0, bboxes[:,1] - bboxes[:,3]/2)
+        right = np.minimum(sz[0]-1, bboxes[:,0] + bboxes[:,2]/2)
+        bottom = np.minimum(sz[1]-1, bboxes[:,1] + bboxes[:,3]/2)
+        extents = (left, top, right, bottom)
+        centers = bboxes[:,0:2].astype(np.float64)
+
+        # keep track of boxes already covered
+        covered = np.zeros(len(bboxes), dtype=bool)
+        bboxIndices = np.arange(len(bboxes))
+
+        # identify query order by clustering the coordinates
+        numClusters = np.max([2, np.sqrt(len(bboxes))]).astype(int)
+        kmeans = KMeans(n_clusters=numClusters).fit(bboxes[:,0:2])
+        count = np.zeros(numClusters)
+        distances = np.zeros(len(bboxes))
+        for i in range(numClusters):
+            bboxes_cluster = bboxes[kmeans.labels_==i, 0:2]
+            count[i] = len(bboxes_cluster)
+            distances[kmeans.labels_==i] = np.sum((bboxes_cluster - kmeans.cluster_centers_[i, :]) ** 2, 1)
+
+        # iterate: biggest cluster, lowest distance first
+        cluOrder = np.argsort(count)
+        cluOrder = cluOrder[::-1]
+
+        for clu in cluOrder:
+            cOrder = np.argsort(distances[kmeans.labels_==clu])
+            candidates = bboxIndices[kmeans.labels_==clu]
+            for can in cOrder:
+                if covered[candidates[can]]:
+                    continue
+
+                # try patches around candidate
+                nextBBox = bboxes[candidates[can], :]
+                minX = int(max(0, np.ceil(nextBBox[0] + nextBBox[2]/2) - self.patchSize[0] + 1))
+                maxX = int(max(minX, min(sz[0] - self.patchSize[0], np.floor(nextBBox[0] - nextBBox[2]/2))))
+                minY = int(max(0, np.ceil(nextBBox[1] + nextBBox[3]/2) - self.patchSize[1] + 1))
+                maxY = int(max(minY, min(sz[1] - self.patchSize[1], np.floor(nextBBox[1] - nextBBox[3]/2))))
+
+                searchRangeX = np.arange(minX, maxX, self.searchStride[0])
+                if not len(searchRangeX) or searchRangeX[-1] != maxX:
+                    searchRangeX = np.append(searchRangeX, maxX)
+                searchRangeY = np.arange(minY, maxY, self.searchStride[1])
+                if not len(searchRangeY) or searchRangeY[-1] != maxY:
+                    searchRangeY = np.append(searchRangeY, maxY)
+
+                # only uncovered boxes that fit into at least one search window matter
+                pool = np.nonzero((~covered) * \
+                    (left >= minX) * (right < (maxX + self.patchSize[0])) * \
+                    (top >= minY) * (bottom < (maxY + self.patchSize[1])))[0]
+
+                # containment per x (resp. y) offset of the search grid
+                inX = (left[pool] >= searchRangeX[:,np.newaxis]) * \
+                        (right[pool] < (searchRangeX[:,np.newaxis] + self.patchSize[0]))
+                inY = (top[pool] >= searchRangeY[:,np.newaxis]) * \
+                        (bottom[pool] < (searchRangeY[:,np.newaxis] + self.patchSize[1]))
+                inX = inX.astype(np.float64)
+                inY = inY.astype(np.float64)
+
+                # number of boxes and sum of squared distances to the center per patch
+                distX = (centers[pool,0] - (searchRangeX[:,np.newaxis] + self.patchSize[0]/2)) ** 2
+                distY = (centers[pool,1] - (searchRangeY[:,np.newaxis] + self.patchSize[1]/2)) ** 2
+                numCandidates = np.matmul(inX, inY.T)
+                bestNumCandidates = int(np.max(numCandidates)) if numCandidates.size else 0
+
+                if bestNumCandidates > 1:
+                    meanCenterDist = (np.matmul(inX * distX, inY.T) + np.matmul(inX, (inY * distY).T)) / \
+                                        np.maximum(numCandidates, 1)
+                    meanCenterDist[numCandidates < bestNumCandidates] = np.inf
+                    argMax = np.unravel_index(np.argmin(meanCenterDist), meanCenterDist.shape)
+                    argMax = (searchRangeX[argMax[0]], searchRangeY[argMax[1]],)
+                else:
+                    # at most one box covered; position patch to center it
+                    leftX = max(0, min(sz[0] - self.patchSize[0], nextBBox[0] - self.patchSize[0]/2))
+                    topY = max(0, min(sz[1] - self.patchSize[1], nextBBox[1] - self.patchSize[1]/2))
+                    argMax = (leftX, topY)
+
+                # mark inclusive bboxes as 'covered'
+                covered += self._containedBoxes(extents, argMax[0], argMax[1])
+
+                # append coordinates
+                coordsX.append(int(argMax[0]))
+                coordsY.append(int(argMax[1]))
+
+        # sanity check
+        if not np.all(covered):
+            print('something is wrong')
+
+        return coordsX, coordsY
+
+
     def splitImageIntoPatches(self, image, bboxes, labels, logits):
         sz = image.size
 
@@ -129,8 +251,8 @@ class WindowCropper:
             maxX = sz[0] - self.patchSize[0]
             maxY = sz[1] - self.patchSize[1]
 
-            coordsX = np.append(np.arange(0, maxX, self.stride[0], dtype=np.int), maxX)
-            coordsY = np.append(np.arange(0, maxY, self.stride[1], dtype=np.int), maxY)
+            coordsX = np.append(np.arange(0, maxX, self.stride[0], dtype=int), maxX)
+            coordsY = np.append(np.arange(0, maxY, self.stride[1], dtype=int), maxY)
 
             # expand to all locations
             coordsX, coordsY = np.meshgrid(coordsX, coordsY)
@@ -138,8 +260,8 @@ class WindowCropper:
             coordsX = coordsX.ravel()
             coordsY = coordsY.ravel()
 
-            cropSizesX = np.repeat(self.patchSize[0], len(coordsX)).astype(np.int)
-            cropSizesY = np.repeat(self.patchSize[1], len(coordsY)).astype(np.int)
+            cropSizesX = np.repeat(self.patchSize[0], len(coordsX)).astype(int)
+            cropSizesY = np.repeat(self.patchSize[1], len(coordsY)).astype(int)
         
         elif self.cropMode == 'objectCentered':
             # create positions around bboxes
@@ -192,106 +314,10 @@ class WindowCropper:
                 coordsY.append(topY)
             
             else:
-                # keep track of boxes already covered
-                bboxes_covered = set()
-                bboxIndices = np.arange(len(bboxes))
-
-                # identify query order by clustering the coordinates
-                numClusters = np.max([2, np.sqrt(len(bboxes))]).astype(np.int)
-                kmeans = KMeans(n_clusters=numClusters).fit(bboxes[:,0:2])
-                count = np.zeros(numClusters)
-                distances = np.zeros(len(bboxes))
-                for i in range(numClusters):
-                    bboxes_cluster = bboxes[kmeans.labels_==i, 0:2]
-                    count[i] = len(bboxes_cluster)
-                    distances[kmeans.labels_==i] = np.sum((bboxes_cluster - kmeans.cluster_centers_[i, :]) ** 2, 1)
-
-                # iterate: biggest cluster, lowest distance first
-                cluOrder = np.argsort(count)
-                cluOrder = cluOrder[::-1]
-
-                for clu in cluOrder:
-                    cOrder = np.argsort(distances[kmeans.labels_==clu])
-                    candidates = bboxIndices[kmeans.labels_==clu]
-                    for can in cOrder:
-                        if candidates[can] in bboxes_covered:
-                            continue
-                        
-                        # try patches around candidate
-                        nextBBox = bboxes[candidates[can], :]
-                        minX = int(max(0, np.ceil(nextBBox[0] + nextBBox[2]/2) - self.patchSize[0] + 1))
-                        maxX = int(max(minX, min(sz[0] - self.patchSize[0], np.floor(nextBBox[0] - nextBBox[2]/2))))
-                        minY = int(max(0, np.ceil(nextBBox[1] + nextBBox[3]/2) - self.patchSize[1] + 1))
-                        maxY = int(max(minY, min(sz[1] - self.patchSize[1], np.floor(nextBBox[1] - nextBBox[3]/2))))
-                        bestNumCandidates = 0
-                        argMax = (-1, -1,)
-                        bestMeanCenterDist = 0      # average distance of included bboxes to patch center
-
-                        searchRangeX = np.arange(minX, maxX, self.searchStride[0])
-                        if not len(searchRangeX) or searchRangeX[-1] != maxX:
-                            searchRangeX = np.append(searchRangeX, maxX)
-                        searchRangeY = np.arange(minY, maxY, self.searchStride[1])
-                        if not len(searchRangeY) or searchRangeY[-1] != maxY:
-                            searchRangeY = np.append(searchRangeY, maxY)
-
-                        for x in searchRangeX:
-                            for y in searchRangeY:
-                                numCandidates = 0
-                                meanCenterDist = 0
-                                for b in bboxIndices:
-                                    if b in bboxes_covered:
-                                        # we only care about uncovered bboxes
-                                        continue
-
-                                    if max(0, bboxes[b, 0] - bboxes[b, 2]/2) >= x and \
-                                        min(sz[0]-1, bboxes[b, 0] + bboxes[b, 2]/2) < (x + self.patchSize[0]) and \
-                                        max(0, bboxes[b, 1] - bboxes[b, 3]/2) >= y and \
-                                        min(sz[1]-1, bboxes[b, 1] + bboxes[b, 3]/2) < (y + self.patchSize[1]):
-                                        # bbox inside area; add
-                                        numCandidates += 1
-                                        meanCenterDist += np.sum((bboxes[b, 0:2] - [x + self.patchSize[0]/2, y + self.patchSize[1]/2]) ** 2)
-
-                                meanCenterDist /= float(numCandidates)
-                                if numCandidates > bestNumCandidates:
-                                    bestNumCandidates = numCandidates
-                                    bestMeanCenterDist = meanCenterDist
-                                    argMax = (x, y,)
-                                
-                                elif numCandidates == bestNumCandidates:
-                                    # check if positioning is better
-                                    if meanCenterDist < bestMeanCenterDist:
-                                        # update with current position
-                                        bestMeanCenterDist = meanCenterDist
-                                        argMax = (x, y,)
-
-                        if bestNumCandidates == 1:
-                            # only one box covered; re-position patch to center it
-                            leftX = max(0, min(sz[0] - self.patchSize[0], nextBBox[0] - self.patchSize[0]/2))
-                            topY = max(0, min(sz[1] - self.patchSize[1], nextBBox[1] - self.patchSize[1]/2))
-                            argMax = (leftX, topY)
-
-                        # mark inclusive bboxes as 'covered'
-                        for b in bboxIndices:
-                            if b in bboxes_covered:
-                                # we only care about uncovered bboxes
-                                continue
-                            if max(0, bboxes[b, 0] - bboxes[b, 2]/2) >= argMax[0] and \
-                                min(sz[0]-1, bboxes[b, 0] + bboxes[b, 2]/2) < (argMax[0] + self.patchSize[0]) and \
-                                max(0, bboxes[b, 1] - bboxes[b, 3]/2) >= argMax[1] and \
-                                min(sz[1]-1, bboxes[b, 1] + bboxes[b, 3]/2) < (argMax[1] + self.patchSize[1]):
-                                bboxes_covered.add(b)
-                        
-                        # append coordinates
-                        coordsX.append(int(argMax[0]))
-                        coordsY.append(int(argMax[1]))
-            
-                # sanity check
-                for b in bboxIndices:
-                    if b not in bboxes_covered:
-                        print('something is wrong')
+                coordsX, coordsY = self._windowCroppingPositions(bboxes, sz)
 
-            cropSizesX = np.repeat(self.patchSize[0], len(coordsX)).astype(np.int)
-            cropSizesY = np.repeat(self.patchSize[1], len(coordsY)).astype(np.int)
+            cropSizesX = np.repeat(self.patchSize[0], len(coordsX)).astype(int)
+            cropSizesY = np.repeat(self.patchSize[1], len(coordsY)).astype(int)
 
 
         if len(bboxes):
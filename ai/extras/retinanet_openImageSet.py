@@ -24,7 +24,8 @@ from ai.models.pytorch.boundingBoxes.retinanet import RetinaNet
 from ai.models.pytorch.functional._retinanet.model import RetinaNet as Model
 from ai.models.pytorch.functional._retinanet import encoder
 from ai.models.pytorch.functional._retinanet.utils import box_nms
-from ai.extras._functional import tensorSharding, windowCropping
+from ai.models.pytorch.functional._util import tensorSharding
+from ai.extras._functional import windowCropping
 
 
 class RetinaNet_ois(RetinaNet):
@@ -371,7 +372,7 @@ class RetinaNet_ois(RetinaNet):
 
         # also do regular inference
         print('Doing inference on existing patches...')
-        response_regular = super(RetinaNet_ois, self).inference(stateDict, data, updateStateFun)
+        response_regular = super(RetinaNet_ois, self).inference(stateDict, data, updateStateFun).to_dict()
         for key in response_regular.keys():
             response[key] = response_regular[key]
 
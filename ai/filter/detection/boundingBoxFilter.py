@@ -1,3 +1,18 @@
+'''
+    Filter that fuses overlapping bounding boxes (e.g. from multiple annotators,
+    or predictions from overlapping patches) into one box each.
+
+    Boxes of all images in the data are processed at once: boxes are grouped
+    per image (and per label class, unless "class_agnostic" is set), a pair-
+    wise IoU matrix is computed per group and boxes are clustered either into
+    connected components of the overlap graph ("grouping": "connected_
+    components") or greedily around the most confident box, as in weighted
+    box fusion ("grouping": "greedy"). The resulting boxes are then computed
+    for all clusters at once through NumPy reductions.
+
+    2019-21 Benjamin Kellenberger
+'''
+
 import numpy as np
 from ai.filter import AbstractFilter
 from util.helpers import check_args
@@ -12,102 +27,208 @@ class BoundingBoxFilter(AbstractFilter):
         defaultOptions = {
             'box_rule': 'average',          # how to generate the resulting bounding box from overlapping ones. One of {'average', 'intersection', 'union'}
             'min_iou': 0.75,                # minimum IoU between overlapping bboxes to employ filtering
-            'class_agnostic': False,        # if True, only overlapping boxes with the same class will be subject to filtering
+            'class_agnostic': False,        # if False, only overlapping boxes with the same class will be subject to filtering
             'class_assignment': 'mode',     # how to assign class label of overlapping boxes. One of {'mode', 'random'}
-            'keep_unsure': True             # if True, "unsure" bounding boxes will directly be appended without modification to output
+            'keep_unsure': True,            # if True, "unsure" bounding boxes will directly be appended without modification to output
+            'grouping': 'connected_components',     # how to cluster overlapping boxes. One of {'connected_components', 'greedy'}
+            'weighted': True                # if True, boxes are averaged with their confidence values as weights (if available)
         }
         self.options = check_args(options, defaultOptions)
 
 
-    def __box_ious(self, box_a, boxes_b):
-        leftX = np.maximum(box_a[0], boxes_b[:,0])
-        rightX = np.minimum(box_a[2], boxes_b[:,2])
-        topY = np.maximum(box_a[1], boxes_b[:,1])
-        bottomY = np.minimum(box_a[3], boxes_b[:,3])
+    @staticmethod
+    def _box_ious(boxes):
+        '''
+            Returns the pairwise IoU matrix of boxes (N x 4, in x_min, y_min,
+            x_max, y_max format).
+        '''
+        leftX = np.maximum(boxes[:,None,0], boxes[None,:,0])
+        rightX = np.minimum(boxes[:,None,2], boxes[None,:,2])
+        topY = np.maximum(boxes[:,None,1], boxes[None,:,1])
+        bottomY = np.minimum(boxes[:,None,3], boxes[None,:,3])
 
-        width = np.clip(rightX - leftX + 1, 0, 1)
-        height = np.clip(bottomY - topY + 1, 0, 1)
-        intersection = width * height
-        union = (box_a[2] - box_a[0])*(box_a[3] - box_a[1]) + \
-                (boxes_b[:,2] - boxes_b[:,0])*(boxes_b[:,3] - boxes_b[:,1]) - \
-                intersection
-        return intersection/union
+        intersection = np.clip(rightX - leftX, 0, None) * np.clip(bottomY - topY, 0, None)
+        area = (boxes[:,2] - boxes[:,0]) * (boxes[:,3] - boxes[:,1])
+        union = area[:,None] + area[None,:] - intersection
+        return intersection / np.maximum(union, 1e-12)
 
 
-    def _get_result_box(self, box_a, boxes_b, label_a, labels_b):
+    @staticmethod
+    def _connected_components(adjacency):
         '''
-            Returns the resulting bounding box based on the options (i.e., intersection,
-            union, or average), as well as the indices of the bounding boxes in 'boxes_b'
-            that were involved in it.
+            Labels the connected components of a (symmetric, boolean) adjacency
+            matrix by propagating the minimum node index along the edges until
+            convergence. Returns component indices starting at zero.
         '''
-        # convert to numpy
-        box_a = np.array(box_a)
-        boxes_b = np.array(boxes_b)
+        num = len(adjacency)
+        labels = np.arange(num)
+        while True:
+            labels_new = np.min(np.where(adjacency, labels[None,:], num), 1)
+            labels_new = labels_new[labels_new]     # pointer jumping
+            if np.array_equal(labels_new, labels):
+                break
+            labels = labels_new
+        return np.unique(labels, return_inverse=True)[1]
+
+
+    @staticmethod
+    def _greedy_clusters(adjacency, confidences):
+        '''
+            Assigns boxes to clusters around the most confident box that has
+            not yet been assigned, in decreasing order of confidence.
+        '''
+        num = len(adjacency)
+        clusters = np.full(num, -1)
+        numClusters = 0
+        for idx in np.argsort(-confidences, kind='stable'):
+            if clusters[idx] >= 0:
+                continue
+            clusters[adjacency[idx,:] * (clusters < 0)] = numClusters
+            numClusters += 1
+        return clusters
 
-        # calc. intersections and unions
-        iou = self.__box_ious(box_a, boxes_b)
 
-        # filter for valid ones
-        if self.options['class_agnostic']:
-            indices = np.where(iou >= self.options['min_iou'])
+    def _cluster(self, boxes, groups, confidences):
+        '''
+            Clusters overlapping boxes within each group (e.g. image and label
+            class). Returns a global cluster index per box.
+        '''
+        clusters = np.zeros(len(boxes), dtype=np.int64)
+        numClusters = 0
+        order = np.argsort(groups, kind='stable')
+        bounds = np.flatnonzero(np.diff(groups[order])) + 1
+        for members in np.split(order, bounds):
+            if len(members) == 1:
+                clusters[members] = numClusters
+                numClusters += 1
+                continue
+            adjacency = self._box_ious(boxes[members,:]) >= self.options['min_iou']
+            np.fill_diagonal(adjacency, True)
+            if self.options['grouping'] == 'greedy':
+                clusters_group = self._greedy_clusters(adjacency, confidences[members])
+            else:
+                clusters_group = self._connected_components(adjacency)
+            clusters[members] = clusters_group + numClusters
+            numClusters += clusters_group.max() + 1
+        return clusters, numClusters
+
+
+    def _fuse(self, boxes, labels, confidences, clusters, numClusters):
+        '''
+            Computes the resulting box, label and confidence of each cluster.
+        '''
+        counts = np.bincount(clusters, minlength=numClusters)
+        if self.options['box_rule'] == 'average':
+            weights = (confidences if self.options['weighted'] else np.ones(len(boxes)))
+            weightSum = np.bincount(clusters, weights, numClusters)
+            weightSum[weightSum <= 0] = 1
+            boxes_out = np.stack([
+                np.bincount(clusters, boxes[:,c] * weights, numClusters) / weightSum for c in range(4)
+            ], 1)
+        else:
+            order = np.argsort(clusters, kind='stable')
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            boxes_sorted = boxes[order,:]
+            minima = np.minimum.reduceat(boxes_sorted, starts, 0)
+            maxima = np.maximum.reduceat(boxes_sorted, starts, 0)
+            if self.options['box_rule'] == 'intersection':
+                boxes_out = np.concatenate((maxima[:,:2], minima[:,2:]), 1)
+                # disjoint boxes (possible in connected components): fall back to union
+                empty = np.any(boxes_out[:,:2] >= boxes_out[:,2:], 1)
+                boxes_out[empty,:] = np.concatenate((minima[empty,:2], maxima[empty,2:]), 1)
+            else:
+                boxes_out = np.concatenate((minima[:,:2], maxima[:,2:]), 1)
+
+        # label class
+        labelSet, labelIdx = np.unique(labels, return_inverse=True)
+        if self.options['class_assignment'] == 'random':
+            pick = np.random.permutation(len(labels))
+            labels_out = np.zeros(numClusters, dtype=np.int64)
+            labels_out[clusters[pick]] = labelIdx[pick]
         else:
-            indices = np.where((iou >= self.options['min_iou']) * np.array([int(l==label_a) for l in labels_b]))
+            # most frequent label; ties are broken by the summed confidence
+            votes = np.zeros((numClusters, len(labelSet)))
+            np.add.at(votes, (clusters, labelIdx), 1 + confidences / (np.sum(np.abs(confidences)) + 1))
+            labels_out = np.argmax(votes, 1)
+        labels_out = labelSet[labels_out]
 
-        # calculate resulting box
-        boxes_concat = np.concatenate([box_a[np.newaxis,:], boxes_b], 0)
-        if self.options['box_rule'] == 'average':
-            box_out = np.mean(boxes_concat, 0)
-        elif self.options['box_rule'] == 'intersection':
-            topLeft = boxes_concat.max(0)[0:2]
-            bottomRight = boxes_concat.min(0)[2:]
-            box_out = np.concatenate([topLeft, bottomRight])
-        elif self.options['box_rule'] == 'union':
-            topLeft = boxes_concat.min(0)[0:2]
-            bottomRight = boxes_concat.max(0)[2:]
-            box_out = np.concatenate([topLeft, bottomRight])
-        return box_out, indices
+        confidences_out = np.bincount(clusters, confidences, numClusters) / counts
+        return boxes_out, labels_out, confidences_out, counts
 
 
     def filter(self, data, **kwargs):
-
+        '''
+            Fuses overlapping boxes in the "annotations" and "predictions" of
+            all images in "data" (dict of image keys and dicts with annotations
+            and/or predictions; each either a list or a dict of entries with
+            "x", "y", "width", "height" and "label", and optionally "unsure"
+            and "confidence").
+            Returns a dict with the same image keys, with lists of the fused
+            entries. Boxes that do not overlap with any other box are returned
+            without modification; fused boxes are new dicts with the box, label,
+            confidence (mean of the fused boxes, if available) and the number
+            of boxes fused ("num_fused").
+        '''
         # prepare result
         data_out = {}
 
-        # iterate over images
-        for key in data.keys():
-            if not 'annotations' in data[key] or not len(data[key]['annotations']):
+        for section in ('annotations', 'predictions'):
+            # collect all bounding boxes and labels of all images
+            entries, imgKeys = [], []
+            for key in data.keys():
+                if not section in data[key]:
+                    continue
+                items = data[key][section]
+                if isinstance(items, dict):
+                    items = list(items.values())
+                data_out.setdefault(key, {})[section] = []
+                for item in items:
+                    if self.options['keep_unsure'] and item.get('unsure', False):
+                        data_out[key][section].append(item)
+                    else:
+                        entries.append(item)
+                        imgKeys.append(key)
+            if not len(entries):
                 continue
 
-            # prepare all bounding boxes and labels
-            bboxes_in = []
-            labels_in = []
-            ids_in = []
-            for annoKey in data[key]['annotations'].keys():
-                anno = data[key]['annotations'][annoKey]
-                if self.options['keep_unsure'] and 'unsure' in anno and anno['unsure']:
-                    data_out[key]['annotations'].append(anno)
-                else:
-                    bboxes_in.append([
-                        anno['x'] - anno['width']/2,
-                        anno['y'] - anno['height']/2,
-                        anno['x'] + anno['width']/2,
-                        anno['y'] + anno['height']/2
-                    ])
-                    labels_in.append(anno['label'])
-                    ids_in.append(annoKey)
-            
-            # iterate over bounding boxes
-            bboxes_out = []
-            while len(bboxes_in):
-                if len(bboxes_in) == 1:
-                    # only one box left; append directly without modification
-                    data_out[key]['annotations'].append(data[key]['annotations'][ids_in[0]])
-
-                else:
-                    # get resulting box and indices of other bounding boxes that overlap with the next one
-                    resultingBox, idx_other = self._get_result_box(bboxes_in[0], bboxes_in[1:], \
-                                                                labels_in[0], labels_in[1:])
-                    
-                    # remove all involved boxes from pool
-                    del bboxes_in[0]
-                    del bboxes_in[idx_other]    #TODO...
\ No newline at end of file
+            coords = np.array([[e['x'], e['y'], e['width'], e['height']] for e in entries], dtype=np.float64)
+            boxes = np.concatenate((coords[:,:2] - coords[:,2:]/2, coords[:,:2] + coords[:,2:]/2), 1)
+            labels = np.array([str(e['label']) for e in entries])
+            hasConfidence = all(e.get('confidence', None) is not None for e in entries)
+            confidences = (np.array([e['confidence'] for e in entries], dtype=np.float64) if hasConfidence \
+                            else np.ones(len(entries)))
+            _, imgIdx = np.unique(np.array(imgKeys, dtype=object).astype(str), return_inverse=True)
+            if self.options['class_agnostic']:
+                groups = imgIdx
+            else:
+                _, labelIdx = np.unique(labels, return_inverse=True)
+                groups = imgIdx * (labelIdx.max() + 1) + labelIdx
+
+            # cluster and fuse
+            clusters, numClusters = self._cluster(boxes, groups, confidences)
+            boxes_out, labels_out, confidences_out, counts = self._fuse(boxes, labels, confidences,
+                                                                    clusters, numClusters)
+
+            # assemble output; labels are restored in their original type
+            labelTypes = dict(zip(labels.tolist(), [e['label'] for e in entries]))
+            firstMember = np.full(numClusters, -1)
+            firstMember[clusters[::-1]] = np.arange(len(entries))[::-1]
+            for c in range(numClusters):
+                idx = firstMember[c]
+                if counts[c] == 1:
+                    data_out[imgKeys[idx]][section].append(entries[idx])
+                    continue
+                box = boxes_out[c,:].tolist()
+                fused = {
+                    'x': (box[0] + box[2]) / 2,
+                    'y': (box[1] + box[3]) / 2,
+                    'width': box[2] - box[0],
+                    'height': box[3] - box[1],
+                    'label': labelTypes[labels_out[c]],
+                    'num_fused': int(counts[c])
+                }
+                if hasConfidence:
+                    fused['confidence'] = float(confidences_out[c])
+                data_out[imgKeys[idx]][section].append(fused)
+
+        return data_out
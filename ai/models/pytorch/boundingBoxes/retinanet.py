@@ -1,7 +1,7 @@
 '''
     RetinaNet trainer for PyTorch.
 
-    2019-20 Benjamin Kellenberger
+    2019-21 Benjamin Kellenberger
 '''
 
 import io
@@ -9,6 +9,8 @@ import json
 from tqdm import tqdm
 import torch
 from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
+from torch.nn.parallel import DistributedDataParallel
 
 from ..genericPyTorchModel import GenericPyTorchModel
 from .. import parse_transforms
@@ -16,7 +18,9 @@ from .. import parse_transforms
 from ..functional._retinanet import DEFAULT_OPTIONS, collation, encoder, loss
 from ..functional._retinanet.model import RetinaNet as Model
 from ..functional.datasets.bboxDataset import BoundingBoxesDataset
+from ..functional._util.tiledInference import merge_boxes
 from util.helpers import get_class_executable
+from util.predictionChunk import PredictionChunk
 from util import optionsHelper
 
 
@@ -47,6 +51,20 @@ class RetinaNet(GenericPyTorchModel):
 
     model_class = Model
 
+    OPTIONS_SPEC = dict(GenericPyTorchModel.OPTIONS_SPEC, **{
+        'image_width': (['options', 'general', 'imageSize', 'width', 'value'], int, None),
+        'image_height': (['options', 'general', 'imageSize', 'height', 'value'], int, None),
+        'add_missing': (['options', 'general', 'labelClasses', 'add_missing', 'value'], bool, False),
+        'remove_obsolete': (['options', 'general', 'labelClasses', 'remove_obsolete', 'value'], bool, False),
+        'ignore_unsure': (['options', 'train', 'encoding', 'ignore_unsure', 'value'], bool, False),
+        'minIoU_pos': (['options', 'train', 'encoding', 'minIoU_pos', 'value'], float, 0.5),
+        'maxIoU_neg': (['options', 'train', 'encoding', 'maxIoU_neg', 'value'], float, 0.4),
+        'shuffle': (['options', 'train', 'dataLoader', 'shuffle', 'value'], bool, True),
+        'cls_thresh': (['options', 'inference', 'encoding', 'cls_thresh', 'value'], float, 0.1),
+        'nms_thresh': (['options', 'inference', 'encoding', 'nms_thresh', 'value'], float, 0.1),
+        'numPred_max': (['options', 'inference', 'encoding', 'numPred_max', 'value'], int, 128)
+    })
+
     def __init__(self, project, config, dbConnector, fileServer, options):
         super(RetinaNet, self).__init__(project, config, dbConnector, fileServer, options)
 
@@ -365,17 +383,21 @@ class RetinaNet(GenericPyTorchModel):
         '''
             Initializes a model based on the given stateDict and a data loader from the
             provided data and trains the model, taking into account the parameters speci-
-            fied in the 'options' given to the class.
+            fied in the 'options' given to the class. Trains in multiple local processes
+            if configured (see "GenericPyTorchModel.train_distributed").
             Returns a serializable state dict of the resulting model.
         '''
+        return self.train_distributed(self._train, stateDict, data, updateStateFun)
+
+
+    def _train(self, stateDict, data, updateStateFun, rank=0, worldSize=1):
         # initialize model
         model, labelclassMap = self.initializeModel(stateDict, data,
-                        optionsHelper.get_hierarchical_value(self.options, ['options', 'general', 'labelClasses', 'add_missing', 'value']),
-                        optionsHelper.get_hierarchical_value(self.options, ['options', 'general', 'labelClasses', 'remove_obsolete', 'value']))
+                        self.compiledOptions.add_missing,
+                        self.compiledOptions.remove_obsolete)
 
         # setup transform, data loader, dataset, optimizer, criterion
-        inputSize = (int(optionsHelper.get_hierarchical_value(self.options, ['options', 'general', 'imageSize', 'width', 'value'])),
-                        int(optionsHelper.get_hierarchical_value(self.options, ['options', 'general', 'imageSize', 'height', 'value'])))
+        inputSize = (self.compiledOptions.image_width, self.compiledOptions.image_height)
         
         transform = RetinaNet._init_transform_instances(
             optionsHelper.get_hierarchical_value(self.options, ['options', 'train', 'transform', 'value']),
@@ -387,18 +409,29 @@ class RetinaNet(GenericPyTorchModel):
                                     labelclassMap=labelclassMap,
                                     targetFormat='xyxy',
                                     transform=transform,
-                                    ignoreUnsure=optionsHelper.get_hierarchical_value(self.options, ['options', 'train', 'encoding', 'ignore_unsure', 'value'], fallback=False))
+                                    ignoreUnsure=self.compiledOptions.ignore_unsure,
+                                    imageCache=self.get_decoded_image_cache(transform))
 
         dataEncoder = encoder.DataEncoder(
-            minIoU_pos=optionsHelper.get_hierarchical_value(self.options, ['options', 'train', 'encoding', 'minIoU_pos', 'value'], fallback=0.5),
-            maxIoU_neg=optionsHelper.get_hierarchical_value(self.options, ['options', 'train', 'encoding', 'maxIoU_neg', 'value'], fallback=0.4)
+            minIoU_pos=self.compiledOptions.minIoU_pos,
+            maxIoU_neg=self.compiledOptions.maxIoU_neg
         )
         collator = collation.Collator(self.project, self.dbConnector, (inputSize[1], inputSize[0],), dataEncoder)
-        dataLoader = DataLoader(
-            dataset=dataset,
-            collate_fn=collator.collate_fn,
-            shuffle=optionsHelper.get_hierarchical_value(self.options, ['options', 'train', 'dataLoader', 'shuffle', 'value'], fallback=True)
-        )
+        if worldSize > 1:
+            # every process trains on its own share of the images
+            sampler = DistributedSampler(dataset, num_replicas=worldSize, rank=rank,
+                                    shuffle=self.compiledOptions.shuffle, seed=self.compiledOptions.seed)
+            dataLoader = DataLoader(
+                dataset=dataset,
+                collate_fn=collator.collate_fn,
+                sampler=sampler
+            )
+        else:
+            dataLoader = DataLoader(
+                dataset=dataset,
+                collate_fn=collator.collate_fn,
+                shuffle=self.compiledOptions.shuffle
+            )
 
         # optimizer
         optimArgs = optionsHelper.get_hierarchical_value(self.options, ['options', 'train', 'optim', 'value'], None)
@@ -419,13 +452,16 @@ class RetinaNet(GenericPyTorchModel):
 
         # train model
         device = self.get_device()
-        seed = int(optionsHelper.get_hierarchical_value(self.options, ['options', 'general', 'seed', 'value'], fallback=0))
+        seed = self.compiledOptions.seed
         torch.manual_seed(seed)
         if 'cuda' in device:
             torch.cuda.manual_seed(seed)
         model.to(device)
+        if worldSize > 1:
+            # averages gradients over all processes; parameters are broadcast from rank 0
+            model = DistributedDataParallel(model, find_unused_parameters=True)
         imgCount = 0
-        for (img, bboxes_target, labels_target, fVec, _) in tqdm(dataLoader):
+        for (img, bboxes_target, labels_target, fVec, _) in tqdm(dataLoader, disable=(rank > 0)):
             img, bboxes_target, labels_target = img.to(device), \
                                                 bboxes_target.to(device), \
                                                 labels_target.to(device)
@@ -445,11 +481,13 @@ class RetinaNet(GenericPyTorchModel):
             ]):
                 raise Exception('Model produced Inf and/or NaN values; training was aborted. Try reducing the learning rate.')
 
-            # update worker state
-            imgCount += img.size(0)
-            updateStateFun(state='PROGRESS', message='training', done=imgCount, total=len(dataLoader.dataset))
+            # update worker state (all processes progress at the same pace)
+            imgCount += img.size(0) * worldSize
+            updateStateFun(state='PROGRESS', message='training', done=min(imgCount, len(dataset)), total=len(dataset))
 
         # all done; return state dict as bytes
+        if rank > 0:
+            return None
         return self.exportModelState(model)
 
     
@@ -461,21 +499,53 @@ class RetinaNet(GenericPyTorchModel):
 
         # read state dict from bytes
         model, labelclassMap = self.initializeModel(stateDict, data)
+        model.eval()
 
         # initialize data loader, dataset, transforms
-        inputSize = (int(optionsHelper.get_hierarchical_value(self.options, ['options', 'general', 'imageSize', 'width', 'value'])),
-                        int(optionsHelper.get_hierarchical_value(self.options, ['options', 'general', 'imageSize', 'height', 'value'])))
+        inputSize = (self.compiledOptions.image_width, self.compiledOptions.image_height)
         
-        transform = RetinaNet._init_transform_instances(
-            optionsHelper.get_hierarchical_value(self.options, ['options', 'inference', 'transform', 'value']),
-            inputSize
-        )
+        transformOptions = optionsHelper.get_hierarchical_value(self.options, ['options', 'inference', 'transform', 'value'])
+        transform = RetinaNet._init_transform_instances(transformOptions, inputSize)
+
+        # sliding-window inference on full-resolution images (if enabled)
+        tiledInference = self.get_tiled_inference(inputSize, lambda tile: transform(tile)[0])
+        if tiledInference is not None:
+            return self._inference_tiled(model, stateDict, labelclassMap, data, tiledInference, inputSize, updateStateFun)
+
+        labelclassMap_inv = dict([v, k] for k, v in labelclassMap.items())
+        dataEncoder = encoder.DataEncoder(minIoU_pos=0.5, maxIoU_neg=0.4)   # IoUs don't matter for inference
+        response = PredictionChunk()
+        device = self.get_device()
+        model.to(device)
+        imgCount = 0
+        numImages = len(data['images'])
+
+        # backbone feature cache (if enabled): images with cached features only need to be
+        # passed through the heads and do not have to be loaded at all
+        featureCache = self.get_feature_cache(model.fpn, inputSize, json.dumps(transformOptions, sort_keys=True))
+        if featureCache is not None:
+            predicted = set()
+            for imgID in tqdm(featureCache.contains(data['images'].keys())):
+                features = featureCache.get(imgID)
+                if features is None:
+                    continue
+                with torch.no_grad():
+                    bboxes_pred_batch, labels_pred_batch = model([f.unsqueeze(0).to(device) for f in features], True)
+                self._add_predictions(response, bboxes_pred_batch, labels_pred_batch, [imgID],
+                                    dataEncoder, inputSize, labelclassMap_inv)
+                predicted.add(imgID)
+                imgCount += 1
+                updateStateFun(state='PROGRESS', message='predicting', done=imgCount, total=numImages)
+            
+            # load remaining images
+            data = dict(data)
+            data['images'] = dict((key, val) for key, val in data['images'].items() if key not in predicted)
         
         dataset = BoundingBoxesDataset(data=data,
                                     fileServer=self.fileServer,
                                     labelclassMap=labelclassMap,
-                                    transform=transform)
-        dataEncoder = encoder.DataEncoder(minIoU_pos=0.5, maxIoU_neg=0.4)   # IoUs don't matter for inference
+                                    transform=transform,
+                                    imageCache=self.get_decoded_image_cache(transform))
         collator = collation.Collator(self.project, self.dbConnector, (inputSize[1], inputSize[0],), dataEncoder)
         dataLoader = DataLoader(
             dataset=dataset,
@@ -483,86 +553,192 @@ class RetinaNet(GenericPyTorchModel):
             shuffle=False
         )
 
+        # compiled inference engine (if enabled); not combined with the feature cache
+        engine = None
+        if featureCache is None and len(dataset):
+            def _calibration_images(numImages):
+                images = (dataset[idx][0] for idx in range(min(numImages, len(dataset))))
+                return [img.unsqueeze(0) for img in images if img is not None]
+            engine = self.get_inference_engine(model, stateDict, _calibration_images, inputSize)
+
         # perform inference
-        response = {}
-        device = self.get_device()
-        model.to(device)
-        imgCount = 0
         for (img, _, _, fVec, imgID) in tqdm(dataLoader):
-
-            # TODO: implement feature vectors
-            # if img is not None:
-            #     dataItem = img.to(device)
-            #     isFeatureVector = False
-            # else:
-            #     dataItem = fVec.to(device)
-            #     isFeatureVector = True
             dataItem = img.to(device)
 
             with torch.no_grad():
-                bboxes_pred_batch, labels_pred_batch = model(dataItem, False)   #TODO: isFeatureVector
-                bboxes_pred_batch, labels_pred_batch, confs_pred_batch = dataEncoder.decode(bboxes_pred_batch.squeeze(0).cpu(),
-                                    labels_pred_batch.squeeze(0).cpu(),
-                                    inputSize,
-                                    cls_thresh=optionsHelper.get_hierarchical_value(self.options, ['options', 'inference', 'encoding', 'cls_thresh', 'value'], fallback=0.1),
-                                    nms_thresh=optionsHelper.get_hierarchical_value(self.options, ['options', 'inference', 'encoding', 'nms_thresh', 'value'], fallback=0.1),
-                                    numPred_max=int(optionsHelper.get_hierarchical_value(self.options, ['options', 'inference', 'encoding', 'numPred_max', 'value'], fallback=128)),
-                                    return_conf=True)
-
-                for i in range(len(imgID)):
-                    bboxes_pred = bboxes_pred_batch[i]
-                    labels_pred = labels_pred_batch[i]
-                    confs_pred = confs_pred_batch[i]
-                    if bboxes_pred.dim() == 2:
-                        bboxes_pred = bboxes_pred.unsqueeze(0)
-                        labels_pred = labels_pred.unsqueeze(0)
-                        confs_pred = confs_pred.unsqueeze(0)
-
-                    # convert bounding boxes to YOLO format
-                    predictions = []
-                    bboxes_pred_img = bboxes_pred[0,...]
-                    labels_pred_img = labels_pred[0,...]
-                    confs_pred_img = confs_pred[0,...]
-                    if len(bboxes_pred_img):
-                        bboxes_pred_img[:,2] -= bboxes_pred_img[:,0]
-                        bboxes_pred_img[:,3] -= bboxes_pred_img[:,1]
-                        bboxes_pred_img[:,0] += bboxes_pred_img[:,2]/2
-                        bboxes_pred_img[:,1] += bboxes_pred_img[:,3]/2
-                        bboxes_pred_img[:,0] /= inputSize[0]
-                        bboxes_pred_img[:,1] /= inputSize[1]
-                        bboxes_pred_img[:,2] /= inputSize[0]
-                        bboxes_pred_img[:,3] /= inputSize[1]
-
-                        # limit to image bounds
-                        bboxes_pred_img = torch.clamp(bboxes_pred_img, 0, 1)
-
-
-                        # append to dict
-                        for b in range(bboxes_pred_img.size(0)):
-                            bbox = bboxes_pred_img[b,:]
-                            label = labels_pred_img[b]
-                            logits = confs_pred_img[b,:]
-                            predictions.append({
-                                'x': bbox[0].item(),
-                                'y': bbox[1].item(),
-                                'width': bbox[2].item(),
-                                'height': bbox[3].item(),
-                                'label': dataset.labelclassMap_inv[label.item()],
-                                'logits': logits.numpy().tolist(),        #TODO: for AL criterion?
-                                'confidence': torch.max(logits).item()
-                            })
-                    
-                    response[imgID[i]] = {
-                        'predictions': predictions,
-                        #TODO: exception if fVec is not torch tensor: 'fVec': io.BytesIO(fVec.numpy().astype(np.float32)).getvalue()
-                    }
+                if engine is not None:
+                    bboxes_pred_batch, labels_pred_batch = engine(dataItem)
+                elif featureCache is None:
+                    bboxes_pred_batch, labels_pred_batch = model(dataItem, False)
+                else:
+                    features = model.fpn(dataItem)
+                    for i in range(len(imgID)):
+                        featureCache.put(imgID[i], [f[i,...] for f in features])
+                    bboxes_pred_batch, labels_pred_batch = model(features, True)
+            self._add_predictions(response, bboxes_pred_batch, labels_pred_batch, imgID,
+                                dataEncoder, inputSize, labelclassMap_inv)
 
             # update worker state
             imgCount += len(imgID)
-            updateStateFun(state='PROGRESS', message='predicting', done=imgCount, total=len(dataLoader.dataset))
+            updateStateFun(state='PROGRESS', message='predicting', done=imgCount, total=numImages)
+
+        if featureCache is not None:
+            featureCache.prune()
+
+        model.cpu()
+        if 'cuda' in device:
+            torch.cuda.empty_cache()
+
+        return response
+
+
+    def _add_predictions(self, response, bboxes_pred_batch, labels_pred_batch, imgIDs, dataEncoder, inputSize, labelclassMap_inv):
+        '''
+            Decodes a batch of model outputs and adds the resulting bounding
+            boxes (in YOLO format) to the "response" PredictionChunk.
+        '''
+        bboxes_pred_batch, labels_pred_batch, confs_pred_batch = dataEncoder.decode(bboxes_pred_batch.squeeze(0).cpu(),
+                            labels_pred_batch.squeeze(0).cpu(),
+                            inputSize,
+                            cls_thresh=self.compiledOptions.cls_thresh,
+                            nms_thresh=self.compiledOptions.nms_thresh,
+                            numPred_max=self.compiledOptions.numPred_max,
+                            return_conf=True)
+
+        for i in range(len(imgIDs)):
+            bboxes_pred = bboxes_pred_batch[i]
+            labels_pred = labels_pred_batch[i]
+            confs_pred = confs_pred_batch[i]
+            if bboxes_pred.dim() == 2:
+                bboxes_pred = bboxes_pred.unsqueeze(0)
+                labels_pred = labels_pred.unsqueeze(0)
+                confs_pred = confs_pred.unsqueeze(0)
+
+            # convert bounding boxes to YOLO format
+            bboxes_pred_img = bboxes_pred[0,...]
+            labels_pred_img = labels_pred[0,...]
+            confs_pred_img = confs_pred[0,...]
+            if len(bboxes_pred_img):
+                bboxes_pred_img[:,2] -= bboxes_pred_img[:,0]
+                bboxes_pred_img[:,3] -= bboxes_pred_img[:,1]
+                bboxes_pred_img[:,0] += bboxes_pred_img[:,2]/2
+                bboxes_pred_img[:,1] += bboxes_pred_img[:,3]/2
+                bboxes_pred_img[:,0] /= inputSize[0]
+                bboxes_pred_img[:,1] /= inputSize[1]
+                bboxes_pred_img[:,2] /= inputSize[0]
+                bboxes_pred_img[:,3] /= inputSize[1]
+
+                # limit to image bounds
+                bboxes_pred_img = torch.clamp(bboxes_pred_img, 0, 1)
+
+                # append to chunk
+                response.add(imgIDs[i],
+                    logits=confs_pred_img,
+                    label=[labelclassMap_inv[l] for l in labels_pred_img.view(-1).tolist()],
+                    confidence=torch.max(confs_pred_img, 1)[0],
+                    x=bboxes_pred_img[:,0],
+                    y=bboxes_pred_img[:,1],
+                    width=bboxes_pred_img[:,2],
+                    height=bboxes_pred_img[:,3])
+
+
+    def _inference_tiled(self, model, stateDict, labelclassMap, data, tiledInference, inputSize, updateStateFun):
+        '''
+            Predicts bounding boxes in tiles of the images at full resolution
+            (see "ai.models.pytorch.functional._util.tiledInference") instead
+            of resizing the images to the model's input size. Predictions are
+            merged across (overlapping) tiles through non-maximum suppression.
+        '''
+        labelclassMap_inv = dict([v, k] for k, v in labelclassMap.items())
+        dataEncoder = encoder.DataEncoder(minIoU_pos=0.5, maxIoU_neg=0.4)   # IoUs don't matter for inference
+        cls_thresh = self.compiledOptions.cls_thresh
+        nms_thresh = self.compiledOptions.nms_thresh
+        numPred_max = self.compiledOptions.numPred_max
+
+        response = PredictionChunk()
+        device = self.get_device()
+        model.to(device)
+        imgCount = 0
+        if hasattr(self.fileServer, 'prefetch'):
+            self.fileServer.prefetch([data['images'][imgID]['filename'] for imgID in data['images']])
+
+        # compiled inference engine (if enabled), calibrated on the tiles of the first images
+        def _calibration_tiles(numTiles):
+            tiles = []
+            for imgID in data['images']:
+                try:
+                    imageData = self.fileServer.getFile(data['images'][imgID]['filename'])
+                    for batch, _, _ in tiledInference.tiles(imageData):
+                        tiles.extend(tile.unsqueeze(0) for tile in batch)
+                        if len(tiles) >= numTiles:
+                            return tiles[:numTiles]
+                except:
+                    continue
+            return tiles
+        engine = self.get_inference_engine(model, stateDict, _calibration_tiles, inputSize)
+        if engine is None:
+            engine = lambda tiles: model(tiles, False)
+
+        for imgID in tqdm(data['images']):
+            imagePath = data['images'][imgID]['filename']
+            try:
+                imageData = self.fileServer.getFile(imagePath)
+                imageSize = tiledInference.image_size(imageData)
+            except:
+                print('WARNING: Image {} is corrupt and could not be loaded.'.format(imagePath))
+                imgCount += 1
+                continue
+
+            bboxes_img, labels_img, confs_img = [], [], []
+            for tiles, coords, sizes in tiledInference.tiles(imageData):
+                with torch.no_grad():
+                    bboxes_pred_batch, labels_pred_batch = engine(tiles.to(device))
+                    bboxes_pred_batch, labels_pred_batch, confs_pred_batch = dataEncoder.decode(bboxes_pred_batch.cpu(),
+                                        labels_pred_batch.cpu(),
+                                        inputSize,
+                                        cls_thresh=cls_thresh,
+                                        nms_thresh=nms_thresh,
+                                        numPred_max=numPred_max,
+                                        return_conf=True)
+
+                for t in range(len(coords)):
+                    bboxes_pred = bboxes_pred_batch[t].view(-1,4)
+                    if not len(bboxes_pred):
+                        continue
+
+                    # convert to absolute image coordinates
+                    scale = torch.tensor([sizes[t][0] / inputSize[0], sizes[t][1] / inputSize[1]]).repeat(2)
+                    offset = torch.tensor(coords[t], dtype=torch.float).repeat(2)
+                    bboxes_img.append(bboxes_pred * scale + offset)
+                    labels_img.append(labels_pred_batch[t].view(-1))
+                    confs_img.append(confs_pred_batch[t].view(len(bboxes_pred), -1))
+
+            # merge predictions across tiles and convert them to YOLO format
+            if len(bboxes_img):
+                bboxes_img, labels_img, confs_img = merge_boxes(torch.cat(bboxes_img, 0),
+                                torch.cat(labels_img, 0), torch.cat(confs_img, 0), nms_thresh)
+                bboxes_img[:,2] -= bboxes_img[:,0]
+                bboxes_img[:,3] -= bboxes_img[:,1]
+                bboxes_img[:,0] += bboxes_img[:,2]/2
+                bboxes_img[:,1] += bboxes_img[:,3]/2
+                bboxes_img /= torch.tensor([imageSize[0], imageSize[1]], dtype=torch.float).repeat(2)
+                bboxes_img = torch.clamp(bboxes_img, 0, 1)
+
+                response.add(imgID,
+                    logits=confs_img,
+                    label=[labelclassMap_inv[l] for l in labels_img.tolist()],
+                    confidence=torch.max(confs_img, 1)[0],
+                    x=bboxes_img[:,0],
+                    y=bboxes_img[:,1],
+                    width=bboxes_img[:,2],
+                    height=bboxes_img[:,3])
+
+            # update worker state
+            imgCount += 1
+            updateStateFun(state='PROGRESS', message='predicting', done=imgCount, total=len(data['images']))
 
         model.cpu()
         if 'cuda' in device:
             torch.cuda.empty_cache()
 
-        return response
\ No newline at end of file
+        return response
@@ -21,6 +21,33 @@ DEFAULT_OPTIONS = {
 				"description": "Requires a <a href=\"https://developer.nvidia.com/cuda-zone\" target=\"_blank\">CUDA-enabled</a> graphics card."
 			}
 		},
+		"inference_runtime": {
+			"eager": {
+				"name": "PyTorch (eager)",
+				"description": "Run the model as is."
+			},
+			"torchscript": {
+				"name": "TorchScript",
+				"description": "Compile the model to a frozen TorchScript module once per model state. CPU only."
+			},
+			"onnx": {
+				"name": "ONNX Runtime",
+				"description": "Export the model to ONNX and run it with ONNX Runtime (requires the \"onnxruntime\" package on the AIWorkers). CPU only."
+			}
+		},
+		"quantization": {
+			"none": {
+				"name": "None (32-bit float)"
+			},
+			"dynamic": {
+				"name": "Dynamic (8-bit integer weights)",
+				"description": "Weights are quantized to 8-bit integers, activations on the fly. With TorchScript, only linear and recurrent layers are quantized."
+			},
+			"static": {
+				"name": "Static (8-bit integer weights and activations)",
+				"description": "Weights and activations are quantized with value ranges observed on calibration images."
+			}
+		},
 		"backbone": {
 			"resnet18": {
 				"name": "ResNet-18"
@@ -751,6 +778,48 @@ DEFAULT_OPTIONS = {
 						"slider": True
 					}
 				}
+			},
+			"tiling": {
+				"name": "Tiled inference",
+				"enabled": {
+					"name": "Predict in tiles of full-resolution images",
+					"description": "If checked, images are not resized to the model's input size for prediction, but split into tiles of the input size that are predicted separately. Predictions are merged across tiles through non-maximum suppression. Useful for large images with small objects.",
+					"value": False
+				},
+				"stride": {
+					"name": "Tile stride",
+					"description": "Distance between neighboring tiles, relative to the tile size. Values below one result in overlapping tiles.",
+					"min": 0.1,
+					"max": 1.0,
+					"value": 0.75,
+					"style": {
+						"slider": True
+					}
+				}
+			},
+			"engine": {
+				"name": "Inference engine",
+				"description": "Compiled engines are only used for prediction on the CPU and are cached per model state. Upon compilation, the engine's outputs are compared to the ones of the original model on the calibration images (see AIWorker log).",
+				"runtime": {
+					"name": "Runtime",
+					"type": "select",
+					"options": "inference_runtime",
+					"value": "eager"
+				},
+				"quantization": {
+					"name": "Quantization",
+					"type": "select",
+					"options": "quantization",
+					"value": "none"
+				},
+				"num_calibration_images": {
+					"name": "Number of calibration images",
+					"description": "Number of images to calibrate static quantization with and to compare the engine to the original model.",
+					"type": "int",
+					"min": 1,
+					"max": 1000,
+					"value": 16
+				}
 			}
 		}
 	}
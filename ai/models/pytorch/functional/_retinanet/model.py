@@ -75,8 +75,8 @@ class FPN(nn.Module):
 
         So we choose bilinear upsample which supports arbitrary output sizes.
         '''
-        _,_,H,W = y.size()
-        return F.interpolate(x, size=(H,W), mode='bilinear', align_corners=True) + y
+        # size taken from the shape (not unpacked) to keep the FPN traceable for quantization
+        return F.interpolate(x, size=y.shape[-2:], mode='bilinear', align_corners=True) + y
 
 
     def forward(self, x):
@@ -295,8 +295,8 @@ class RetinaNet(nn.Module):
         for fm in fms:
             loc_pred = self.loc_head(fm)
             cls_pred = self.cls_head(fm)
-            loc_pred = loc_pred.permute(0,2,3,1).contiguous().view(x.size(0),-1,4)
-            cls_pred = cls_pred.permute(0,2,3,1).contiguous().view(x.size(0),-1,self.numClasses)
+            loc_pred = loc_pred.permute(0,2,3,1).contiguous().view(fm.size(0),-1,4)
+            cls_pred = cls_pred.permute(0,2,3,1).contiguous().view(fm.size(0),-1,self.numClasses)
             loc_preds.append(loc_pred)
             cls_preds.append(cls_pred)
         return torch.cat(loc_preds,1), torch.cat(cls_preds,1)
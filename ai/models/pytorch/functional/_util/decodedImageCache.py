@@ -0,0 +1,199 @@
+'''
+    Disk cache for decoded and resized images. Decoding (large) JPEGs and
+    resizing them to the model's input size often dominates the CPU time of
+    data loading, and is repeated in every epoch for the same images. This
+    cache instead stores the result of the (deterministic) "Resize" trans-
+    form at the beginning of a dataset's transforms as an uncompressed uint8
+    array per image. Arrays are read through memory maps, so that they are
+    shared through the OS' page cache among the data loader workers and
+    AIWorker tasks of the same host. All other (random) transforms are still
+    applied on the cached image; the "Resize" transform then does nothing,
+    as the image already has the target size.
+
+    Arrays are stored under <cacheDir>/<project>/<resize signature>/, one file
+    per image, with the version of the image file (see "FileServer.getFile-
+    Version") and its original size encoded in the file name. Images that
+    have been replaced (e.g. uploaded again with "replaceExisting") are hence
+    decoded anew. The total size of the cache is bounded; least recently used
+    files are evicted first.
+
+    2021 Benjamin Kellenberger
+'''
+
+import os
+import hashlib
+from io import BytesIO
+import numpy as np
+from PIL import Image
+
+
+class DecodedImageCache:
+
+    def __init__(self, cacheDir, project, resize, maxSize):
+        '''
+            - cacheDir:     root directory of the cache (with one sub-direc-
+                            tory per project).
+            - project:      project shortname.
+            - resize:       the "Resize" transform instance (see "get_
+                            resize") whose results are cached.
+            - maxSize:      maximum total size of the cache (all projects)
+                            in bytes.
+        '''
+        self.cacheDir = cacheDir
+        self.resize = resize
+        self.maxSize = maxSize
+        signature = hashlib.sha1('{}_{}_{}'.format(type(resize).__name__,
+                        getattr(resize, 'size', None), getattr(resize, 'interpolation', None)).encode('utf-8')).hexdigest()
+        self.imageDir = os.path.join(cacheDir, project, signature)
+        os.makedirs(self.imageDir, exist_ok=True)
+
+        # index of cached images (file name hash: (file version hash, original image size))
+        self.index = {}
+        for fileName in os.listdir(self.imageDir):
+            tokens = fileName.split('.')
+            if len(tokens) == 4 and tokens[3] == 'npy':
+                self.index[tokens[0]] = (tokens[1], tuple(int(t) for t in tokens[2].split('x')))
+
+        # running estimate of the cache size; only walk the directory when exceeded
+        self._size = None
+
+
+    @staticmethod
+    def get_resize(transform):
+        '''
+            Returns the first transform of a "Compose" transform (of any of
+            the built-in types or torchvision) if it is a "Resize" transform,
+            else None. Only the results of such a transform can be cached.
+        '''
+        transforms = getattr(transform, 'transforms', None)
+        if transforms is None or not len(transforms):
+            return None
+        first = transforms[0]
+        if type(first).__name__ == 'Resize' and hasattr(first, 'size'):
+            return first
+        return None
+
+
+    @staticmethod
+    def _hash(value):
+        return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+
+    def contains(self, imagePath):
+        '''
+            Returns True if any version of the image is in the cache (without
+            checking whether it is still up-to-date).
+        '''
+        return self._hash(imagePath) in self.index
+
+
+    def _file_path(self, key, version, imageSize):
+        return os.path.join(self.imageDir, '{}.{}.{}x{}.npy'.format(key, version, imageSize[0], imageSize[1]))
+
+
+    def load(self, fileServer, imagePath):
+        '''
+            Returns the image at the given path (as a resized PIL image in RGB
+            mode) and its original size (width, height). Images not yet in
+            the cache (or whose file has changed since they were cached) are
+            loaded through the "fileServer", decoded, resized and stored.
+            Images whose version cannot be determined through the "file-
+            Server" are not cached.
+        '''
+        key = self._hash(imagePath)
+        version = None
+        if hasattr(fileServer, 'getFileVersion'):
+            version = fileServer.getFileVersion(imagePath)
+        if version is not None:
+            version = self._hash(version)
+            if key in self.index and self.index[key][0] == version:
+                imageSize = self.index[key][1]
+                filePath = self._file_path(key, version, imageSize)
+                try:
+                    img = Image.fromarray(np.array(np.load(filePath, mmap_mode='r')))
+                    os.utime(filePath)      # for LRU eviction
+                    return img, imageSize
+                except Exception:
+                    # evicted in the meantime
+                    del self.index[key]
+
+        img = Image.open(BytesIO(fileServer.getFile(imagePath))).convert('RGB')
+        imageSize = img.size
+        img = self.resize(img)
+        if isinstance(img, tuple):
+            # built-in transforms also return annotations
+            img = img[0]
+        if version is not None:
+            self.put(key, version, imageSize, np.asarray(img))
+        return img, imageSize
+
+
+    def put(self, key, version, imageSize, array):
+        filePath = self._file_path(key, version, imageSize)
+        tempPath = '{}.{}.tmp'.format(filePath, os.getpid())
+        try:
+            with open(tempPath, 'wb') as f:
+                np.save(f, array)
+            os.replace(tempPath, filePath)
+        except OSError:
+            # cache is optional; e.g. disk full
+            return
+
+        # remove outdated version of the image
+        previous = self.index.get(key, None)
+        if previous is not None and previous[0] != version:
+            try:
+                os.remove(self._file_path(key, previous[0], previous[1]))
+            except OSError:
+                pass
+        self.index[key] = (version, imageSize)
+        if self._size is None:
+            self._size = self._compute_size()
+        else:
+            self._size += array.nbytes
+        if self._size > self.maxSize:
+            self.prune()
+
+
+    def _compute_size(self):
+        size = 0
+        for root, _, fileNames in os.walk(self.cacheDir):
+            for fileName in fileNames:
+                try:
+                    size += os.path.getsize(os.path.join(root, fileName))
+                except OSError:
+                    pass
+        return size
+
+
+    def prune(self):
+        '''
+            Evicts least recently used files (of all projects and resize sig-
+            natures) until the cache is below 90% of its size limit, and
+            removes empty directories.
+        '''
+        files = []
+        for root, _, fileNames in os.walk(self.cacheDir):
+            for fileName in fileNames:
+                filePath = os.path.join(root, fileName)
+                try:
+                    stat = os.stat(filePath)
+                    files.append((stat.st_mtime, stat.st_size, filePath))
+                except OSError:
+                    pass
+        totalSize = sum(f[1] for f in files)
+        for _, size, filePath in sorted(files):
+            if totalSize <= 0.9 * self.maxSize:
+                break
+            try:
+                os.remove(filePath)
+                totalSize -= size
+            except OSError:
+                pass
+        self._size = totalSize
+        for root, dirs, fileNames in os.walk(self.cacheDir, topdown=False):
+            if root != self.cacheDir and root != self.imageDir and not len(dirs) and not len(fileNames):
+                try:
+                    os.rmdir(root)
+                except OSError:
+                    pass
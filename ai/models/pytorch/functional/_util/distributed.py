@@ -0,0 +1,121 @@
+'''
+    Synchronous data-parallel training over multiple local processes.
+
+    Launches a number of processes on the current machine that form a
+    process group (gloo backend, communicating over the loopback interface)
+    and each run the same training function on their share of the data.
+    Models are wrapped into "torch.nn.parallel.DistributedDataParallel",
+    which averages the gradients of all processes in every step, so that
+    the result is equivalent to training with a batch size multiplied by
+    the number of processes (unlike averaging the model states of separate
+    AIWorkers after an epoch).
+
+    The training function receives its rank and the number of processes as
+    keyword arguments "rank" and "worldSize". Progress updates and the
+    return value (e.g. the model state) of the process with rank 0 are sent
+    back to the calling process; the other processes are expected to return
+    None. If any of the processes fails, all of them are terminated and the
+    error is raised in the calling process.
+
+    Processes are created with the "spawn" method, so that the training
+    function (and the model instance it is bound to) must be picklable.
+    They are started through billiard (Celery's fork of multiprocessing),
+    since the standard library refuses to start children from the daemonic
+    processes of Celery's prefork pool.
+
+    2021 Benjamin Kellenberger
+'''
+
+import os
+import sys
+import queue
+import socket
+import traceback
+import billiard
+import torch
+import torch.distributed as dist
+
+
+def get_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _worker(rank, worldSize, port, numThreads, trainFun, args, resultQueue):
+    torch.set_num_threads(numThreads)
+    try:
+        dist.init_process_group('gloo', init_method=f'tcp://127.0.0.1:{port}',
+                                rank=rank, world_size=worldSize)
+
+        if rank == 0:
+            def updateStateFun(state, message, done=None, total=None):
+                resultQueue.put(('progress', (state, message, done, total)))
+        else:
+            def updateStateFun(state, message, done=None, total=None):
+                pass
+
+        result = trainFun(*args, updateStateFun=updateStateFun, rank=rank, worldSize=worldSize)
+        if rank == 0:
+            resultQueue.put(('result', result))
+        dist.destroy_process_group()
+
+    except Exception:
+        resultQueue.put(('error', (rank, traceback.format_exc())))
+        sys.exit(1)
+
+
+def run_distributed(numProcesses, trainFun, args, updateStateFun=None, pollInterval=0.5):
+    '''
+        Runs "trainFun(*args, updateStateFun, rank, worldSize)" in "numPro-
+        cesses" local processes and returns the result of rank 0. Forwards
+        the progress updates of rank 0 to "updateStateFun". The CPU threads
+        are divided evenly among the processes.
+    '''
+    ctx = billiard.get_context('spawn')
+    resultQueue = ctx.Queue()
+    port = get_free_port()
+    numThreads = max(1, (os.cpu_count() or 1) // numProcesses)
+
+    processes = []
+    for rank in range(numProcesses):
+        # not daemonic (even if the calling process is): processes may start data loader workers themselves
+        p = ctx.Process(target=_worker,
+                        args=(rank, numProcesses, port, numThreads, trainFun, args, resultQueue),
+                        daemon=False)
+        p.start()
+        processes.append(p)
+
+    try:
+        while True:
+            try:
+                msgType, payload = resultQueue.get(timeout=pollInterval)
+            except queue.Empty:
+                failed = [p for p in processes if p.exitcode not in (None, 0)]
+                if len(failed):
+                    raise Exception(f'Training process {processes.index(failed[0])} exited with code {failed[0].exitcode}.')
+                if all(p.exitcode == 0 for p in processes):
+                    raise Exception('Training processes exited without returning a result.')
+                continue
+
+            if msgType == 'progress':
+                if updateStateFun is not None:
+                    state, message, done, total = payload
+                    updateStateFun(state=state, message=message, done=done, total=total)
+            elif msgType == 'result':
+                result = payload
+                break
+            elif msgType == 'error':
+                rank, trace = payload
+                raise Exception(f'Training process {rank} failed:\n{trace}')
+
+        for p in processes:
+            p.join()
+        return result
+
+    finally:
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
+            p.join()
+        resultQueue.close()
@@ -0,0 +1,123 @@
+'''
+    Disk cache for backbone features (e.g. the feature pyramid of RetinaNet)
+    of images. Features are stored per image and per "signature", which is
+    a hash of the backbone's weights and of everything else that affects the
+    features (input size, inference transforms). As long as the backbone is
+    unchanged (e.g. after fine-tuning the heads only, or when predicting and
+    ranking again with the same model), only the heads need to be run on
+    the cached features, and the images do not even need to be loaded.
+
+    Features are stored as half-precision arrays, one file per image, under
+    <cacheDir>/<project>/<signature>/. The total size of the cache is bound-
+    ed; least recently used files are evicted first.
+
+    2021 Benjamin Kellenberger
+'''
+
+import os
+import hashlib
+import numpy as np
+import torch
+
+
+class FeatureCache:
+
+    def __init__(self, cacheDir, project, signature, maxSize):
+        '''
+            - cacheDir:     root directory of the cache (with one sub-direc-
+                            tory per project).
+            - project:      project shortname.
+            - signature:    str, identifier of the backbone (see "make_sig-
+                            nature").
+            - maxSize:      maximum total size of the cache (all projects)
+                            in bytes.
+        '''
+        self.cacheDir = cacheDir
+        self.maxSize = maxSize
+        self.featureDir = os.path.join(cacheDir, project, signature)
+        os.makedirs(self.featureDir, exist_ok=True)
+
+
+    @staticmethod
+    def make_signature(backbone, *args):
+        '''
+            Returns a hash of the weights (parameters and buffers) of a
+            backbone (torch.nn.Module) and any additional (str-convertible)
+            arguments, such as the input size.
+        '''
+        sha = hashlib.sha1()
+        for key, value in backbone.state_dict().items():
+            sha.update(key.encode('utf-8'))
+            sha.update(value.detach().cpu().contiguous().numpy().tobytes())
+        for arg in args:
+            sha.update(str(arg).encode('utf-8'))
+        return sha.hexdigest()
+
+
+    def _file_path(self, imageID):
+        return os.path.join(self.featureDir, str(imageID) + '.npz')
+
+
+    def contains(self, imageIDs):
+        '''
+            Returns the subset of image IDs for which features are cached.
+        '''
+        return [i for i in imageIDs if os.path.isfile(self._file_path(i))]
+
+
+    def get(self, imageID):
+        '''
+            Returns the cached features of an image as a list of float
+            tensors, or None if not available.
+        '''
+        filePath = self._file_path(imageID)
+        try:
+            with np.load(filePath) as arrays:
+                features = [torch.from_numpy(arrays[f'arr_{idx}'].astype(np.float32)) \
+                                for idx in range(len(arrays.files))]
+            os.utime(filePath)      # for LRU eviction
+            return features
+        except Exception:
+            return None
+
+
+    def put(self, imageID, features):
+        '''
+            Stores the features (list of tensors) of an image.
+        '''
+        filePath = self._file_path(imageID)
+        tempPath = filePath + '.tmp.npz'
+        np.savez(tempPath, *[f.detach().cpu().numpy().astype(np.float16) for f in features])
+        os.replace(tempPath, filePath)
+
+
+    def prune(self):
+        '''
+            Evicts least recently used files (of all projects and signatures)
+            until the cache is within its size limit again, and removes empty
+            directories.
+        '''
+        files = []
+        for root, _, fileNames in os.walk(self.cacheDir):
+            for fileName in fileNames:
+                filePath = os.path.join(root, fileName)
+                try:
+                    stat = os.stat(filePath)
+                    files.append((stat.st_mtime, stat.st_size, filePath))
+                except OSError:
+                    pass
+        totalSize = sum(f[1] for f in files)
+        for _, size, filePath in sorted(files):
+            if totalSize <= self.maxSize:
+                break
+            try:
+                os.remove(filePath)
+                totalSize -= size
+            except OSError:
+                pass
+        for root, dirs, fileNames in os.walk(self.cacheDir, topdown=False):
+            if root != self.cacheDir and root != self.featureDir and not len(dirs) and not len(fileNames):
+                try:
+                    os.rmdir(root)
+                except OSError:
+                    pass
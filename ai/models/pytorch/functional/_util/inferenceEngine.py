@@ -0,0 +1,334 @@
+'''
+    Compiled (and optionally quantized) inference engines for PyTorch models
+    on the CPU.
+
+    Instead of running a model in eager mode with 32-bit floats, the forward
+    pass on images is compiled once per model state into one of these run-
+    times:
+    - "torchscript":    traced and frozen TorchScript module (folds batch
+                        normalization into convolutions, removes Python
+                        overhead);
+    - "onnx":           ONNX graph run by ONNX Runtime (requires the optional
+                        "onnxruntime" package).
+    Weights (and activations) may further be quantized to 8-bit integers:
+    - "dynamic":        weights are quantized ahead of time, activations on
+                        the fly. For TorchScript, this only affects linear and
+                        recurrent layers; ONNX Runtime also quantizes convolu-
+                        tions;
+    - "static":         weights and activations are quantized with ranges ob-
+                        served on calibration images (post-training quanti-
+                        zation; FX graph mode for TorchScript).
+
+    Compiled engines are stored on disk, keyed by a hash of the model state
+    and everything else that affects the compilation, so that they are only
+    compiled once per model state and shared among all tasks and AIWorker
+    processes of a machine. The most recently used engines are also kept in
+    memory. Upon compilation, the outputs of the engine are compared to the
+    ones of the original (32-bit float) model on the calibration images; the
+    resulting report (output deltas and speedup) is stored along with the
+    engine.
+
+    2021 Benjamin Kellenberger
+'''
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import torch
+
+try:
+    import onnxruntime
+    from onnxruntime import quantization as ortQuantization
+except ImportError:
+    onnxruntime = None
+
+
+RUNTIMES = ('eager', 'torchscript', 'onnx')
+QUANTIZATIONS = ('none', 'dynamic', 'static')
+
+FILE_EXTENSIONS = {
+    'torchscript': '.pt',
+    'onnx': '.onnx'
+}
+
+
+class _ImageModel(torch.nn.Module):
+    '''
+        Exposes the forward pass of a model on images (a single tensor) for
+        tracing, quantization and export.
+    '''
+
+    def __init__(self, model):
+        super(_ImageModel, self).__init__()
+        self.model = model
+
+    def forward(self, x):
+        return self.model(x)
+
+
+
+class _TorchScriptEngine:
+
+    def __init__(self, filePath):
+        self.module = torch.jit.load(filePath, map_location='cpu')
+
+    def __call__(self, x):
+        with torch.no_grad():
+            return tuple(self.module(x.cpu()))
+
+
+
+class _ONNXEngine:
+
+    def __init__(self, filePath):
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = torch.get_num_threads()
+        self.session = onnxruntime.InferenceSession(filePath, options, providers=['CPUExecutionProvider'])
+        self.inputName = self.session.get_inputs()[0].name
+
+    def __call__(self, x):
+        outputs = self.session.run(None, {self.inputName: x.detach().cpu().numpy()})
+        return tuple(torch.from_numpy(o) for o in outputs)
+
+
+
+def _load_engine(runtime, filePath):
+    if runtime == 'torchscript':
+        return _TorchScriptEngine(filePath)
+    return _ONNXEngine(filePath)
+
+
+def make_key(stateDict, runtime, quantization, *args):
+    '''
+        Returns a hash of a model state (bytes), the runtime, the quantiza-
+        tion mode and any additional (str-convertible) arguments that affect
+        the compilation, such as the input size.
+    '''
+    sha = hashlib.sha1()
+    sha.update(stateDict)
+    for arg in (runtime, quantization, torch.__version__) + args:
+        sha.update(str(arg).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def _quantize_torch(model, quantization, calibration):
+    if quantization == 'dynamic':
+        return torch.ao.quantization.quantize_dynamic(model,
+                    {torch.nn.Linear, torch.nn.LSTM, torch.nn.GRU}, dtype=torch.qint8)
+    elif quantization == 'static':
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+        qconfigMapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+        prepared = prepare_fx(model, qconfigMapping, example_inputs=(calibration[0],))
+        with torch.no_grad():
+            for x in calibration:
+                prepared(x)
+        return convert_fx(prepared)
+    return model
+
+
+def _compile_torchscript(model, quantization, calibration, filePath):
+    model = _quantize_torch(model, quantization, calibration)
+    with torch.no_grad():
+        module = torch.jit.trace(model, (calibration[0],), check_trace=False)
+        module = torch.jit.freeze(module.eval())
+    torch.jit.save(module, filePath)
+
+
+def _export_onnx(model, example, filePath):
+    with torch.no_grad():
+        numOutputs = len(model(example))
+    outputNames = [f'output_{idx}' for idx in range(numOutputs)]
+    dynamicAxes = dict((name, {0: 'batch'}) for name in ['image'] + outputNames)
+    kwargs = {
+        'input_names': ['image'],
+        'output_names': outputNames,
+        'dynamic_axes': dynamicAxes,
+        'opset_version': 13
+    }
+    try:
+        torch.onnx.export(model, (example,), filePath, dynamo=False, **kwargs)
+    except TypeError:
+        # PyTorch versions without the "dynamo" exporter
+        torch.onnx.export(model, (example,), filePath, **kwargs)
+
+
+def _compile_onnx(model, quantization, calibration, filePath):
+    if onnxruntime is None:
+        raise Exception('Package "onnxruntime" is not installed.')
+    if quantization == 'none':
+        _export_onnx(model, calibration[0], filePath)
+        return
+
+    fp32Path = filePath + '.fp32.onnx'
+    _export_onnx(model, calibration[0], fp32Path)
+    try:
+        if quantization == 'dynamic':
+            ortQuantization.quantize_dynamic(fp32Path, filePath,
+                            weight_type=ortQuantization.QuantType.QInt8)
+        else:
+            class _CalibrationReader(ortQuantization.CalibrationDataReader):
+                def __init__(self):
+                    self.inputs = iter(calibration)
+                def get_next(self):
+                    x = next(self.inputs, None)
+                    return (None if x is None else {'image': x.numpy()})
+
+            ortQuantization.quantize_static(fp32Path, filePath, _CalibrationReader(),
+                            quant_format=ortQuantization.QuantFormat.QDQ,
+                            weight_type=ortQuantization.QuantType.QInt8)
+    finally:
+        if os.path.exists(fp32Path):
+            os.remove(fp32Path)
+
+
+def _time_per_image(fun, inputs):
+    fun(inputs[0])      # warm-up
+    tic = time.perf_counter()
+    for x in inputs:
+        fun(x)
+    return (time.perf_counter() - tic) / sum(x.size(0) for x in inputs)
+
+
+def accuracy_report(model, engine, inputs):
+    '''
+        Compares the outputs of an engine to the ones of the original model
+        (32-bit float, eager mode) on the given inputs and returns a dict
+        with the maximum, mean and relative absolute differences per output,
+        as well as the time per image of both and the resulting speedup.
+    '''
+    with torch.no_grad():
+        reference = [tuple(model(x)) for x in inputs]
+    outputs = [engine(x) for x in inputs]
+    deltas = []
+    for idx in range(len(reference[0])):
+        ref = torch.cat([r[idx].reshape(-1).float() for r in reference])
+        out = torch.cat([o[idx].reshape(-1).float() for o in outputs])
+        diff = torch.abs(out - ref)
+        deltas.append({
+            'max_abs': diff.max().item(),
+            'mean_abs': diff.mean().item(),
+            'relative': (torch.norm(out - ref) / torch.norm(ref).clamp(min=1e-12)).item()
+        })
+
+    def _eager(x):
+        with torch.no_grad():
+            return model(x)
+    timeFP32 = _time_per_image(_eager, inputs)
+    timeEngine = _time_per_image(engine, inputs)
+    return {
+        'num_images': sum(x.size(0) for x in inputs),
+        'output_deltas': deltas,
+        'time_per_image_fp32': timeFP32,
+        'time_per_image': timeEngine,
+        'speedup': timeFP32 / max(timeEngine, 1e-12)
+    }
+
+
+def format_report(report):
+    deltas = ', '.join('output {}: max {:.4g}, mean {:.4g}, rel. {:.2%}'.format(
+                    idx, d['max_abs'], d['mean_abs'], d['relative']) for idx, d in enumerate(report['output_deltas']))
+    return '{:.2f}x faster than fp32 on {} calibration image(s); deltas {}'.format(
+                    report['speedup'], report['num_images'], deltas)
+
+
+
+class InferenceEngineCache:
+
+    MAX_ENGINES = 4             # number of engines per project that are kept on disk
+    MAX_LOADED = 2              # number of engines that are kept in memory
+
+    _loaded = OrderedDict()     # file path: engine (shared within the process)
+    _lock = threading.Lock()
+
+    def __init__(self, cacheDir, project):
+        self.engineDir = os.path.join(cacheDir, project)
+        os.makedirs(self.engineDir, exist_ok=True)
+
+
+    def _remember(self, filePath, engine):
+        with self._lock:
+            self._loaded[filePath] = engine
+            while len(self._loaded) > self.MAX_LOADED:
+                self._loaded.popitem(last=False)
+        return engine
+
+
+    def _load(self, runtime, filePath):
+        with self._lock:
+            if filePath in self._loaded:
+                self._loaded.move_to_end(filePath)
+                return self._loaded[filePath]
+        return self._remember(filePath, _load_engine(runtime, filePath))
+
+
+    def _prune(self):
+        engines = {}
+        for fileName in os.listdir(self.engineDir):
+            filePath = os.path.join(self.engineDir, fileName)
+            try:
+                mtime = os.path.getmtime(filePath)
+            except OSError:
+                continue
+            key = fileName.split('.')[0]
+            engines.setdefault(key, []).append((mtime, filePath))
+        order = sorted(engines.keys(), key=lambda k: max(f[0] for f in engines[k]), reverse=True)
+        for key in order[self.MAX_ENGINES:]:
+            for _, filePath in engines[key]:
+                try:
+                    os.remove(filePath)
+                except OSError:
+                    pass
+
+
+    def get(self, model, stateDict, runtime, quantization, calibrationFun, numCalibration, *args):
+        '''
+            Returns the engine for a model (torch.nn.Module on the CPU) and its
+            state (bytes) with the given runtime and quantization, along with
+            the accuracy report of the engine. Compiles the engine if it is
+            not cached yet, with the list of input tensors returned by "cali-
+            brationFun(numCalibration)" as calibration (and example) inputs.
+        '''
+        if runtime not in FILE_EXTENSIONS:
+            raise Exception(f'Unknown inference runtime "{runtime}".')
+        if quantization not in QUANTIZATIONS:
+            raise Exception(f'Unknown quantization mode "{quantization}".')
+        if runtime == 'onnx' and onnxruntime is None:
+            raise Exception('Package "onnxruntime" is not installed.')
+
+        key = make_key(stateDict, runtime, quantization, numCalibration, *args)
+        filePath = os.path.join(self.engineDir, key + FILE_EXTENSIONS[runtime])
+        reportPath = os.path.join(self.engineDir, key + '.json')
+        if os.path.isfile(filePath) and os.path.isfile(reportPath):
+            with open(reportPath, 'r') as f:
+                report = json.load(f)
+            os.utime(filePath)
+            os.utime(reportPath)
+            return self._load(runtime, filePath), report
+
+        # compile engine
+        calibration = [x.cpu() for x in calibrationFun(numCalibration)]
+        if not len(calibration):
+            raise Exception('No calibration images available.')
+        imageModel = _ImageModel(model).cpu().eval()
+        tempPath = f'{filePath}.{os.getpid()}.tmp'
+        try:
+            if runtime == 'torchscript':
+                _compile_torchscript(imageModel, quantization, calibration, tempPath)
+            else:
+                _compile_onnx(imageModel, quantization, calibration, tempPath)
+            engine = _load_engine(runtime, tempPath)
+            report = accuracy_report(imageModel, engine, calibration)
+            os.replace(tempPath, filePath)
+        finally:
+            if os.path.exists(tempPath):
+                os.remove(tempPath)
+        with open(reportPath + '.tmp', 'w') as f:
+            json.dump(report, f)
+        os.replace(reportPath + '.tmp', reportPath)
+
+        self._prune()
+        return self._remember(filePath, engine), report
@@ -119,35 +119,62 @@ def createSplitLocations_auto(fullTensorSize,shardSize,stride='auto',tight=True)
     
     
     
+# shards with at most this many elements (per band) are split and combined
+# through indexing operations over all shards at once; for larger shards, the
+# per-shard overhead is negligible compared to copying their contents
+SMALL_SHARD_AREA = 32*32
+
+
+
+def _gridIndices(locations):
+    """
+        Returns the index of each location in the (sorted, unique) set of all
+        locations if these are evenly spaced, together with that spacing.
+        Returns None if the locations are irregular.
+    """
+    unique = np.unique(locations)
+    if len(unique) == 1:
+        return np.zeros(len(locations), dtype=int), 1
+    steps = np.diff(unique)
+    if not np.all(steps == steps[0]):
+        return None
+    return (locations - unique[0]) // steps[0], int(steps[0])
+
+
+
 def splitTensor(inputTensor,shardSize,locX,locY):
     """
         Divides an input tensor into sub-tensors at given locations.
         The locations determine the top left corners of the sub-tensors.
         If the locations exceed the input tensor's boundaries, it is
         padded with zeros.
+        Shards are extracted as views of the input tensor (without copying)
+        and only copied once into the result tensor (NxCxWxH): shards on a
+        regular grid are obtained from a strided unfolding of the input;
+        otherwise, small shards are gathered from a view of all possible
+        windows at once and larger shards are stacked from slice views.
     """
     if len(inputTensor.size())>3:
         inputTensor = torch.squeeze(inputTensor)
         
     sz = inputTensor.size()
     
-    locX = locX.long()
-    locY = locY.long()
+    locX = np.asarray(locX).astype(int).reshape(-1)
+    locY = np.asarray(locY).astype(int).reshape(-1)
     
-    startLocX = torch.min(locX)
-    startLocY = torch.min(locY)
-    endLocX = torch.max(locX) + shardSize[0]
-    endLocY = torch.max(locY) + shardSize[1]
+    startLocX = np.min(locX)
+    startLocY = np.min(locY)
+    endLocX = np.max(locX) + shardSize[0]
+    endLocY = np.max(locY) + shardSize[1]
     
     
     # pad tensor with zeros
     if startLocX<0 or startLocY<0 or endLocX>sz[1] or endLocY>sz[2]:
-        padL = int(torch.abs(startLocX))
-        padT = int(torch.abs(startLocY))
-        padR = int(endLocX - sz[1])
-        padB = int(endLocY - sz[2])
-        tensor = torch.nn.ZeroPad2d((padT,padB,padL,padR))(inputTensor.unsqueeze(0))
-        tensor = tensor.data.squeeze()
+        padL = int(max(0, -startLocX))
+        padT = int(max(0, -startLocY))
+        padR = int(max(0, endLocX - sz[1]))
+        padB = int(max(0, endLocY - sz[2]))
+        tensor = torch.nn.functional.pad(inputTensor, (padT,padB,padL,padR))
         
         # shift locations accordingly
         locX = locX + padL
@@ -155,20 +182,26 @@ def splitTensor(inputTensor,shardSize,locX,locY):
     else:
         tensor = inputTensor
     
-    
-    # crop tensor
-    if locX.dim()==2:
-        numPatches = locX.size(0)*locX.size(1)
-        locX = locX.view(-1)
-        locY = locY.view(-1)
-    else:
-        numPatches = locX.size(0)
 
-    result = torch.Tensor(numPatches,sz[0],shardSize[0],shardSize[1]).type(tensor.dtype).to(tensor.device)
-    for x in range(0,numPatches):
-        result[x,:,:,:] = tensor[:,locX[x]:locX[x]+shardSize[0],locY[x]:locY[x]+shardSize[1]]
-    
-    return result
+    gridX, gridY = _gridIndices(locX), _gridIndices(locY)
+    if gridX is not None and gridY is not None:
+        # regular grid: strided view of the shards (C x numX x numY x shardW x shardH)
+        offsetX, offsetY = np.min(locX), np.min(locY)
+        shards = tensor[:,offsetX:,offsetY:].unfold(1, shardSize[0], gridX[1]).unfold(2, shardSize[1], gridY[1])
+        shards = shards.permute(1,2,0,3,4)
+        numY = shards.size(1)
+        if np.array_equal(gridX[0] * numY + gridY[0], np.arange(shards.size(0) * numY)):
+            # locations are in row-major order of the grid
+            return shards.reshape(-1, sz[0], shardSize[0], shardSize[1])
+        return shards[torch.from_numpy(gridX[0]).to(tensor.device), torch.from_numpy(gridY[0]).to(tensor.device)]
+
+    elif shardSize[0] * shardSize[1] <= SMALL_SHARD_AREA:
+        # gather from a view of all windows (C x W' x H' x shardW x shardH)
+        windows = tensor.unfold(1, shardSize[0], 1).unfold(2, shardSize[1], 1)
+        return windows.permute(1,2,0,3,4)[torch.from_numpy(locX).to(tensor.device), torch.from_numpy(locY).to(tensor.device)]
+
+    else:
+        return torch.stack([tensor[:,x:x+shardSize[0],y:y+shardSize[1]] for x, y in zip(locX.tolist(), locY.tolist())])
 
 
 
@@ -188,18 +221,20 @@ def combineShards(shards,locX,locY,outSize,overlapRule):
         - "max": the maximum value is retained
         - "min": the minimum value is chosen
         - "sum": the sum is calculated along all overlapping patches
+        Small shards are scattered into the output (and the count map for
+        averaging) all at once; larger ones are accumulated shard by shard.
     """
     
-    locX = locX.astype(int)
-    locY = locY.astype(int)
+    locX = np.asarray(locX).astype(int).reshape(-1)
+    locY = np.asarray(locY).astype(int).reshape(-1)
     
     sz = shards.size()
     
     startLocX = np.min(locX)
     startLocY = np.min(locY)
     
-    endLocX = np.max(locX) + sz[2] + np.abs(startLocX)
-    endLocY = np.max(locY) + sz[3] + np.abs(startLocY)
+    endLocX = int(np.max(locX) + sz[2] + np.abs(startLocX))
+    endLocY = int(np.max(locY) + sz[3] + np.abs(startLocY))
     
     if startLocX<0:
         locX += np.abs(startLocX)
@@ -208,30 +243,43 @@ def combineShards(shards,locX,locY,outSize,overlapRule):
         
     
     # prepare output tensor as well as counting grid
-    out = torch.Tensor(sz[1],int(endLocX),int(endLocY))
-    out[:] = 0
-    count = torch.Tensor(1,int(endLocX),int(endLocY))
-    count[:] = 0
-    
-    # iterate over shards and restore
-    for i in range(0,sz[0]):
-        posX = int(i / locX.shape[1])
-        posY = int(i % locX.shape[1])
-        
-        coordsX = locX[posX,posY]
-        coordsY = locY[posX,posY]
-        
-        shard = shards[i,:,:,:]
-        
-        if overlapRule=='sum':
-            out[:,coordsX:coordsX+sz[2],coordsY:coordsY+sz[3]] += shard
-        elif overlapRule=='max':
-            out[:,coordsX:coordsX+sz[2],coordsY:coordsY+sz[3]] = torch.max(out[:,coordsX:coordsX+sz[2],coordsY:coordsY+sz[3]],shard)
-        elif overlapRule=='min':
-            out[:,coordsX:coordsX+sz[2],coordsY:coordsY+sz[3]] = torch.min(out[:,coordsX:coordsX+sz[2],coordsY:coordsY+sz[3]],shard)
+    out = torch.zeros(sz[1], endLocX, endLocY, dtype=shards.dtype, device=shards.device)
+    count = torch.zeros(1, endLocX, endLocY, dtype=shards.dtype, device=shards.device)
+    reduceMinMax = (overlapRule in ('max', 'min'))
+
+    if sz[2]*sz[3] <= SMALL_SHARD_AREA and (not reduceMinMax or hasattr(out, 'scatter_reduce_')):
+        # flat output indices of all shard elements (N x W x H)
+        posX = torch.from_numpy(locX).view(-1,1,1) + torch.arange(sz[2]).view(1,-1,1)
+        posY = torch.from_numpy(locY).view(-1,1,1) + torch.arange(sz[3]).view(1,1,-1)
+        index = (posX * endLocY + posY).view(-1).to(shards.device)
+        values = shards.transpose(0,1).reshape(sz[1], -1)
+
+        if reduceMinMax:
+            # the output is initialized with zeros, which take part in the comparison
+            out.view(sz[1], -1).scatter_reduce_(1, index.unsqueeze(0).expand(sz[1],-1), values,
+                    reduce=('amax' if overlapRule=='max' else 'amin'), include_self=True)
         else:
-            out[:,coordsX:coordsX+sz[2],coordsY:coordsY+sz[3]] += shard
-            count[:,coordsX:coordsX+sz[2],coordsY:coordsY+sz[3]] += 1
+            out.view(sz[1], -1).index_add_(1, index, values)
+            if overlapRule!='sum':
+                count.view(-1).index_add_(0, index, torch.ones_like(index, dtype=shards.dtype))
+    
+    else:
+        # iterate over shards and restore
+        for i in range(0,sz[0]):
+            coordsX = locX[i]
+            coordsY = locY[i]
+            
+            region = out[:,coordsX:coordsX+sz[2],coordsY:coordsY+sz[3]]
+            shard = shards[i,:,:,:]
+            
+            if overlapRule=='max':
+                torch.max(region,shard,out=region)
+            elif overlapRule=='min':
+                torch.min(region,shard,out=region)
+            else:
+                region += shard
+                if overlapRule!='sum':
+                    count[:,coordsX:coordsX+sz[2],coordsY:coordsY+sz[3]] += 1
 
     
     
@@ -244,9 +292,9 @@ def combineShards(shards,locX,locY,outSize,overlapRule):
     if outSize is not None:
         sz_out = out.size()
         if sz_out[1]!=outSize[0] or sz_out[2]!=outSize[1]:
-            overhangX = (sz_out[1] - outSize[0])/2
-            overhangY = (sz_out[2] - outSize[1])/2
+            overhangX = int((sz_out[1] - outSize[0])/2)
+            overhangY = int((sz_out[2] - outSize[1])/2)
             
-            out = out[:,overhangX:-overhangX,overhangY:-overhangY]
+            out = out[:,overhangX:overhangX+outSize[0],overhangY:overhangY+outSize[1]]
         
-    return out
\ No newline at end of file
+    return out
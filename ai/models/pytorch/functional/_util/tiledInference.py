@@ -0,0 +1,259 @@
+'''
+    Sliding-window (tiled) inference on full-resolution images.
+    Instead of resizing a whole image to the model's input size, the image
+    is cut into tiles of that size, which are passed through the model in
+    batches. The predictions of all tiles are then merged in the image's
+    coordinate system:
+    - bounding boxes:       non-maximum suppression across tiles
+    - points:               removal of duplicates (of the same class) within
+                            a given distance
+    - segmentation masks:   averaging of class probabilities in zones of
+                            overlapping tiles, one band of tile rows at a
+                            time
+
+    Tiles are read from the image one at a time (see "util.imageSharding.
+    split_image_windowed"), so that only one batch of tiles needs to be
+    kept in memory; tiled TIFFs and JPEG2000 images are not even decoded
+    in full if the optional "rasterio" package is installed.
+
+    2021 Benjamin Kellenberger
+'''
+
+import math
+from io import BytesIO
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torchvision.transforms.functional import to_tensor
+from util.imageSharding import split_image_windowed, get_image_size, get_split_positions
+from .._retinanet.utils import box_nms
+
+
+class TiledInference:
+
+    def __init__(self, tileSize, stride=None, batchSize=1, transform=None):
+        '''
+            - tileSize:     (width, height) of the tiles in pixels. Images
+                            smaller than that are predicted in one tile.
+            - stride:       spacing of the tiles; either in pixels (int or
+                            tuple of ints) or relative to the tile size
+                            (float or tuple of floats in (0, 1]). Values
+                            below the tile size produce overlapping tiles.
+                            Defaults to the tile size (no overlap, except
+                            for the last tiles at the right and bottom).
+            - batchSize:    number of tiles passed to the model at once.
+            - transform:    function that receives a PIL image (tile) and
+                            returns its (model-ready) torch.Tensor. Defaults
+                            to "ToTensor".
+        '''
+        if isinstance(tileSize, int):
+            tileSize = (tileSize, tileSize)
+        self.tileSize = (int(tileSize[0]), int(tileSize[1]))
+        if stride is None:
+            stride = self.tileSize
+        elif not isinstance(stride, (tuple, list)):
+            stride = (stride, stride)
+        self.stride = tuple(
+            max(1, int(round(stride[i] * self.tileSize[i]))) if isinstance(stride[i], float) else int(stride[i])
+            for i in range(2)
+        )
+        self.batchSize = max(1, int(batchSize))
+        self.transform = (transform if transform is not None else to_tensor)
+
+
+    @staticmethod
+    def _source(image):
+        if isinstance(image, (bytes, bytearray)):
+            return BytesIO(image)
+        return image
+
+
+    def image_size(self, image):
+        '''
+            Returns the (width, height) of an image (file path, bytes or
+            file-like object) without decoding it.
+        '''
+        return get_image_size(self._source(image))
+
+
+    def row_positions(self, imageSize):
+        '''
+            Returns the vertical positions of the rows of tiles of an image
+            of given size (width, height), in the order they are yielded by
+            "tiles".
+        '''
+        return get_split_positions(imageSize, self.tileSize, self.stride, tight=True)[2]
+
+
+    def tiles(self, image):
+        '''
+            Generator that reads an image (file path, bytes or file-like
+            object) tile by tile and yields batches as tuples of:
+            - tensor:   the transformed tiles (N x C x H x W)
+            - coords:   list of N (x, y) tuples of the tiles' top left
+                        pixel coordinates in the image
+            - sizes:    list of N (width, height) tuples of the tiles
+                        before transformation (these may be smaller than
+                        the tile size for small images)
+        '''
+        batch, coords, sizes = [], [], []
+        for tile, pos in split_image_windowed(self._source(image), self.tileSize, self.stride, tight=True):
+            if tile.mode != 'RGB':
+                tile = tile.convert('RGB')
+            batch.append(self.transform(tile))
+            coords.append(pos)
+            sizes.append(tile.size)
+            if len(batch) == self.batchSize:
+                yield torch.stack(batch), coords, sizes
+                batch, coords, sizes = [], [], []
+        if len(batch):
+            yield torch.stack(batch), coords, sizes
+
+
+
+def merge_boxes(boxes, labels, confs, nmsThresh):
+    '''
+        Merges bounding boxes predicted in (overlapping) tiles through non-
+        maximum suppression. Boxes are expected in absolute image coordinates
+        (x_min, y_min, x_max, y_max); "confs" holds the class confidences
+        (N x C). Returns the retained boxes, labels and confidences.
+    '''
+    if not len(boxes) or nmsThresh <= 0:
+        return boxes, labels, confs
+    keep = box_nms(boxes, torch.max(confs, 1)[0], threshold=nmsThresh).view(-1)
+    return boxes[keep,:], labels[keep], confs[keep,:]
+
+
+
+def merge_points(points, labels, confs, minDist):
+    '''
+        Removes duplicate points from overlapping tiles: points are visited in
+        order of decreasing confidence, and all points of the same class that
+        lie within "minDist" pixels of a retained point are discarded.
+        Points are expected in absolute image coordinates (N x 2).
+    '''
+    if not len(points) or minDist <= 0:
+        return points, labels, confs
+    order = torch.argsort(torch.max(confs, 1)[0], descending=True)
+    suppressed = torch.zeros(len(points), dtype=torch.bool)
+    keep = []
+    for idx in order.tolist():
+        if suppressed[idx]:
+            continue
+        keep.append(idx)
+        suppressed |= (labels == labels[idx]) * \
+            (torch.sum((points - points[idx,:]) ** 2, 1) <= minDist ** 2)
+    keep = torch.tensor(keep, dtype=torch.long)
+    return points[keep,:], labels[keep], confs[keep,:]
+
+
+
+class MaskBlender:
+    '''
+        Accumulates class probabilities of segmentation tiles into a label
+        map of the full image, averaging them in zones of overlapping tiles.
+        Tiles are expected row by row (as yielded by "TiledInference.tiles"),
+        so that only the band of rows covered by the current row of tiles
+        needs to be accumulated: rows above all remaining rows of tiles are
+        final and are written out as class indices (uint8). The vertical
+        positions of the rows of tiles ("rowPositions"; see "TiledInference.
+        row_positions") are required for this, as the last row may start
+        above the previous one. Without them, rows are expected in order of
+        increasing position.
+        Peak memory is hence bounded by tile height x image width x number
+        of classes, plus one byte per pixel for the label map.
+        For the AL criteria, class probabilities are additionally kept on a
+        regular grid of at most "maxLogitsPixels" pixels (every n-th row and
+        column; all pixels for smaller images).
+    '''
+    MAX_LOGITS_PIXELS = 1024 * 1024
+
+    def __init__(self, numClasses, imageSize, rowPositions=None, maxLogitsPixels=None):
+        self.numClasses = numClasses
+        self.width, self.height = int(imageSize[0]), int(imageSize[1])
+
+        # remaining rows of tiles: (vertical position, topmost position of all rows from there on)
+        self.rows = []
+        if rowPositions is not None:
+            top = self.height
+            for y in reversed(list(rowPositions)):
+                top = min(top, int(y))
+                self.rows.insert(0, (int(y), top))
+        if maxLogitsPixels is None:
+            maxLogitsPixels = self.MAX_LOGITS_PIXELS
+        self.step = max(1, int(math.ceil(math.sqrt(self.width * self.height / max(1, maxLogitsPixels)))))
+
+        self.label = np.zeros((self.height, self.width), dtype=np.uint8)
+        self.logits = np.zeros((numClasses, int(math.ceil(self.height / self.step)),
+                                int(math.ceil(self.width / self.step))), dtype=np.float32)
+
+        # accumulators for the band of rows [top, top + sum.size(1)) that is not final yet
+        self.top = 0
+        self.sum = torch.zeros(numClasses, 0, self.width)
+        self.count = torch.zeros(1, 0, self.width)
+
+
+    def _extend(self, bottom):
+        numRows = min(bottom, self.height) - self.top - self.sum.size(1)
+        if numRows > 0:
+            self.sum = torch.cat((self.sum, torch.zeros(self.numClasses, numRows, self.width)), 1)
+            self.count = torch.cat((self.count, torch.zeros(1, numRows, self.width)), 1)
+
+
+    def _flush(self, bottom):
+        '''
+            Writes out all rows above "bottom" (exclusive).
+        '''
+        bottom = min(bottom, self.height)
+        if bottom <= self.top:
+            return
+        self._extend(bottom)
+        numRows = bottom - self.top
+        probs = self.sum[:, :numRows, :] / self.count[:, :numRows, :].clamp(min=1)
+        self.label[self.top:bottom, :] = torch.argmax(probs, 0).numpy().astype(np.uint8)
+
+        # keep probabilities of every "step"-th row and column
+        first = (-self.top) % self.step
+        if first < numRows:
+            rows = probs[:, first::self.step, ::self.step].numpy()
+            start = (self.top + first) // self.step
+            self.logits[:, start:start+rows.shape[1], :] = rows
+
+        self.sum = self.sum[:, numRows:, :].clone()
+        self.count = self.count[:, numRows:, :].clone()
+        self.top = bottom
+
+
+    def add(self, probs, pos, size):
+        '''
+            Adds the class probabilities (C x h x w) of a tile with top left
+            corner "pos" and (original) "size" (width, height). Probabilities
+            are resampled to the tile size if needed.
+        '''
+        if pos[1] < self.top:
+            raise ValueError('Tiles must be added row by row.')
+        if probs.size(1) != size[1] or probs.size(2) != size[0]:
+            probs = F.interpolate(probs.unsqueeze(0), size=(size[1], size[0]), mode='bilinear', align_corners=False)[0]
+
+        # rows above the current and all remaining rows of tiles are not covered by any further tile
+        while len(self.rows) > 1 and self.rows[0][0] != pos[1]:
+            self.rows.pop(0)
+        self._flush(self.rows[0][1] if len(self.rows) else pos[1])
+
+        # tiles may exceed the image borders (zero-padded)
+        w, h = min(size[0], self.width - pos[0]), min(size[1], self.height - pos[1])
+        if w <= 0 or h <= 0:
+            return
+        self._extend(pos[1] + h)
+        y = pos[1] - self.top
+        self.sum[:, y:y+h, pos[0]:pos[0]+w] += probs[:, :h, :w].cpu()
+        self.count[:, y:y+h, pos[0]:pos[0]+w] += 1
+
+
+    def result(self):
+        '''
+            Returns the label map (H x W class indices, uint8) and the (sub-
+            sampled) class probabilities (C x h x w).
+        '''
+        self._flush(self.height)
+        return self.label, self.logits
@@ -28,6 +28,8 @@ class BoundingBoxesDataset(Dataset):
                         or 'xyxy' (top left and bottom right coordinates)
         - transform: Instance of classes defined in 'ai.models.pytorch.functional.transforms.boundingBoxes'. May be None for no transformation at all.
         - ignoreUnsure: if True, all annotations with flag 'unsure' will get a label of -1 (i.e., 'ignore')
+        - imageCache: optional "DecodedImageCache" instance for the "Resize" transform at the beginning of
+                      'transform'. If provided, decoded and resized images are loaded from (and stored in) it.
 
         The '__getitem__' function returns the data entry at given index as a tuple with the following contents:
         - img: the loaded and transformed (if specified) image.
@@ -37,15 +39,21 @@ class BoundingBoxesDataset(Dataset):
         - fVec: a torch tensor of feature vectors (if available; else None)
         - imageID: str, filename of the image loaded
     '''
-    def __init__(self, data, fileServer, labelclassMap, targetFormat='xywh', transform=None, ignoreUnsure=False):
+    def __init__(self, data, fileServer, labelclassMap, targetFormat='xywh', transform=None, ignoreUnsure=False, imageCache=None):
         super(BoundingBoxesDataset, self).__init__()
         self.fileServer = fileServer
         self.labelclassMap = labelclassMap
         self.targetFormat = targetFormat
         self.transform = transform
         self.ignoreUnsure = ignoreUnsure
+        self.imageCache = imageCache
         self.__parse_data(data)
 
+        # warm the local image cache of remote AIWorkers (if enabled)
+        if hasattr(self.fileServer, 'prefetch'):
+            self.fileServer.prefetch([d[-1] for d in self.data \
+                                        if self.imageCache is None or not self.imageCache.contains(d[-1])])
+
     
     def __parse_data(self, data):
         
@@ -123,7 +131,10 @@ class BoundingBoxesDataset(Dataset):
 
         # load image
         try:
-            img = Image.open(BytesIO(self.fileServer.getFile(imagePath))).convert('RGB')
+            if self.imageCache is not None:
+                img, _ = self.imageCache.load(self.fileServer, imagePath)
+            else:
+                img = Image.open(BytesIO(self.fileServer.getFile(imagePath))).convert('RGB')
         except:
             print('WARNING: Image {} is corrupt and could not be loaded.'.format(imagePath))
             img = None
@@ -12,14 +12,20 @@ from PIL import Image
 
 class LabelsDataset(Dataset):
 
-    def __init__(self, data, fileServer, labelclassMap, transform, ignoreUnsure=False, **kwargs):
+    def __init__(self, data, fileServer, labelclassMap, transform, ignoreUnsure=False, imageCache=None, **kwargs):
         super(LabelsDataset, self).__init__()
         self.fileServer = fileServer
         self.labelclassMap = labelclassMap
         self.transform = transform
         self.ignoreUnsure = ignoreUnsure
+        self.imageCache = imageCache
         self.__parse_data(data)
 
+        # warm the local image cache of remote AIWorkers (if enabled)
+        if hasattr(self.fileServer, 'prefetch'):
+            self.fileServer.prefetch([d[-1] for d in self.data \
+                                        if self.imageCache is None or not self.imageCache.contains(d[-1])])
+
 
     def __parse_data(self, data):
     
@@ -74,7 +80,10 @@ class LabelsDataset(Dataset):
 
         # load image
         try:
-            img = Image.open(BytesIO(self.fileServer.getFile(imagePath))).convert('RGB')
+            if self.imageCache is not None:
+                img, _ = self.imageCache.load(self.fileServer, imagePath)
+            else:
+                img = Image.open(BytesIO(self.fileServer.getFile(imagePath))).convert('RGB')
         except:
             print('WARNING: Image {} is corrupt and could not be loaded.'.format(imagePath))
             img = None
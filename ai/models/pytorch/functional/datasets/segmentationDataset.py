@@ -25,21 +25,30 @@ class SegmentationDataset(Dataset):
         - labelclassMap: a dictionary/LUT with mapping: key = label class UUID, value = index (number) according
                          to the model.
         - transform: Instance of classes defined in 'ai.models.pytorch.functional.transforms.segmentationMasks'. May be None for no transformation at all.
+        - imageCache: optional "DecodedImageCache" instance for the "Resize" transform at the beginning of
+                      'transform'. If provided, decoded and resized images are loaded from (and stored in) it.
 
         The '__getitem__' function returns the data entry at given index as a tuple with the following contents:
         - img: the loaded and transformed (if specified) image.
         - segmentationMask: the loaded and transformed (if specified) segmentation mask.
         - imageID: str, filename of the image loaded
     '''
-    def __init__(self, data, fileServer, labelclassMap, transform=None, **kwargs):
+    def __init__(self, data, fileServer, labelclassMap, transform=None, imageCache=None, **kwargs):
         super(SegmentationDataset, self).__init__()
         self.data = data
         self.fileServer = fileServer
         self.labelclassMap = labelclassMap
         self.transform = transform
+        self.imageCache = imageCache
         self.imageOrder = list(self.data['images'].keys())
         self.ignore_unlabeled = (kwargs['ignore_unlabeled'] if 'ignore_unlabeled' in kwargs else True)
 
+        # warm the local image cache of remote AIWorkers (if enabled)
+        if hasattr(self.fileServer, 'prefetch'):
+            imagePaths = [self.data['images'][i]['filename'] for i in self.imageOrder]
+            self.fileServer.prefetch([i for i in imagePaths \
+                                        if self.imageCache is None or not self.imageCache.contains(i)])
+
 
     def __len__(self):
         return len(self.imageOrder)
@@ -52,8 +61,11 @@ class SegmentationDataset(Dataset):
         # load image
         imagePath = dataDesc['filename']
         try:
-            img = Image.open(BytesIO(self.fileServer.getFile(imagePath))).convert('RGB')
-            imageSize = img.size
+            if self.imageCache is not None:
+                img, imageSize = self.imageCache.load(self.fileServer, imagePath)
+            else:
+                img = Image.open(BytesIO(self.fileServer.getFile(imagePath))).convert('RGB')
+                imageSize = img.size
         except:
             print(f'WARNING: Image "{imagePath}" is corrupt and could not be loaded.')
             img = None
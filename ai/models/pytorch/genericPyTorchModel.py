@@ -5,19 +5,45 @@
     by subclassing PyTorch implementations, such as option checks, model initiali-
     zations, model state exports, etc.
 
-    2019-20 Benjamin Kellenberger
+    2019-21 Benjamin Kellenberger
 '''
 
 import io
+import os
+import tempfile
 import torch
 from torch.optim import SGD
 from ai.models import AIModel
 from ai.models.pytorch import parse_transforms
+from ai.models.pytorch.functional._util.tiledInference import TiledInference
+from ai.models.pytorch.functional._util.featureCache import FeatureCache
+from ai.models.pytorch.functional._util.decodedImageCache import DecodedImageCache
+from ai.models.pytorch.functional._util import distributed
+from ai.models.pytorch.functional._util.inferenceEngine import InferenceEngineCache, format_report
 from util.helpers import get_class_executable, check_args
 from util import optionsHelper
 
 
 
+def _get_temp_dir(config):
+    tempDir = config.getProperty('FileServer', 'tempfiles_dir', type=str, fallback=None)
+    if tempDir is None or not len(tempDir):
+        tempDir = tempfile.gettempdir()
+    return tempDir
+
+
+def _get_decoded_image_cache(config, project, transform):
+    maxSize = config.getProperty('AIWorker', 'decoded_image_cache_size', type=float, fallback=0)
+    if maxSize <= 0:
+        return None
+    resize = DecodedImageCache.get_resize(transform)
+    if resize is None:
+        return None
+    cacheDir = os.path.join(_get_temp_dir(config), 'aide/decodedImageCache')
+    return DecodedImageCache(cacheDir, project, resize, maxSize * 1024**2)
+
+
+
 class GenericPyTorchModel(AIModel):
 
     '''
@@ -27,6 +53,19 @@ class GenericPyTorchModel(AIModel):
 
     model_class = None
 
+    # options that are resolved once upon instantiation (see "optionsHelper.compile_options");
+    # subclasses may extend this
+    OPTIONS_SPEC = {
+        'device': (['options', 'general', 'device', 'value', 'id'], str, 'cpu'),
+        'seed': (['options', 'general', 'seed', 'value'], int, 0),
+        'tiling_enabled': (['options', 'inference', 'tiling', 'enabled', 'value'], bool, False),
+        'tiling_stride': (['options', 'inference', 'tiling', 'stride', 'value'], float, 1.0),
+        'inference_batch_size': (['options', 'inference', 'dataLoader', 'batch_size', 'value'], int, 1),
+        'inference_runtime': (['options', 'inference', 'engine', 'runtime', 'value', 'id'], str, 'eager'),
+        'inference_quantization': (['options', 'inference', 'engine', 'quantization', 'value', 'id'], str, 'none'),
+        'num_calibration_images': (['options', 'inference', 'engine', 'num_calibration_images', 'value'], int, 16)
+    }
+
     def __init__(self, project, config, dbConnector, fileServer, options):
         super(GenericPyTorchModel, self).__init__(project, config, dbConnector, fileServer, options)
 
@@ -57,13 +96,126 @@ class GenericPyTorchModel(AIModel):
         except:
             self.dataset_class = None
 
+        self.compiledOptions = optionsHelper.compile_options(self.options, self.OPTIONS_SPEC)
+
+
+    def __getstate__(self):
+        # compiled options are of a dynamically created type; compile them anew upon unpickling
+        state = self.__dict__.copy()
+        del state['compiledOptions']
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.compiledOptions = optionsHelper.compile_options(self.options, self.OPTIONS_SPEC)
+
 
     def get_device(self):
-        device = optionsHelper.get_hierarchical_value(self.options, ['options', 'general', 'device', 'value', 'id'])
+        device = self.compiledOptions.device
         if 'cuda' in device and not torch.cuda.is_available():
             device = 'cpu'
         return device
 
+
+    def get_num_train_processes(self):
+        '''
+            Returns the number of local processes to train with in parallel
+            (parameter "num_train_processes" in section [AIWorker] of the
+            configuration file; 0 for one per CPU core). Only applies to
+            training on the CPU; returns 1 otherwise.
+        '''
+        numProcesses = self.config.getProperty('AIWorker', 'num_train_processes', type=int, fallback=1)
+        if numProcesses == 0:
+            numProcesses = os.cpu_count() or 1
+        if numProcesses <= 1 or 'cuda' in self.get_device():
+            return 1
+        return numProcesses
+
+
+    def train_distributed(self, trainFun, stateDict, data, updateStateFun):
+        '''
+            Calls "trainFun(stateDict, data, updateStateFun, rank, worldSize)"
+            either directly (rank 0 of 1) or, if configured (see "get_num_
+            train_processes"), in multiple local processes that train synchro-
+            nously on their share of the data (see "functional._util.distri-
+            buted"). "trainFun" is usually a method of this instance, which is
+            pickled for the processes. Returns the result of rank 0.
+        '''
+        numProcesses = self.get_num_train_processes()
+        if numProcesses <= 1:
+            return trainFun(stateDict, data, updateStateFun=updateStateFun, rank=0, worldSize=1)
+        if isinstance(stateDict, memoryview):
+            # state dicts are loaded from the database as memoryviews, which cannot be pickled
+            stateDict = stateDict.tobytes()
+        return distributed.run_distributed(numProcesses, trainFun, (stateDict, data), updateStateFun)
+
+
+    def get_tiled_inference(self, tileSize, transform=None):
+        '''
+            Returns a "TiledInference" instance with the given tile size (width,
+            height) and tile transform if sliding-window inference on full-
+            resolution images is enabled in the options ("options.inference.
+            tiling"), else None.
+        '''
+        if not self.compiledOptions.tiling_enabled:
+            return None
+        return TiledInference(tileSize, self.compiledOptions.tiling_stride,
+                            self.compiledOptions.inference_batch_size, transform)
+
+
+    def get_inference_engine(self, model, stateDict, calibrationFun, *args):
+        '''
+            Returns a compiled (and optionally quantized) engine for the forward
+            pass of the model on a batch of images, as set in the options ("op-
+            tions.inference.engine"; see "functional._util.inferenceEngine"), or
+            None if the model is to be run as is (eager runtime, GPU device, or
+            if the compilation failed). "calibrationFun(numImages)" must return
+            a list of input tensors of the model (e.g. transformed images); any
+            additional arguments that affect the engine (e.g. the input size)
+            are included in the key under which it is cached.
+        '''
+        runtime = self.compiledOptions.inference_runtime
+        if runtime == 'eager' or 'cuda' in self.get_device():
+            return None
+        quantization = self.compiledOptions.inference_quantization
+        cacheDir = os.path.join(_get_temp_dir(self.config), 'aide/inferenceEngines')
+        try:
+            engine, report = InferenceEngineCache(cacheDir, self.project).get(model, stateDict,
+                                    runtime, quantization, calibrationFun,
+                                    self.compiledOptions.num_calibration_images, *args)
+        except Exception as e:
+            print(f'WARNING: could not compile model with inference runtime "{runtime}" (quantization: "{quantization}"; message: "{str(e)}"). Falling back to eager mode.')
+            return None
+        print(f'[{self.project}] Inference engine "{runtime}" (quantization: "{quantization}"): {format_report(report)}.')
+        return engine
+
+
+    def get_feature_cache(self, backbone, *args):
+        '''
+            Returns a "FeatureCache" for the given backbone (torch.nn.Module)
+            and any additional arguments that affect its features (e.g. input
+            size and transforms), or None if the cache is disabled (parameter
+            "feature_cache_size" in section [AIWorker] of the configuration
+            file).
+        '''
+        maxSize = self.config.getProperty('AIWorker', 'feature_cache_size', type=float, fallback=0)
+        if maxSize <= 0:
+            return None
+        cacheDir = os.path.join(_get_temp_dir(self.config), 'aide/featureCache')
+        return FeatureCache(cacheDir, self.project, FeatureCache.make_signature(backbone, *args), maxSize * 1024**2)
+
+
+    def get_decoded_image_cache(self, transform):
+        '''
+            Returns a "DecodedImageCache" for the "Resize" transform at the
+            beginning of the given (Compose) transform, or None if the cache
+            is disabled (parameter "decoded_image_cache_size" in section
+            [AIWorker] of the configuration file) or if the transform does
+            not start with a "Resize".
+        '''
+        return _get_decoded_image_cache(self.config, self.project, transform)
+
     
     def initializeModel(self, stateDict, data, addMissingLabelClasses=False, removeObsoleteLabelClasses=False):
         '''
@@ -199,7 +351,10 @@ class GenericPyTorchModel(AIModel):
             to a byte array that can be sent back to the AIWorker, and eventually the
             database.
             Also puts the model back on CPU and empties the CUDA cache (if available).
+            Models wrapped for distributed training are unwrapped.
         '''
+        if isinstance(model, torch.nn.parallel.DistributedDataParallel):
+            model = model.module
         if 'cuda' in self.get_device():
             torch.cuda.empty_cache()
         model.cpu()
@@ -275,6 +430,29 @@ class GenericPyTorchModel_Legacy(AIModel):
             device = 'cpu'
         return device
 
+
+    def get_tiled_inference(self, tileSize, transform=None):
+        '''
+            Returns a "TiledInference" instance with the given tile size (width,
+            height) and tile transform if sliding-window inference on full-
+            resolution images is enabled in the options ("inference.tiling"),
+            else None.
+        '''
+        tiling = self.options['inference'].get('tiling', {})
+        if not tiling.get('enabled', False):
+            return None
+        batchSize = self.options['inference'].get('dataLoader', {}).get('kwargs', {}).get('batch_size', 1)
+        return TiledInference(tileSize, float(tiling.get('stride', 1.0)), batchSize, transform)
+
+
+    def get_decoded_image_cache(self, transform):
+        '''
+            Returns a "DecodedImageCache" for the "Resize" transform at the
+            beginning of the given (Compose) transform, or None if disabled
+            (see "GenericPyTorchModel.get_decoded_image_cache").
+        '''
+        return _get_decoded_image_cache(self.config, self.project, transform)
+
     
     def initializeModel(self, stateDict, data):
         '''
@@ -13,6 +13,7 @@ from .. import parse_transforms
 from ..functional.classification.collation import Collator
 
 from util.helpers import get_class_executable, check_args
+from util.predictionChunk import PredictionChunk
 
 
 
@@ -37,9 +38,13 @@ class ClassificationModel(GenericPyTorchModel_Legacy):
         # setup transform, data loader, dataset, optimizer, criterion
         transform = parse_transforms(self.options['train']['transform'])
 
+        dataset_kwargs = dict(self.options['dataset']['kwargs'])
+        imageCache = self.get_decoded_image_cache(transform)
+        if imageCache is not None:
+            dataset_kwargs['imageCache'] = imageCache
         dataset = self.dataset_class(data, self.fileServer, labelclassMap,
                                 transform, self.options['train']['ignore_unsure'],
-                                **self.options['dataset']['kwargs']
+                                **dataset_kwargs
                                 )
 
         collator = Collator(self.project, self.dbConnector)
@@ -97,9 +102,13 @@ class ClassificationModel(GenericPyTorchModel_Legacy):
         # setup transform, data loader, dataset, optimizer, criterion
         transform = parse_transforms(self.options['inference']['transform'])
 
+        dataset_kwargs = dict(self.options['dataset']['kwargs'])
+        imageCache = self.get_decoded_image_cache(transform)
+        if imageCache is not None:
+            dataset_kwargs['imageCache'] = imageCache
         dataset = self.dataset_class(data, self.fileServer, labelclassMap,
                                 transform, False,
-                                **self.options['dataset']['kwargs']
+                                **dataset_kwargs
                                 )
 
         collator = Collator(self.project, self.dbConnector)
@@ -110,7 +119,7 @@ class ClassificationModel(GenericPyTorchModel_Legacy):
 
         # perform inference
         device = self.get_device()
-        response = {}
+        response = PredictionChunk()
         model.to(device)
         imgCount = 0
         for (img, _, fVec, imgID) in tqdm(dataLoader):
@@ -119,20 +128,13 @@ class ClassificationModel(GenericPyTorchModel_Legacy):
             with torch.no_grad():
                 pred_batch = model(dataItem)
             
-            # append to dict
+            # append to chunk
+            confidence, label = torch.max(pred_batch, 1)
             for i in range(len(imgID)):
-                logits = pred_batch[i,:]
-                label = torch.argmax(logits).item()
-                
-                response[imgID[i]] = {
-                    'predictions': [
-                        {
-                            'label': dataset.labelclassMap_inv[label],
-                            'logits': logits.cpu().numpy().tolist(),        #TODO: for AL criterion?
-                            'confidence': torch.max(logits).item()
-                        }
-                    ]
-                }
+                response.add(imgID[i],
+                    logits=pred_batch[i:i+1,:],
+                    label=[dataset.labelclassMap_inv[label[i].item()]],
+                    confidence=confidence[i:i+1])
         
             # update worker state
             imgCount += len(imgID)
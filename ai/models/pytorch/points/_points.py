@@ -33,14 +33,16 @@ from tqdm import tqdm
 from ..genericPyTorchModel import GenericPyTorchModel_Legacy
 from .. import parse_transforms
 from ..functional._wsodPoints import encoder, collation
+from ..functional._util.tiledInference import merge_points
 
 from util.helpers import get_class_executable, check_args
+from util.predictionChunk import PredictionChunk
 
 
 class PointModel(GenericPyTorchModel_Legacy):
 
-    def __init__(self, config, dbConnector, fileServer, options, defaultOptions):
-        super(PointModel, self).__init__(config, dbConnector, fileServer, options, defaultOptions)
+    def __init__(self, project, config, dbConnector, fileServer, options, defaultOptions):
+        super(PointModel, self).__init__(project, config, dbConnector, fileServer, options, defaultOptions)
     
 
     def train(self, stateDict, data, updateStateFun):
@@ -63,9 +65,13 @@ class PointModel(GenericPyTorchModel_Legacy):
         # setup transform, data loader, dataset, optimizer, criterion
         transform = parse_transforms(self.options['train']['transform'])
 
+        dataset_kwargs = dict(self.options['dataset']['kwargs'])
+        imageCache = self.get_decoded_image_cache(transform)
+        if imageCache is not None:
+            dataset_kwargs['imageCache'] = imageCache
         dataset = self.dataset_class(data, self.fileServer, labelclassMap,
                                 transform, self.options['train']['ignore_unsure'],
-                                **self.options['dataset']['kwargs']
+                                **dataset_kwargs
                                 )
         
         dataEncoder = encoder.DataEncoder(len(labelclassMap.keys()))
@@ -129,9 +135,18 @@ class PointModel(GenericPyTorchModel_Legacy):
         # setup transform, data loader, dataset, optimizer, criterion
         transform = parse_transforms(self.options['inference']['transform'])
 
+        # sliding-window inference on full-resolution images (if enabled)
+        tiledInference = self.get_tiled_inference(inputSize, lambda tile: transform(tile)[0])
+        if tiledInference is not None:
+            return self._inference_tiled(model, labelclassMap, data, tiledInference, targetSize, updateStateFun)
+
+        dataset_kwargs = dict(self.options['dataset']['kwargs'])
+        imageCache = self.get_decoded_image_cache(transform)
+        if imageCache is not None:
+            dataset_kwargs['imageCache'] = imageCache
         dataset = self.dataset_class(data, self.fileServer, labelclassMap,
                                 transform, False,
-                                **self.options['dataset']['kwargs']
+                                **dataset_kwargs
                                 )
 
         dataEncoder = encoder.DataEncoder(len(labelclassMap.keys()))
@@ -144,7 +159,7 @@ class PointModel(GenericPyTorchModel_Legacy):
         
         # perform inference
         device = self.get_device()
-        response = {}
+        response = PredictionChunk()
         model.to(device)
         imgCount = 0
         for (img, _, _, fVec, imgID) in tqdm(dataLoader):
@@ -153,25 +168,20 @@ class PointModel(GenericPyTorchModel_Legacy):
             with torch.no_grad():
                 pred_batch = model(dataItem)
             
-            # decode and append to dict
+            # decode and append to chunk
             for i in range(len(imgID)):
                 pred_points, pred_labels, pred_confs = dataEncoder.decode(pred_batch[i,...].squeeze(),
                                                         min_conf=0.1, nms_dist=2)   #TODO
-                
-                predictions = []
-                for p in range(pred_points.size(0)):
-                    predictions.append({
-                        'x': pred_points[p,0].item(),
-                        'y': pred_points[p,1].item(),
-                        'label': dataset.labelclassMap_inv[pred_labels[p].item()],
-                        'logits': pred_confs[p,:].cpu().numpy().tolist(),
-                        'confidence': torch.max(pred_confs[p,:]).item()
-                    })
-            
-            response[imgID[i]] = {
-                'predictions': predictions,
-                #TODO: exception if fVec is not torch tensor: 'fVec': io.BytesIO(fVec.numpy().astype(np.float32)).getvalue()
-            }
+                if not len(pred_points):
+                    continue
+                pred_confs = pred_confs.cpu()
+                response.add(imgID[i],
+                    logits=pred_confs,
+                    label=[dataset.labelclassMap_inv[l] for l in pred_labels.view(-1).tolist()],
+                    confidence=torch.max(pred_confs, 1)[0],
+                    x=pred_points[:,0],
+                    y=pred_points[:,1])
+                #TODO: exception if fVec is not torch tensor: response.set_feature_vector(imgID[i], io.BytesIO(fVec.numpy().astype(np.float32)).getvalue())
         
             # update worker state
             imgCount += len(imgID)
@@ -181,4 +191,73 @@ class PointModel(GenericPyTorchModel_Legacy):
         if 'cuda' in device:
             torch.cuda.empty_cache()
 
-        return response
\ No newline at end of file
+        return response
+
+
+    def _inference_tiled(self, model, labelclassMap, data, tiledInference, targetSize, updateStateFun):
+        '''
+            Predicts points in tiles of the images at full resolution (see
+            "ai.models.pytorch.functional._util.tiledInference"). Duplicates
+            from overlapping tiles are removed if they are closer than the
+            "min_dist" tiling option (in pixels; defaults to one cell of the
+            model's prediction grid).
+        '''
+        labelclassMap_inv = dict([v, k] for k, v in labelclassMap.items())
+        dataEncoder = encoder.DataEncoder(len(labelclassMap.keys()))
+        tileSize = tiledInference.tileSize
+        minDist = self.options['inference'].get('tiling', {}).get('min_dist',
+                    max(tileSize[0] / targetSize[0], tileSize[1] / targetSize[1]))
+
+        device = self.get_device()
+        response = PredictionChunk()
+        model.to(device)
+        imgCount = 0
+        if hasattr(self.fileServer, 'prefetch'):
+            self.fileServer.prefetch([data['images'][imgID]['filename'] for imgID in data['images']])
+        for imgID in tqdm(data['images']):
+            imagePath = data['images'][imgID]['filename']
+            try:
+                imageData = self.fileServer.getFile(imagePath)
+                imageSize = tiledInference.image_size(imageData)
+            except:
+                print('WARNING: Image {} is corrupt and could not be loaded.'.format(imagePath))
+                imgCount += 1
+                continue
+
+            points_img, labels_img, confs_img = [], [], []
+            for tiles, coords, sizes in tiledInference.tiles(imageData):
+                with torch.no_grad():
+                    pred_batch = model(tiles.to(device))
+                for t in range(len(coords)):
+                    pred_points, pred_labels, pred_confs = dataEncoder.decode(pred_batch[t,...].squeeze(),
+                                                            min_conf=0.1, nms_dist=2)   #TODO
+                    if not len(pred_points):
+                        continue
+
+                    # convert to absolute image coordinates
+                    points_img.append(pred_points * torch.tensor(sizes[t], dtype=torch.float) + \
+                                        torch.tensor(coords[t], dtype=torch.float))
+                    labels_img.append(pred_labels.view(-1))
+                    confs_img.append(pred_confs.cpu())
+
+            # merge predictions across tiles and convert them back to relative format
+            if len(points_img):
+                points_img, labels_img, confs_img = merge_points(torch.cat(points_img, 0),
+                                torch.cat(labels_img, 0), torch.cat(confs_img, 0), minDist)
+                points_img /= torch.tensor(imageSize, dtype=torch.float)
+                response.add(imgID,
+                    logits=confs_img,
+                    label=[labelclassMap_inv[l] for l in labels_img.tolist()],
+                    confidence=torch.max(confs_img, 1)[0],
+                    x=points_img[:,0],
+                    y=points_img[:,1])
+
+            # update worker state
+            imgCount += 1
+            updateStateFun(state='PROGRESS', message='predicting', done=imgCount, total=len(data['images']))
+
+        model.cpu()
+        if 'cuda' in device:
+            torch.cuda.empty_cache()
+
+        return response
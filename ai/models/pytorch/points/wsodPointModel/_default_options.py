@@ -134,6 +134,10 @@ DEFAULT_OPTIONS = {
                 "shuffle": False,
                 "batch_size": 1
             }
-        }
+        },
+		"tiling": {
+			"enabled": False,
+			"stride": 0.75
+		}
 	}
 }
\ No newline at end of file
@@ -13,8 +13,10 @@ from tqdm import tqdm
 from ..genericPyTorchModel import GenericPyTorchModel_Legacy
 from .. import parse_transforms
 from ..functional.segmentationMasks.collation import Collator
+from ..functional._util.tiledInference import MaskBlender
 
 from util.helpers import get_class_executable, check_args
+from util.predictionChunk import PredictionChunk
 
 
 
@@ -38,8 +40,11 @@ class SegmentationModel(GenericPyTorchModel_Legacy):
 
         # setup transform, data loader, dataset, optimizer, criterion
         transform = parse_transforms(self.options['train']['transform'])
-        dataset_kwargs = self.options['dataset']['kwargs']
+        dataset_kwargs = dict(self.options['dataset']['kwargs'])
         dataset_kwargs['ignore_unlabeled'] = self.ignore_unlabeled
+        imageCache = self.get_decoded_image_cache(transform)
+        if imageCache is not None:
+            dataset_kwargs['imageCache'] = imageCache
         dataset = self.dataset_class(data, self.fileServer, labelclassMap,
                                 transform,
                                 **dataset_kwargs
@@ -102,8 +107,18 @@ class SegmentationModel(GenericPyTorchModel_Legacy):
 
         # setup transform, data loader, dataset, optimizer, criterion
         transform = parse_transforms(self.options['inference']['transform'])
-        dataset_kwargs = self.options['dataset']['kwargs']
+
+        # sliding-window inference on full-resolution images (if enabled)
+        tiledInference = self.get_tiled_inference(tuple(self.options['general']['image_size']),
+                                                    lambda tile: transform(tile)[0])
+        if tiledInference is not None:
+            return self._inference_tiled(model, labelclassMap, data, tiledInference, updateStateFun)
+
+        dataset_kwargs = dict(self.options['dataset']['kwargs'])
         dataset_kwargs['ignore_unlabeled'] = self.ignore_unlabeled
+        imageCache = self.get_decoded_image_cache(transform)
+        if imageCache is not None:
+            dataset_kwargs['imageCache'] = imageCache
         dataset = self.dataset_class(data, self.fileServer, labelclassMap,
                                 transform,
                                 **dataset_kwargs
@@ -116,7 +131,7 @@ class SegmentationModel(GenericPyTorchModel_Legacy):
 
         # perform inference
         device = self.get_device()
-        response = {}
+        response = PredictionChunk()
         model.to(device)
         imgCount = 0
         for (img, _, imageSizes, imgID) in tqdm(dataLoader):
@@ -129,19 +144,11 @@ class SegmentationModel(GenericPyTorchModel_Legacy):
             # scale up to original size
             pred_batch = F.interpolate(pred_batch, size=imageSizes[0])
             
-            # append to dict
+            # append to chunk
             for i in range(len(imgID)):
                 logits = pred_batch[i,...]
                 confidence, label = torch.max(logits, 0)
-                response[imgID[i]] = {
-                    'predictions': [
-                        {
-                            'label': label.cpu().numpy(),
-                            'logits': logits.cpu().numpy().tolist(),
-                            'confidence': confidence.cpu().numpy()
-                        }
-                    ]
-                }
+                response.add_mask(imgID[i], label, logits, confidence)
         
             # update worker state
             imgCount += len(imgID)
@@ -151,4 +158,50 @@ class SegmentationModel(GenericPyTorchModel_Legacy):
         if 'cuda' in device:
             torch.cuda.empty_cache()
 
-        return response
\ No newline at end of file
+        return response
+
+
+    def _inference_tiled(self, model, labelclassMap, data, tiledInference, updateStateFun):
+        '''
+            Predicts segmentation masks in tiles of the images at full resolution
+            (see "ai.models.pytorch.functional._util.tiledInference"). Class
+            probabilities are averaged in areas of overlapping tiles; for very
+            large images, only a subsampled grid of them is kept for ranking
+            (see "MaskBlender").
+        '''
+        device = self.get_device()
+        response = PredictionChunk()
+        model.to(device)
+        imgCount = 0
+        if hasattr(self.fileServer, 'prefetch'):
+            self.fileServer.prefetch([data['images'][imgID]['filename'] for imgID in data['images']])
+        for imgID in tqdm(data['images']):
+            imagePath = data['images'][imgID]['filename']
+            try:
+                imageData = self.fileServer.getFile(imagePath)
+                imageSize = tiledInference.image_size(imageData)
+                blender = MaskBlender(len(labelclassMap), imageSize, tiledInference.row_positions(imageSize))
+            except:
+                print('WARNING: Image {} is corrupt and could not be loaded.'.format(imagePath))
+                imgCount += 1
+                continue
+
+            for tiles, coords, sizes in tiledInference.tiles(imageData):
+                with torch.no_grad():
+                    pred_batch = model(tiles.to(device))
+                    pred_batch = F.softmax(pred_batch, dim=1)
+                for t in range(len(coords)):
+                    blender.add(pred_batch[t,...], coords[t], sizes[t])
+
+            label, logits = blender.result()
+            response.add_mask(imgID, label, logits)
+
+            # update worker state
+            imgCount += 1
+            updateStateFun(state='PROGRESS', message='predicting', done=imgCount, total=len(data['images']))
+
+        model.cpu()
+        if 'cuda' in device:
+            torch.cuda.empty_cache()
+
+        return response
@@ -0,0 +1,155 @@
+'''
+    Benchmark for the synchronous data-parallel training of PyTorch models
+    over multiple local processes (see "ai.models.pytorch.functional._util.
+    distributed" and parameter "num_train_processes" in section [AIWorker]
+    of the configuration file).
+
+    Trains a RetinaNet on the same synthetic images (random pixels and
+    bounding boxes) for one epoch with increasing numbers of processes and
+    reports the throughput, the speedup and the parallel efficiency compared
+    to a single process. The CPU cores are divided evenly among the processes;
+    the batch size is per process. No database or FileServer is required.
+
+    Usage (run as a module, so that the spawned processes can import the
+    training function defined here):
+        export PYTHONPATH=.
+        python -m benchmarks.distributedTraining --num_processes 1 2 4 8
+
+    2021 Benjamin Kellenberger
+'''
+
+import time
+import json
+import argparse
+import torch
+import torch.distributed as dist
+from torch.utils.data import Dataset, DataLoader
+from torch.utils.data.distributed import DistributedSampler
+from torch.nn.parallel import DistributedDataParallel
+from ai.models.pytorch.functional._retinanet import encoder, loss
+from ai.models.pytorch.functional._retinanet.model import RetinaNet
+from ai.models.pytorch.functional._util.distributed import run_distributed
+
+
+class SyntheticDataset(Dataset):
+    '''
+        Random images with random bounding boxes, encoded as RetinaNet
+        targets. Images are generated deterministically from their index.
+    '''
+
+    def __init__(self, numImages, imageSize, numClasses, numBoxes=8, seed=0):
+        self.numImages = numImages
+        self.imageSize = imageSize
+        self.numClasses = numClasses
+        self.numBoxes = numBoxes
+        self.seed = seed
+        self.encoder = encoder.DataEncoder()
+
+    def __len__(self):
+        return self.numImages
+
+    def __getitem__(self, idx):
+        gen = torch.Generator().manual_seed(self.seed + idx)
+        img = torch.rand(3, self.imageSize, self.imageSize, generator=gen)
+        xy = torch.rand(self.numBoxes, 2, generator=gen) * self.imageSize * 0.75
+        wh = (torch.rand(self.numBoxes, 2, generator=gen) * 0.2 + 0.05) * self.imageSize
+        boxes = torch.cat((xy, torch.clamp(xy + wh, max=self.imageSize - 1)), 1)
+        labels = torch.randint(self.numClasses, (self.numBoxes,), generator=gen)
+        loc_target, cls_target = self.encoder.encode(boxes, labels,
+                                    input_size=(self.imageSize, self.imageSize))
+        return img, loc_target, cls_target
+
+
+def train_synthetic(numImages, imageSize, batchSize, backbone, numClasses, seed,
+                    updateStateFun=None, rank=0, worldSize=1):
+    '''
+        Trains a freshly initialized RetinaNet for one epoch on synthetic data
+        and returns the duration of the epoch and the mean loss (of rank 0).
+    '''
+    torch.manual_seed(seed)
+    model = RetinaNet(dict((c, c) for c in range(numClasses)), backbone=backbone, pretrained=False)
+    dataset = SyntheticDataset(numImages, imageSize, numClasses, seed=seed)
+    if worldSize > 1:
+        sampler = DistributedSampler(dataset, num_replicas=worldSize, rank=rank, shuffle=True, seed=seed)
+        dataLoader = DataLoader(dataset, batch_size=batchSize, sampler=sampler)
+        model = DistributedDataParallel(model, find_unused_parameters=True)
+    else:
+        dataLoader = DataLoader(dataset, batch_size=batchSize, shuffle=True)
+    optimizer = torch.optim.SGD(model.parameters(), lr=1e-4, momentum=0.9)
+    criterion = loss.FocalLoss()
+
+    if worldSize > 1:
+        dist.barrier()
+    tic = time.perf_counter()
+    losses = []
+    for img, loc_target, cls_target in dataLoader:
+        optimizer.zero_grad()
+        loc_pred, cls_pred = model(img)
+        loss_value = criterion(loc_pred, loc_target, cls_pred, cls_target)
+        loss_value.backward()
+        optimizer.step()
+        losses.append(loss_value.item())
+        if updateStateFun is not None:
+            updateStateFun(state='PROGRESS', message='training',
+                        done=min(len(losses) * batchSize * worldSize, numImages), total=numImages)
+    if worldSize > 1:
+        dist.barrier()
+    duration = time.perf_counter() - tic
+
+    if rank > 0:
+        return None
+    return {
+        'epoch_time': duration,
+        'loss': sum(losses) / max(1, len(losses))
+    }
+
+
+def measure(numProcesses, args):
+    trainArgs = (args.num_images, args.image_size, args.batch_size, args.backbone, args.num_classes, args.seed)
+    tic = time.perf_counter()
+    if numProcesses <= 1:
+        result = train_synthetic(*trainArgs)
+    else:
+        result = run_distributed(numProcesses, train_synthetic, trainArgs)
+    result['total_time'] = time.perf_counter() - tic
+    result['num_processes'] = numProcesses
+    result['images_per_second'] = args.num_images / result['epoch_time']
+    return result
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the data-parallel training of RetinaNet over local processes.')
+    parser.add_argument('--num_processes', type=int, nargs='+', default=[1, 2, 4, 8],
+                    help='Number(s) of processes to train with (default: 1 2 4 8).')
+    parser.add_argument('--num_images', type=int, default=64,
+                    help='Number of synthetic images per epoch (default: 64).')
+    parser.add_argument('--image_size', type=int, default=256,
+                    help='Width and height of the synthetic images (default: 256).')
+    parser.add_argument('--batch_size', type=int, default=2,
+                    help='Batch size per process (default: 2).')
+    parser.add_argument('--backbone', type=str, default='resnet18',
+                    help='RetinaNet backbone (default: resnet18).')
+    parser.add_argument('--num_classes', type=int, default=4,
+                    help='Number of label classes (default: 4).')
+    parser.add_argument('--seed', type=int, default=0,
+                    help='Random seed (default: 0).')
+    parser.add_argument('--json', action='store_true',
+                    help='Print results as JSON.')
+    args = parser.parse_args()
+
+    results = []
+    for numProcesses in args.num_processes:
+        result = measure(numProcesses, args)
+        results.append(result)
+        if not args.json:
+            baseline = results[0]
+            speedup = result['images_per_second'] / baseline['images_per_second']
+            efficiency = speedup * baseline['num_processes'] / numProcesses
+            print('{} process(es): epoch {:.2f}s (total incl. startup {:.2f}s), {:.2f} img/s, speedup {:.2f}x, efficiency {:.0%}, loss {:.4f}'.format(
+                numProcesses, result['epoch_time'], result['total_time'], result['images_per_second'],
+                speedup, efficiency, result['loss']
+            ))
+    if args.json:
+        print(json.dumps(results, indent=2))
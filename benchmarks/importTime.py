@@ -0,0 +1,113 @@
+'''
+    Benchmark for the cold start of AIDE processes: for each role (value of
+    the "AIDE_MODULES" environment variable), a fresh interpreter imports
+    the module classes that "application.py" would launch for it, and
+    reports the import time, the number of loaded Python modules and the
+    peak memory (RSS) of the process. Optionally fails if thresholds are
+    exceeded, so that the benchmark can be used to guard against regressions.
+
+    Only imports are measured; no database connections are made and no
+    modules are instantiated.
+
+    Usage:
+        export AIDE_CONFIG_PATH=config/settings.ini
+        export PYTHONPATH=.
+        python benchmarks/importTime.py --roles LabelUI FileServer AIWorker
+
+    2021 Benjamin Kellenberger
+'''
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+import statistics
+
+
+# modules launched by "application.py" in addition to the requested ones
+ROLE_MODULES = {
+    'LabelUI': ['AIDEAdmin', 'Reception', 'ProjectConfigurator', 'ProjectStatistics'],
+    'AIController': ['ModelMarketplace']
+}
+GLOBAL_MODULES = ['UserHandler', 'DataAdministrator', 'StaticFileServer']
+
+
+# executed in a fresh interpreter per measurement
+_PROBE = '''
+import sys, time, json, resource
+t = time.perf_counter()
+from modules import REGISTERED_MODULES
+for moduleName in {moduleNames!r}:
+    REGISTERED_MODULES[moduleName]
+elapsed = time.perf_counter() - t
+print(json.dumps({{
+    'time': elapsed,
+    'num_modules': len(sys.modules),
+    'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'celery': 'celery_worker' in sys.modules
+}}))
+'''
+
+
+def measure(role, numRepetitions):
+    '''
+        Returns the median import time, number of loaded modules and peak
+        RSS over a number of cold starts for a role (comma-separated list of
+        module names, like "AIDE_MODULES").
+    '''
+    moduleNames = [m.strip() for m in role.split(',')]
+    for m in list(moduleNames):
+        moduleNames.extend(ROLE_MODULES.get(m, []))
+    moduleNames.extend(GLOBAL_MODULES)
+    moduleNames = list(dict.fromkeys(moduleNames))
+
+    env = os.environ.copy()
+    env['AIDE_MODULES'] = role
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.getcwd(), env.get('PYTHONPATH', None)]))
+    results = []
+    for _ in range(numRepetitions):
+        output = subprocess.run([sys.executable, '-c', _PROBE.format(moduleNames=moduleNames)],
+                        env=env, stdout=subprocess.PIPE, check=True).stdout
+        results.append(json.loads(output.decode('utf-8').strip().split('\n')[-1]))
+
+    return {
+        'role': role,
+        'time': statistics.median(r['time'] for r in results),
+        'num_modules': statistics.median(r['num_modules'] for r in results),
+        'max_rss_mb': statistics.median(r['max_rss_mb'] for r in results),
+        'celery': results[0]['celery']
+    }
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the import time and memory of AIDE processes per role.')
+    parser.add_argument('--roles', type=str, nargs='+', default=['LabelUI', 'FileServer', 'AIController', 'AIWorker'],
+                    help='Role(s) to measure; each is a comma-separated list of modules as in "AIDE_MODULES" (default: LabelUI FileServer AIController AIWorker).')
+    parser.add_argument('--num_repetitions', type=int, default=5,
+                    help='Number of cold starts per role; the median is reported (default: 5).')
+    parser.add_argument('--max_time', type=float, default=None,
+                    help='Exit with an error if the import time (seconds) of any role exceeds this value.')
+    parser.add_argument('--max_rss', type=float, default=None,
+                    help='Exit with an error if the peak memory (MB) of any role exceeds this value.')
+    parser.add_argument('--json', action='store_true',
+                    help='Print results as JSON.')
+    args = parser.parse_args()
+
+    if not 'AIDE_CONFIG_PATH' in os.environ:
+        raise ValueError('Missing system environment variable "AIDE_CONFIG_PATH".')
+
+    results = [measure(role, args.num_repetitions) for role in args.roles]
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            print(', '.join('{}: {}'.format(key, (round(val, 4) if isinstance(val, float) else val)) for key, val in result.items()))
+
+    failed = [r['role'] for r in results if (args.max_time is not None and r['time'] > args.max_time) or
+                (args.max_rss is not None and r['max_rss_mb'] > args.max_rss)]
+    if len(failed):
+        print('Thresholds exceeded for role(s): {}'.format(', '.join(failed)))
+        sys.exit(1)
@@ -0,0 +1,130 @@
+'''
+    Benchmark for the compiled (and quantized) inference engines of PyTorch
+    models on the CPU (see "ai.models.pytorch.functional._util.inference-
+    Engine" and the option "inference.engine" of the built-in models).
+
+    Compiles a RetinaNet (randomly initialized or from a model state file
+    exported by AIDE) with each of the requested runtime and quantization
+    combinations and reports the compilation time, the throughput compared
+    to the original (32-bit float, eager mode) model and the differences of
+    the outputs on the calibration images. Images are random unless a
+    directory of images is provided.
+
+    Usage:
+        export PYTHONPATH=.
+        python benchmarks/inferenceEngine.py --engines torchscript:none torchscript:static onnx:dynamic
+
+    2021 Benjamin Kellenberger
+'''
+
+import os
+import io
+import time
+import json
+import argparse
+import tempfile
+import torch
+from PIL import Image
+from torchvision.transforms.functional import to_tensor
+from ai.models.pytorch.functional._retinanet.model import RetinaNet
+from ai.models.pytorch.functional._util.inferenceEngine import InferenceEngineCache, format_report
+
+
+def load_images(args):
+    if args.image_dir is None:
+        gen = torch.Generator().manual_seed(args.seed)
+        return [torch.rand(1, 3, args.image_size, args.image_size, generator=gen) for _ in range(args.num_images)]
+    images = []
+    for fileName in sorted(os.listdir(args.image_dir)):
+        try:
+            img = Image.open(os.path.join(args.image_dir, fileName)).convert('RGB')
+        except Exception:
+            continue
+        images.append(to_tensor(img.resize((args.image_size, args.image_size))).unsqueeze(0))
+        if len(images) >= args.num_images:
+            break
+    return images
+
+
+def time_per_image(fun, images):
+    fun(images[0])      # warm-up
+    tic = time.perf_counter()
+    for img in images:
+        fun(img)
+    return (time.perf_counter() - tic) / len(images)
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark compiled and quantized inference engines on the CPU.')
+    parser.add_argument('--engines', type=str, nargs='+', default=['torchscript:none', 'torchscript:static', 'onnx:none', 'onnx:dynamic', 'onnx:static'],
+                    help='Runtime and quantization combinations to benchmark, as "<runtime>:<quantization>" (default: all).')
+    parser.add_argument('--model_state', type=str, default=None,
+                    help='Path of a RetinaNet model state file; a randomly initialized model is used if not provided.')
+    parser.add_argument('--backbone', type=str, default='resnet50',
+                    help='Backbone of the randomly initialized model (default: resnet50).')
+    parser.add_argument('--image_dir', type=str, default=None,
+                    help='Directory of images to predict; random images are used if not provided.')
+    parser.add_argument('--image_size', type=int, default=512,
+                    help='Width and height the images are resized to (default: 512).')
+    parser.add_argument('--num_images', type=int, default=32,
+                    help='Number of images to predict (default: 32).')
+    parser.add_argument('--num_calibration_images', type=int, default=16,
+                    help='Number of images to calibrate static quantization with and to compute the output deltas on (default: 16).')
+    parser.add_argument('--seed', type=int, default=0,
+                    help='Random seed (default: 0).')
+    parser.add_argument('--json', action='store_true',
+                    help='Print results as JSON.')
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    if args.model_state is not None:
+        with open(args.model_state, 'rb') as f:
+            stateDict = f.read()
+        model = RetinaNet.loadFromStateDict(torch.load(io.BytesIO(stateDict), map_location='cpu'))
+    else:
+        model = RetinaNet({0: 0, 1: 1, 2: 2, 3: 3}, backbone=args.backbone, pretrained=False)
+        bio = io.BytesIO()
+        torch.save(model.getStateDict(), bio)
+        stateDict = bio.getvalue()
+    model.eval()
+
+    images = load_images(args)
+    def _eager(x):
+        with torch.no_grad():
+            return model(x)
+    timeFP32 = time_per_image(_eager, images)
+
+    results = []
+    with tempfile.TemporaryDirectory() as cacheDir:
+        cache = InferenceEngineCache(cacheDir, 'benchmark')
+        for spec in args.engines:
+            runtime, quantization = (spec.split(':') + ['none'])[:2]
+            result = {
+                'runtime': runtime,
+                'quantization': quantization
+            }
+            try:
+                tic = time.perf_counter()
+                engine, report = cache.get(model, stateDict, runtime, quantization,
+                                        lambda num: images[:num], args.num_calibration_images, args.image_size)
+                result['compile_time'] = time.perf_counter() - tic
+                result['time_per_image'] = time_per_image(engine, images)
+                result['time_per_image_fp32'] = timeFP32
+                result['speedup'] = timeFP32 / result['time_per_image']
+                result['report'] = report
+            except Exception as e:
+                result['error'] = str(e)
+            results.append(result)
+
+            if not args.json:
+                if 'error' in result:
+                    print(f'{runtime} ({quantization}): failed (message: "{result["error"]}")')
+                else:
+                    print('{} ({}): compiled in {:.2f}s, {:.4f}s/image (fp32: {:.4f}s/image), speedup {:.2f}x; {}'.format(
+                        runtime, quantization, result['compile_time'], result['time_per_image'],
+                        timeFP32, result['speedup'], format_report(report)
+                    ))
+    if args.json:
+        print(json.dumps(results, indent=2))
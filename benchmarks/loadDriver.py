@@ -0,0 +1,234 @@
+'''
+    Load test of the labeling interface with concurrent annotators.
+
+    Each simulated annotator logs in to a running AIDE instance (LabelUI
+    module) with its own session and repeatedly goes through the requests
+    the labeling UI makes:
+    - "getLatestImages":    next batch of images (with annotations and
+                            predictions);
+    - "submitAnnotations":  random annotations for all images of the batch;
+    - "getImages":          occasionally, the batch is requested again by
+                            its image IDs (like when going back to previous
+                            images).
+    The project settings (label classes, annotation type) are requested
+    once per annotator upon login.
+
+    Reports the latency percentiles and error counts per endpoint, as well
+    as the overall throughput of requests and annotated images. Meant to be
+    run against a synthetic project (see "syntheticProject.py"), whose users
+    are used by default; note that the annotations of these users are mo-
+    dified.
+
+    Usage:
+        python application.py      # or gunicorn; with AIDE_MODULES=LabelUI
+        export PYTHONPATH=.
+        python benchmarks/loadDriver.py --url http://localhost:8080 --project benchmark --num_users 4 --duration 60
+
+    2021 Benjamin Kellenberger
+'''
+
+import sys
+import json
+import time
+import threading
+import argparse
+import numpy as np
+import requests
+from benchmarks.syntheticProject import user_names, make_submission
+
+
+def _class_ids(tree):
+    '''
+        Returns the IDs of all label classes in a (nested) class definition
+        tree as returned by "getClassDefinitions".
+    '''
+    ids = []
+    for key, entry in tree.get('entries', {}).items():
+        if 'entries' in entry:
+            ids.extend(_class_ids(entry))
+        else:
+            ids.append(key)
+    return ids
+
+
+def summarize(latencies):
+    '''
+        Returns count, mean, percentiles and maximum of a list of latencies
+        (seconds).
+    '''
+    if not len(latencies):
+        return {'count': 0}
+    latencies = np.array(latencies)
+    return {
+        'count': len(latencies),
+        'mean': float(np.mean(latencies)),
+        'p50': float(np.percentile(latencies, 50)),
+        'p95': float(np.percentile(latencies, 95)),
+        'p99': float(np.percentile(latencies, 99)),
+        'max': float(np.max(latencies))
+    }
+
+
+
+class Annotator(threading.Thread):
+
+    def __init__(self, args, username, seed, deadline):
+        super(Annotator, self).__init__(daemon=True)
+        self.args = args
+        self.username = username
+        self.baseURL = args.url.rstrip('/') + '/' + args.project
+        self.rnd = np.random.RandomState(seed)
+        self.deadline = deadline
+
+        self.latencies = {}     # endpoint: list of latencies of successful requests
+        self.errors = {}        # endpoint: number of failed requests
+        self.messages = []      # first error messages
+        self.numImages = 0      # number of images annotations were submitted for
+
+
+    def _request(self, session, endpoint, method='GET', **kwargs):
+        tic = time.perf_counter()
+        try:
+            response = session.request(method, f'{self.baseURL}/{endpoint}', timeout=self.args.timeout, **kwargs)
+            response.raise_for_status()
+            result = response.json()
+            if isinstance(result, dict) and result.get('status', 0) not in (0, None):
+                raise Exception(result.get('message', f'status {result["status"]}'))
+            self.latencies.setdefault(endpoint, []).append(time.perf_counter() - tic)
+            return result
+        except Exception as e:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+            if len(self.messages) < 5:
+                self.messages.append(f'{endpoint}: {str(e)}')
+            return None
+
+
+    def _think(self):
+        if self.args.think_time > 0:
+            time.sleep(self.rnd.exponential(self.args.think_time))
+
+
+    def run(self):
+        with requests.Session() as session:
+            if self._request(session, 'doLogin', 'POST',
+                        data={'username': self.username, 'password': self.args.password}) is None:
+                return
+            settings = self._request(session, 'getProjectSettings')
+            if settings is None:
+                return
+            annotationType = settings['settings']['annotationType']
+            labelClasses = _class_ids(settings['settings']['classes'])
+
+            seen, seenSet = [], set()
+            while time.time() < self.deadline:
+                batch = self._request(session, 'getLatestImages', params={'limit': self.args.batch_size})
+                if batch is not None and not len(batch['entries']) and len(seen):
+                    # no new images left; revise previously annotated ones
+                    imageIDs = [seen[i] for i in self.rnd.choice(len(seen), min(len(seen), self.args.batch_size), replace=False)]
+                    batch = self._request(session, 'getImages', 'POST', json={'imageIDs': imageIDs})
+                if batch is None or not len(batch['entries']):
+                    time.sleep(max(self.args.think_time, 0.1))
+                    continue
+                imageIDs = list(batch['entries'].keys())
+                seen.extend(i for i in imageIDs if i not in seenSet)
+                seenSet.update(imageIDs)
+                self._think()
+
+                submission = make_submission(self.rnd, annotationType, imageIDs, labelClasses,
+                                            self.args.num_annotations, tuple(self.args.image_size))
+                if self._request(session, 'submitAnnotations', 'POST', json=submission) is not None:
+                    self.numImages += len(imageIDs)
+
+                if self.rnd.rand() < self.args.revisit_probability:
+                    self._think()
+                    self._request(session, 'getImages', 'POST', json={'imageIDs': imageIDs})
+
+
+
+def run(args):
+    users = (args.users if args.users is not None else user_names(args.project, args.num_users))
+    users = [users[idx % len(users)] for idx in range(args.num_users)]
+
+    tic = time.time()
+    annotators = [Annotator(args, username, args.seed + idx, tic + args.duration) for idx, username in enumerate(users)]
+    for a in annotators:
+        a.start()
+    for a in annotators:
+        a.join()
+    duration = time.time() - tic
+
+    endpoints = sorted(set(e for a in annotators for e in list(a.latencies.keys()) + list(a.errors.keys())))
+    results = {}
+    for endpoint in endpoints:
+        results[endpoint] = summarize([l for a in annotators for l in a.latencies.get(endpoint, [])])
+        results[endpoint]['errors'] = sum(a.errors.get(endpoint, 0) for a in annotators)
+    numRequests = sum(r['count'] + r['errors'] for r in results.values())
+    return {
+        'url': args.url,
+        'project': args.project,
+        'num_users': args.num_users,
+        'batch_size': args.batch_size,
+        'think_time': args.think_time,
+        'duration': duration,
+        'num_requests': numRequests,
+        'requests_per_second': numRequests / duration,
+        'num_images_annotated': sum(a.numImages for a in annotators),
+        'images_per_second': sum(a.numImages for a in annotators) / duration,
+        'endpoints': results,
+        'error_messages': [m for a in annotators for m in a.messages][:10]
+    }
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Load test of the labeling interface with concurrent annotators.')
+    parser.add_argument('--url', type=str, default='http://localhost:8080',
+                    help='Base URL of the AIDE instance running the LabelUI (default: http://localhost:8080).')
+    parser.add_argument('--project', type=str, default='benchmark',
+                    help='Shortname of the (synthetic) project (default: "benchmark").')
+    parser.add_argument('--users', type=str, nargs='+', default=None,
+                    help='User names to log in with (default: the users of the synthetic project).')
+    parser.add_argument('--password', type=str, default='benchmark',
+                    help='Password of the users (default: "benchmark").')
+    parser.add_argument('--num_users', type=int, default=4,
+                    help='Number of concurrent annotators; users are reused if there are fewer (default: 4).')
+    parser.add_argument('--duration', type=float, default=60,
+                    help='Duration of the test in seconds (default: 60).')
+    parser.add_argument('--batch_size', type=int, default=12,
+                    help='Number of images requested per batch (default: 12).')
+    parser.add_argument('--num_annotations', type=int, default=5,
+                    help='Number of annotations submitted per image (points and bounding boxes; default: 5).')
+    parser.add_argument('--image_size', type=int, nargs=2, default=[256, 192],
+                    help='Width and height of submitted segmentation masks (default: 256 192).')
+    parser.add_argument('--revisit_probability', type=float, default=0.2,
+                    help='Probability of requesting a batch again after submitting it (default: 0.2).')
+    parser.add_argument('--think_time', type=float, default=0.0,
+                    help='Mean time in seconds annotators wait between requests; zero for maximum load (default: 0).')
+    parser.add_argument('--timeout', type=float, default=60,
+                    help='Request timeout in seconds (default: 60).')
+    parser.add_argument('--seed', type=int, default=0,
+                    help='Random seed (default: 0).')
+    parser.add_argument('--json', action='store_true',
+                    help='Print results as JSON.')
+    args = parser.parse_args()
+
+    result = run(args)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print('{} users, {:.1f}s: {} requests ({:.2f}/s), {} images annotated ({:.2f}/s)'.format(
+            result['num_users'], result['duration'], result['num_requests'], result['requests_per_second'],
+            result['num_images_annotated'], result['images_per_second']))
+        for endpoint, r in result['endpoints'].items():
+            if r['count']:
+                print('{}: {} requests, {} errors, p50 {:.4f}s, p95 {:.4f}s, p99 {:.4f}s, max {:.4f}s'.format(
+                    endpoint, r['count'], r['errors'], r['p50'], r['p95'], r['p99'], r['max']))
+            else:
+                print(f'{endpoint}: {r["errors"]} errors')
+        for message in result['error_messages']:
+            print(f'Error: {message}')
+        if result['num_images_annotated'] == 0:
+            print('No images annotated; the project may not contain any images that have not been viewed yet.')
+    if result['num_requests'] == 0 or all(r['count'] == 0 for r in result['endpoints'].values()):
+        sys.exit(1)
@@ -0,0 +1,458 @@
+'''
+    Microbenchmarks for the hot paths of AIDE:
+    - LabelUI:              getBatch_auto, getBatch_fixed, submitAnnotations
+    - DataAdministration:   listImages, prepareDataDownload (with and
+                            without the export cache)
+    - ProjectStatistics:    getPerformanceStatistics
+    - AIWorker:             _call_inference with a dummy model (metadata
+                            loading, ranking, parsing and storing of the
+                            predictions)
+    - AL criteria:          vectorized ranking of a prediction chunk
+    - models / utilities:   non-maximum suppression (requires PyTorch) and
+                            image sharding (in memory and windowed)
+
+    Benchmarks that access the database run on an existing project, ideally
+    a synthetic one created with "syntheticProject.py"; they are skipped if
+    no project is specified. Note that they modify the project (submitted
+    annotations replace the ones of the first user; predictions made during
+    the benchmark are removed afterwards).
+
+    Each benchmark is run once (reported separately as the cold time) and
+    then a number of times, of which the median, 95th percentile, minimum
+    and mean durations are reported. Results can be stored as JSON and
+    compared to a previous run to detect regressions.
+
+    Usage:
+        export AIDE_CONFIG_PATH=config/settings.ini
+        export AIDE_MODULES=LabelUI
+        export PYTHONPATH=.
+        python benchmarks/microbenchmarks.py --project benchmark --output results.json
+        python benchmarks/microbenchmarks.py --project benchmark --baseline results.json --max_regression 0.2
+
+    2021 Benjamin Kellenberger
+'''
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import contextlib
+from datetime import datetime
+from collections import OrderedDict
+import numpy as np
+from psycopg2 import sql
+from PIL import Image
+
+
+BENCHMARKS = OrderedDict()      # name: (function, requires project)
+
+
+def benchmark(name, requiresProject=True):
+    '''
+        Registers a benchmark. The decorated function receives the bench-
+        mark context and returns the function to be timed (without argu-
+        ments).
+    '''
+    def _register(fun):
+        BENCHMARKS[name] = (fun, requiresProject)
+        return fun
+    return _register
+
+
+
+class BenchmarkContext:
+
+    def __init__(self, args):
+        self.args = args
+        self.rnd = np.random.RandomState(args.seed)
+        self.cleanup = []       # functions to be called after each benchmark
+        self._middlewares = {}
+
+        self.project = args.project
+        if self.project is None:
+            return
+
+        from util.configDef import Config
+        from modules.Database.app import Database
+        self.config = Config()
+        self.dbConnector = Database(self.config)
+
+        meta = self.dbConnector.execute('''
+            SELECT annotationType, predictionType, owner
+            FROM aide_admin.project
+            WHERE shortname = %s;
+        ''', (self.project,), 1)
+        if meta is None or not len(meta):
+            raise Exception(f'Project "{self.project}" does not exist.')
+        self.annotationType = meta[0]['annotationtype']
+        self.predictionType = meta[0]['predictiontype']
+        users = self.dbConnector.execute('''
+            SELECT username FROM aide_admin.authentication
+            WHERE project = %s
+            ORDER BY username;
+        ''', (self.project,), 'all')
+        self.users = [meta[0]['owner']] + [u['username'] for u in users if u['username'] != meta[0]['owner']]
+
+        self.imageIDs = [str(r['id']) for r in self.dbConnector.execute(sql.SQL('''
+            SELECT id FROM {id_img} ORDER BY filename;
+        ''').format(id_img=sql.Identifier(self.project, 'image')), None, 'all')]
+        self.labelClasses = [str(r['id']) for r in self.dbConnector.execute(sql.SQL('''
+            SELECT id FROM {id_lc} ORDER BY idx;
+        ''').format(id_lc=sql.Identifier(self.project, 'labelclass')), None, 'all')]
+
+        self.imageSize = (256, 192)
+        if self.annotationType == 'segmentationMasks':
+            size = self.dbConnector.execute(sql.SQL('''
+                SELECT width, height FROM {id_anno} LIMIT 1;
+            ''').format(id_anno=sql.Identifier(self.project, 'annotation')), None, 1)
+            if len(size):
+                self.imageSize = (int(size[0]['width']), int(size[0]['height']))
+
+
+    def middleware(self, name):
+        '''
+            Returns a (shared) instance of a module's middleware.
+        '''
+        if name not in self._middlewares:
+            if name == 'LabelUI':
+                from modules.LabelUI.backend.middleware import DBMiddleware
+                self._middlewares[name] = DBMiddleware(self.config)
+            elif name == 'DataWorker':
+                from modules.DataAdministration.backend.dataWorker import DataWorker
+                self._middlewares[name] = DataWorker(self.config, passiveMode=True)
+            elif name == 'ProjectStatistics':
+                from modules.ProjectStatistics.backend.middleware import ProjectStatisticsMiddleware
+                self._middlewares[name] = ProjectStatisticsMiddleware(self.config)
+        return self._middlewares[name]
+
+
+    def sample_images(self):
+        num = min(self.args.batch_size, len(self.imageIDs))
+        return [self.imageIDs[i] for i in self.rnd.choice(len(self.imageIDs), num, replace=False)]
+
+
+    def random_logits(self, num, numClasses):
+        logits = self.rnd.rand(num, numClasses).astype(np.float32)
+        return logits / logits.sum(1, keepdims=True)
+
+
+
+''' LabelUI '''
+@benchmark('getBatch_auto')
+def _getBatch_auto(ctx):
+    middleware = ctx.middleware('LabelUI')
+    return lambda: middleware.getBatch_auto(ctx.project, ctx.users[0], limit=ctx.args.batch_size)
+
+
+@benchmark('getBatch_fixed')
+def _getBatch_fixed(ctx):
+    middleware = ctx.middleware('LabelUI')
+    imageIDs = ctx.sample_images()
+    return lambda: middleware.getBatch_fixed(ctx.project, ctx.users[0], imageIDs)
+
+
+@benchmark('submitAnnotations')
+def _submitAnnotations(ctx):
+    from benchmarks.syntheticProject import make_submission
+    middleware = ctx.middleware('LabelUI')
+    submission = make_submission(ctx.rnd, ctx.annotationType, ctx.sample_images(), ctx.labelClasses,
+                                imageSize=ctx.imageSize)
+    return lambda: middleware.submitAnnotations(ctx.project, ctx.users[0], submission)
+
+
+
+''' DataAdministration '''
+@benchmark('listImages')
+def _listImages(ctx):
+    worker = ctx.middleware('DataWorker')
+    return lambda: worker.listImages(ctx.project)
+
+
+@benchmark('prepareDataDownload')
+def _prepareDataDownload(ctx):
+    from modules.DataAdministration.backend.dataWorker import DataWorker
+    worker = DataWorker(ctx.config, passiveMode=True)
+    worker.exportCache.maxSize = 0      # disable cache
+    return lambda: worker.prepareDataDownload(ctx.project, 'annotation')
+
+
+@benchmark('prepareDataDownload_cached')
+def _prepareDataDownload_cached(ctx):
+    worker = ctx.middleware('DataWorker')
+    return lambda: worker.prepareDataDownload(ctx.project, 'annotation')
+
+
+
+''' ProjectStatistics '''
+@benchmark('getPerformanceStatistics')
+def _getPerformanceStatistics(ctx):
+    middleware = ctx.middleware('ProjectStatistics')
+    return lambda: middleware.getPerformanceStatistics(ctx.project, ctx.users[1:], ctx.users[0], 'user', 0.5, True)
+
+
+
+''' AIWorker '''
+class _DummyModel:
+    '''
+        Returns random predictions (with class confidences) for all images
+        without loading them.
+    '''
+
+    def __init__(self, predictionType, imageSize, numPredictions, rnd):
+        self.predictionType = predictionType
+        self.imageSize = imageSize
+        self.numPredictions = numPredictions
+        self.rnd = rnd
+
+    def inference(self, stateDict, data, updateStateFun):
+        from util.predictionChunk import PredictionChunk
+        labelClasses = [str(lc) for lc in data['labelClasses'].keys()]
+        numClasses = len(labelClasses)
+        chunk = PredictionChunk()
+        for idx, imgID in enumerate(data['images'].keys()):
+            if self.predictionType == 'segmentationMasks':
+                logits = self.rnd.rand(numClasses, self.imageSize[1], self.imageSize[0]).astype(np.float32)
+                chunk.add_mask(imgID, label=np.argmax(logits, 0), logits=logits)
+            else:
+                num = (1 if self.predictionType == 'labels' else self.numPredictions)
+                logits = self.rnd.rand(num, numClasses).astype(np.float32)
+                logits /= logits.sum(1, keepdims=True)
+                fields = {
+                    'label': [labelClasses[l] for l in np.argmax(logits, 1)],
+                    'confidence': np.max(logits, 1)
+                }
+                if self.predictionType in ('points', 'boundingBoxes'):
+                    fields['x'] = self.rnd.rand(num)
+                    fields['y'] = self.rnd.rand(num)
+                if self.predictionType == 'boundingBoxes':
+                    fields['width'] = self.rnd.rand(num) * 0.2
+                    fields['height'] = self.rnd.rand(num) * 0.2
+                chunk.add(imgID, logits=logits, **fields)
+            updateStateFun(state='PROGRESS', message='predicting', done=idx+1, total=len(data['images']))
+        return chunk
+
+
+@benchmark('_call_inference')
+def _call_inference(ctx):
+    from modules.AIWorker.backend.worker import functional
+    from ai.al.builtins.maxconfidence import MaxConfidence
+    model = _DummyModel(ctx.predictionType, ctx.imageSize, ctx.args.num_predictions_per_image, ctx.rnd)
+    rankFun = MaxConfidence(ctx.project, ctx.config, ctx.dbConnector, None, None).rank
+    imageIDs = ctx.sample_images()
+    startTime = ctx.dbConnector.execute('SELECT NOW() AS now;', None, 1)[0]['now']
+
+    def _remove_predictions():
+        ctx.dbConnector.execute(sql.SQL('''
+            DELETE FROM {id_pred} WHERE timeCreated >= %s;
+        ''').format(id_pred=sql.Identifier(ctx.project, 'prediction')), (startTime,), None)
+    ctx.cleanup.append(_remove_predictions)
+
+    return lambda: functional._call_inference(ctx.project, imageIDs, 1, 1, model.inference, rankFun,
+                                            ctx.dbConnector, None, -1)
+
+
+
+''' AL criteria '''
+@benchmark('al_ranking', requiresProject=False)
+def _al_ranking(ctx):
+    from util.predictionChunk import PredictionChunk
+    from ai.al.functional.noarch import ranking
+    from ai.al.functional.noarch.functional import max_confidence, breaking_ties
+    chunk = PredictionChunk()
+    numImages = max(1, ctx.args.num_predictions // ctx.args.num_predictions_per_image)
+    for imgID in range(numImages):
+        logits = ctx.random_logits(ctx.args.num_predictions_per_image, ctx.args.num_classes)
+        chunk.add(imgID, logits=logits, confidence=np.max(logits, 1))
+    return lambda: ranking.rank(chunk, [max_confidence, breaking_ties])
+
+
+
+''' models and utilities '''
+@benchmark('box_nms', requiresProject=False)
+def _box_nms(ctx):
+    import torch
+    from ai.models.pytorch.functional._retinanet.utils import box_nms
+    xy = torch.from_numpy(ctx.rnd.rand(ctx.args.num_boxes, 2).astype(np.float32)) * 1000
+    wh = torch.from_numpy(ctx.rnd.rand(ctx.args.num_boxes, 2).astype(np.float32)) * 100 + 10
+    bboxes = torch.cat((xy, xy + wh), 1)
+    scores = torch.from_numpy(ctx.rnd.rand(ctx.args.num_boxes).astype(np.float32))
+    return lambda: box_nms(bboxes, scores, 0.5)
+
+
+def _shard_image(ctx):
+    size = ctx.args.shard_image_size
+    pixels = ctx.rnd.randint(0, 256, (size, size, 3), dtype=np.uint8)
+    return Image.fromarray(pixels)
+
+
+@benchmark('split_image', requiresProject=False)
+def _split_image(ctx):
+    from util.imageSharding import split_image
+    img = _shard_image(ctx)
+    return lambda: split_image(img, ctx.args.patch_size, ctx.args.patch_size // 2)
+
+
+@benchmark('split_image_windowed', requiresProject=False)
+def _split_image_windowed(ctx):
+    from util.imageSharding import split_image_windowed
+    tempDir = tempfile.TemporaryDirectory()
+    ctx.cleanup.append(tempDir.cleanup)
+    filePath = os.path.join(tempDir.name, 'image.tif')
+    _shard_image(ctx).save(filePath, tiffinfo={322: 256, 323: 256})       # tile width and height
+    def _split():
+        for _ in split_image_windowed(filePath, ctx.args.patch_size, ctx.args.patch_size // 2):
+            pass
+    return _split
+
+
+
+def measure(fun, numRepetitions):
+    '''
+        Calls "fun" once (cold) and then "numRepetitions" times and returns
+        the durations in seconds.
+    '''
+    tic = time.perf_counter()
+    fun()
+    result = {
+        'first': time.perf_counter() - tic
+    }
+    times = []
+    for _ in range(numRepetitions):
+        tic = time.perf_counter()
+        fun()
+        times.append(time.perf_counter() - tic)
+    if len(times):
+        result.update({
+            'median': float(np.median(times)),
+            'p95': float(np.percentile(times, 95)),
+            'min': float(np.min(times)),
+            'mean': float(np.mean(times))
+        })
+    return result
+
+
+def run_benchmark(ctx, name):
+    fun, requiresProject = BENCHMARKS[name]
+    result = {
+        'name': name
+    }
+    if requiresProject and ctx.project is None:
+        result['status'] = 'skipped'
+        result['message'] = 'no project specified'
+        return result
+    try:
+        # keep console output of AIDE's functions away from the results
+        with contextlib.redirect_stdout(sys.stderr):
+            result.update(measure(fun(ctx), ctx.args.num_repetitions))
+        result['status'] = 'ok'
+    except ImportError as e:
+        result['status'] = 'skipped'
+        result['message'] = str(e)
+    except Exception as e:
+        result['status'] = 'failed'
+        result['message'] = str(e)
+    finally:
+        for cleanupFun in ctx.cleanup:
+            cleanupFun()
+        ctx.cleanup = []
+    return result
+
+
+def compare(results, baseline, maxRegression):
+    '''
+        Returns the benchmarks whose median duration exceeds the one of the
+        baseline by more than the given fraction.
+    '''
+    baselineTimes = dict((r['name'], r['median']) for r in baseline['results'] if 'median' in r)
+    regressions = []
+    for r in results:
+        if 'median' in r and r['name'] in baselineTimes:
+            ratio = r['median'] / max(baselineTimes[r['name']], 1e-9)
+            r['baseline_ratio'] = ratio
+            if ratio > 1 + maxRegression:
+                regressions.append(r['name'])
+    return regressions
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Run microbenchmarks of AIDE\'s hot paths.')
+    parser.add_argument('--project', type=str, default=None,
+                    help='Shortname of the (synthetic) project to run the database benchmarks on; they are skipped if not provided.')
+    parser.add_argument('--benchmarks', type=str, nargs='+', default=list(BENCHMARKS.keys()), choices=list(BENCHMARKS.keys()),
+                    help='Benchmark(s) to run (default: all).')
+    parser.add_argument('--num_repetitions', type=int, default=10,
+                    help='Number of timed runs after the first (cold) one (default: 10).')
+    parser.add_argument('--batch_size', type=int, default=32,
+                    help='Number of images per batch, submission and inference call (default: 32).')
+    parser.add_argument('--num_predictions', type=int, default=100000,
+                    help='Number of predictions to rank (default: 100000).')
+    parser.add_argument('--num_predictions_per_image', type=int, default=20,
+                    help='Number of predictions per image made by the dummy model and for ranking (default: 20).')
+    parser.add_argument('--num_classes', type=int, default=10,
+                    help='Number of classes of the predictions to rank (default: 10).')
+    parser.add_argument('--num_boxes', type=int, default=5000,
+                    help='Number of bounding boxes for non-maximum suppression (default: 5000).')
+    parser.add_argument('--shard_image_size', type=int, default=4096,
+                    help='Width and height of the image to split into patches (default: 4096).')
+    parser.add_argument('--patch_size', type=int, default=512,
+                    help='Patch size for image sharding; the stride is half of it (default: 512).')
+    parser.add_argument('--seed', type=int, default=0,
+                    help='Random seed (default: 0).')
+    parser.add_argument('--output', type=str, default=None,
+                    help='File to store the results in (JSON).')
+    parser.add_argument('--baseline', type=str, default=None,
+                    help='Results of a previous run (JSON) to compare the median durations to.')
+    parser.add_argument('--max_regression', type=float, default=0.2,
+                    help='Exit with an error if any median duration exceeds the baseline by more than this fraction (default: 0.2).')
+    parser.add_argument('--json', action='store_true',
+                    help='Print results as JSON.')
+    args = parser.parse_args()
+
+    if args.project is not None and not 'AIDE_CONFIG_PATH' in os.environ:
+        raise ValueError('Missing system environment variable "AIDE_CONFIG_PATH".')
+
+    ctx = BenchmarkContext(args)
+    output = {
+        'meta': {
+            'project': args.project,
+            'annotation_type': getattr(ctx, 'annotationType', None),
+            'prediction_type': getattr(ctx, 'predictionType', None),
+            'num_images': len(getattr(ctx, 'imageIDs', [])),
+            'args': vars(args),
+            'host': socket.gethostname(),
+            'python': sys.version.split(' ')[0],
+            'timestamp': datetime.now().isoformat()
+        },
+        'results': []
+    }
+    for name in args.benchmarks:
+        result = run_benchmark(ctx, name)
+        output['results'].append(result)
+        if not args.json:
+            if result['status'] != 'ok':
+                print(f'{name}: {result["status"]} ({result["message"]})')
+            else:
+                print('{}: first {:.4f}s, median {:.4f}s, p95 {:.4f}s, min {:.4f}s'.format(
+                    name, result['first'], result.get('median', result['first']),
+                    result.get('p95', result['first']), result.get('min', result['first'])))
+
+    regressions = []
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(output['results'], baseline, args.max_regression)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+    if args.json:
+        print(json.dumps(output, indent=2))
+
+    if len(regressions):
+        print('Median duration regressed by more than {:.0%} for: {}'.format(args.max_regression, ', '.join(regressions)), file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,400 @@
+'''
+    Creates a synthetic project for benchmarking (see "microbenchmarks.py"
+    and "loadDriver.py").
+
+    The project is created through the same code path as in the project
+    configuration page ("ProjectConfigMiddleware.createProject"), so that
+    its schema is identical to the one of a real project. It is then
+    populated with a number of label classes, images, annotations of a
+    number of users and predictions of a (dummy) model state. Values are
+    random, but reproducible with the same seed:
+    - golden question images are annotated by all users, with slightly
+      perturbed copies of the same geometries (so that the performance
+      statistics are meaningful);
+    - of the remaining images, a fraction is annotated by one user each;
+    - all images have predictions with random confidences and priorities.
+    Users are named "<project>_user<index>" and are created if they do not
+    exist yet. The first user owns the project and is its administrator.
+
+    Images are not written to disk unless requested; the database entries
+    suffice for all benchmarks that do not load image data.
+
+    Usage:
+        export AIDE_CONFIG_PATH=config/settings.ini
+        export AIDE_MODULES=FileServer
+        export PYTHONPATH=.
+        python benchmarks/syntheticProject.py --project bench --num_images 10000 --num_annotations 5
+
+    2021 Benjamin Kellenberger
+'''
+
+import os
+import sys
+import json
+import contextlib
+import importlib
+import base64
+import argparse
+from datetime import datetime, timedelta
+import numpy as np
+import psycopg2
+import pytz
+from psycopg2 import sql
+from PIL import Image
+
+
+ANNOTATION_TYPES = ('labels', 'points', 'boundingBoxes', 'segmentationMasks')
+
+INSERT_CHUNK_SIZE = 10000
+
+# fixed number of entries per image for these types
+SINGLE_ENTRY_TYPES = ('labels', 'segmentationMasks')
+
+
+def user_names(project, numUsers):
+    return [f'{project}_user{idx}' for idx in range(numUsers)]
+
+
+def _insert(dbConnector, queryStr, values):
+    for idx in range(0, len(values), INSERT_CHUNK_SIZE):
+        dbConnector.insert(queryStr, values[idx:idx+INSERT_CHUNK_SIZE])
+
+
+def _random_mask(rnd, width, height, numClasses):
+    '''
+        Returns a base64-encoded segmentation mask (as stored by the
+        LabelUI) with a few random rectangles of label class indices.
+    '''
+    mask = np.zeros((height, width), dtype=np.uint8)
+    for _ in range(rnd.randint(1, 6)):
+        x, y = rnd.randint(0, width), rnd.randint(0, height)
+        w, h = rnd.randint(1, max(2, width//4)), rnd.randint(1, max(2, height//4))
+        mask[y:y+h, x:x+w] = rnd.randint(1, numClasses+1)
+    return base64.b64encode(mask.ravel()).decode('utf-8')
+
+
+def _geometries(rnd, annotationType, num):
+    '''
+        Returns "num" random geometries (dicts of coordinates, relative to
+        the image size) for the given annotation type.
+    '''
+    if annotationType == 'points':
+        return [{'x': x, 'y': y} for x, y in rnd.uniform(0.05, 0.95, (num, 2)).tolist()]
+    elif annotationType == 'boundingBoxes':
+        wh = rnd.uniform(0.02, 0.2, (num, 2))
+        xy = rnd.uniform(0, 1, (num, 2)) * (1 - wh) + wh/2
+        return [{'x': b[0], 'y': b[1], 'width': b[2], 'height': b[3]}
+                for b in np.concatenate((xy, wh), 1).tolist()]
+    return [{} for _ in range(num)]
+
+
+def _jitter(rnd, geometry, amount=0.01):
+    return dict((key, min(1.0, max(0.0, val + rnd.normal(0, amount)))) for key, val in geometry.items())
+
+
+def make_submission(rnd, annotationType, imageIDs, labelClasses, numAnnotations=5, imageSize=(256, 192)):
+    '''
+        Returns a submission of random (new) annotations for the given image
+        IDs in the format sent by the labeling UI to "submitAnnotations".
+    '''
+    now = datetime.now(tz=pytz.utc).isoformat()
+    numPerImage = (1 if annotationType in SINGLE_ENTRY_TYPES else numAnnotations)
+    entries = {}
+    for imgID in imageIDs:
+        annotations = []
+        for geometry in _geometries(rnd, annotationType, numPerImage):
+            annotation = {
+                'timeCreated': now,
+                'timeRequired': int(rnd.randint(100, 5000))
+            }
+            if annotationType == 'segmentationMasks':
+                annotation['segmentationMask'] = _random_mask(rnd, imageSize[0], imageSize[1], len(labelClasses))
+                annotation['width'], annotation['height'] = imageSize
+            else:
+                annotation['label'] = labelClasses[rnd.randint(0, len(labelClasses))]
+                annotation['unsure'] = False
+                if len(geometry):
+                    annotation['geometry'] = geometry
+            annotations.append(annotation)
+        entries[str(imgID)] = {
+            'annotations': annotations,
+            'timeCreated': now,
+            'timeRequired': int(rnd.randint(1000, 60000)),
+            'numInteractions': len(annotations)
+        }
+    return {
+        'entries': entries,
+        'meta': {'source': 'benchmark'}
+    }
+
+
+
+class SyntheticProject:
+
+    def __init__(self, config, project, annotationType='boundingBoxes', predictionType=None,
+                numUsers=4, password='benchmark', seed=0):
+        from modules.Database.app import Database
+        self.config = config
+        self.dbConnector = Database(config)
+        self.project = project
+        self.annotationType = annotationType
+        self.predictionType = (predictionType if predictionType is not None else annotationType)
+        self.users = user_names(project, numUsers)
+        self.password = password
+        self.rnd = np.random.RandomState(seed)
+
+
+    def _create_users(self):
+        from modules.UserHandling.backend.middleware import UserMiddleware
+        from modules.UserHandling.backend.exceptions import AccountExistsException
+        userMiddleware = UserMiddleware(self.config)
+        for username in self.users:
+            try:
+                userMiddleware.createAccount(username, self.password, f'{username}@localhost')
+            except AccountExistsException:
+                pass
+
+
+    def create(self, replace=False):
+        '''
+            Creates the users and the project. If the project already exists,
+            it is deleted first if "replace" is True, otherwise an exception
+            is raised.
+        '''
+        importlib.import_module('celery_worker')     # Celery configuration for notifying the FileServer(s)
+        from modules.ProjectAdministration.backend.middleware import ProjectConfigMiddleware
+        projectMiddleware = ProjectConfigMiddleware(self.config)
+        if not projectMiddleware.getProjectShortNameAvailable(self.project):
+            if not replace:
+                raise Exception(f'Project "{self.project}" already exists (use "--replace" to overwrite it).')
+            from modules.DataAdministration.backend.dataWorker import DataWorker
+            with contextlib.redirect_stdout(sys.stderr):
+                DataWorker(self.config, passiveMode=True).deleteProject(self.project, deleteFiles=False)
+
+        self._create_users()
+        projectMiddleware.createProject(self.users[0], {
+            'shortname': self.project,
+            'name': self.project,
+            'description': 'Synthetic project for benchmarks',
+            'annotationType': self.annotationType,
+            'predictionType': self.predictionType
+        })
+
+        # enable interface and register remaining users as members
+        self.dbConnector.execute('''
+            UPDATE aide_admin.project
+            SET interface_enabled = TRUE
+            WHERE shortname = %s;
+        ''', (self.project,), None)
+        if len(self.users) > 1:
+            self.dbConnector.insert('''
+                INSERT INTO aide_admin.authentication (username, project, isAdmin)
+                VALUES %s
+                ON CONFLICT DO NOTHING;
+            ''', [(u, self.project, False) for u in self.users[1:]])
+
+
+    def populate(self, numImages, numAnnotations, numPredictions, numClasses=10,
+                goldenFraction=0.05, annotatedFraction=0.5, imageSize=(256, 192)):
+        '''
+            Adds label classes, images, annotations and predictions to the
+            (empty) project. "numAnnotations" and "numPredictions" are the
+            numbers per image (and user, for annotations); they are ignored
+            for image labels and segmentation masks (one entry per image).
+            Returns a dict with the numbers of entries created.
+        '''
+        rnd = self.rnd
+        now = datetime.now(tz=pytz.utc)
+        width, height = imageSize
+
+        # label classes
+        queryStr = sql.SQL('''
+            INSERT INTO {id_lc} (name, color)
+            VALUES %s;
+        ''').format(id_lc=sql.Identifier(self.project, 'labelclass'))
+        _insert(self.dbConnector, queryStr, [(f'class_{c}', '#{:06x}'.format(rnd.randint(0, 0xffffff))) for c in range(numClasses)])
+        labelClasses = [str(r['id']) for r in self.dbConnector.execute(sql.SQL('''
+            SELECT id FROM {id_lc} ORDER BY idx;
+        ''').format(id_lc=sql.Identifier(self.project, 'labelclass')), None, 'all')]
+
+        # images
+        isGolden = rnd.rand(numImages) < goldenFraction
+        queryStr = sql.SQL('''
+            INSERT INTO {id_img} (filename, isGoldenQuestion, date_added)
+            VALUES %s;
+        ''').format(id_img=sql.Identifier(self.project, 'image'))
+        _insert(self.dbConnector, queryStr, [
+            (f'synthetic/{idx:08d}.jpg', bool(isGolden[idx]), now - timedelta(days=30, seconds=idx))
+            for idx in range(numImages)
+        ])
+        images = self.dbConnector.execute(sql.SQL('''
+            SELECT id, filename, isGoldenQuestion FROM {id_img} ORDER BY filename;
+        ''').format(id_img=sql.Identifier(self.project, 'image')), None, 'all')
+
+        # dummy model state
+        stateID = self.dbConnector.execute(sql.SQL('''
+            INSERT INTO {id_cnnstate} (model_library, stateDict, partial)
+            VALUES (%s, %s, FALSE)
+            RETURNING id;
+        ''').format(id_cnnstate=sql.Identifier(self.project, 'cnnstate')),
+            ('synthetic', psycopg2.Binary(b'synthetic')), 1)[0]['id']
+
+        # annotations and views
+        numPerImage = (1 if self.annotationType in SINGLE_ENTRY_TYPES else numAnnotations)
+        values_anno = []
+        values_iu = []
+        for idx, img in enumerate(images):
+            if img['isgoldenquestion']:
+                annotators = self.users
+            elif rnd.rand() < annotatedFraction:
+                annotators = [self.users[idx % len(self.users)]]
+            else:
+                continue
+            geometries = _geometries(rnd, self.annotationType, numPerImage)
+            labels = rnd.randint(0, numClasses, numPerImage)
+            mask = (_random_mask(rnd, width, height, numClasses) if self.annotationType == 'segmentationMasks' else None)
+            for username in annotators:
+                timeCreated = now - timedelta(seconds=int(rnd.randint(0, 30*86400)))
+                timeRequired = int(rnd.randint(1000, 60000))
+                values_iu.append((username, img['id'], 1, timeCreated, timeCreated, timeRequired, timeRequired, int(rnd.randint(1, 20))))
+                for a in range(numPerImage):
+                    if self.annotationType == 'segmentationMasks':
+                        values_anno.append((username, img['id'], timeCreated, timeRequired, mask, width, height))
+                        continue
+                    geometry = _jitter(rnd, geometries[a])
+                    values_anno.append((username, img['id'], timeCreated, timeRequired, False,
+                                        labelClasses[labels[a]]) + tuple(geometry.values()))
+
+        if self.annotationType == 'segmentationMasks':
+            fields = ['segmentationMask', 'width', 'height']
+        else:
+            fields = ['unsure', 'label'] + list(_geometries(rnd, self.annotationType, 1)[0].keys())
+        queryStr = sql.SQL('''
+            INSERT INTO {id_anno} (username, image, timeCreated, timeRequired, {fields})
+            VALUES %s;
+        ''').format(
+            id_anno=sql.Identifier(self.project, 'annotation'),
+            fields=sql.SQL(', ').join([sql.Identifier(f.lower()) for f in fields])
+        )
+        _insert(self.dbConnector, queryStr, values_anno)
+
+        queryStr = sql.SQL('''
+            INSERT INTO {id_iu} (username, image, viewcount, first_checked, last_checked,
+                last_time_required, total_time_required, num_interactions)
+            VALUES %s;
+        ''').format(id_iu=sql.Identifier(self.project, 'image_user'))
+        _insert(self.dbConnector, queryStr, values_iu)
+
+        # predictions
+        numPerImage = (1 if self.predictionType in SINGLE_ENTRY_TYPES else numPredictions)
+        values_pred = []
+        for img in images:
+            if self.predictionType == 'segmentationMasks':
+                values_pred.append((img['id'], stateID, float(rnd.rand()), float(rnd.rand()),
+                                    _random_mask(rnd, width, height, numClasses), width, height))
+                continue
+            labels = rnd.randint(0, numClasses, numPerImage)
+            for a, geometry in enumerate(_geometries(rnd, self.predictionType, numPerImage)):
+                values_pred.append((img['id'], stateID, float(rnd.rand()), float(rnd.rand()),
+                                    labelClasses[labels[a]]) + tuple(geometry.values()))
+
+        if self.predictionType == 'segmentationMasks':
+            fields = ['segmentationMask', 'width', 'height']
+        else:
+            fields = ['label'] + list(_geometries(rnd, self.predictionType, 1)[0].keys())
+        queryStr = sql.SQL('''
+            INSERT INTO {id_pred} (image, cnnstate, confidence, priority, {fields})
+            VALUES %s;
+        ''').format(
+            id_pred=sql.Identifier(self.project, 'prediction'),
+            fields=sql.SQL(', ').join([sql.Identifier(f.lower()) for f in fields])
+        )
+        _insert(self.dbConnector, queryStr, values_pred)
+
+        return {
+            'num_label_classes': len(labelClasses),
+            'num_images': len(images),
+            'num_golden_questions': int(np.sum(isGolden)),
+            'num_annotations': len(values_anno),
+            'num_views': len(values_iu),
+            'num_predictions': len(values_pred)
+        }
+
+
+    def write_images(self, imageSize=(256, 192)):
+        '''
+            Writes random JPEG images for all images of the project into the
+            FileServer's directory.
+        '''
+        baseDir = os.path.join(self.config.getProperty('FileServer', 'staticfiles_dir'), self.project)
+        images = self.dbConnector.execute(sql.SQL('''
+            SELECT filename FROM {id_img};
+        ''').format(id_img=sql.Identifier(self.project, 'image')), None, 'all')
+        for img in images:
+            filePath = os.path.join(baseDir, img['filename'])
+            os.makedirs(os.path.dirname(filePath), exist_ok=True)
+            pixels = self.rnd.randint(0, 256, (imageSize[1], imageSize[0], 3), dtype=np.uint8)
+            Image.fromarray(pixels).save(filePath, quality=75)
+        return len(images)
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Create a synthetic project for benchmarks.')
+    parser.add_argument('--project', type=str, default='benchmark',
+                    help='Shortname of the project to create (default: "benchmark").')
+    parser.add_argument('--annotation_type', type=str, default='boundingBoxes', choices=ANNOTATION_TYPES,
+                    help='Annotation type of the project (default: boundingBoxes).')
+    parser.add_argument('--prediction_type', type=str, default=None, choices=ANNOTATION_TYPES,
+                    help='Prediction type of the project (default: same as annotation type).')
+    parser.add_argument('--num_images', type=int, default=1000,
+                    help='Number of images (default: 1000).')
+    parser.add_argument('--num_annotations', type=int, default=5,
+                    help='Number of annotations per image and user (points and bounding boxes; default: 5).')
+    parser.add_argument('--num_predictions', type=int, default=5,
+                    help='Number of predictions per image (points and bounding boxes; default: 5).')
+    parser.add_argument('--num_classes', type=int, default=10,
+                    help='Number of label classes (default: 10).')
+    parser.add_argument('--num_users', type=int, default=4,
+                    help='Number of annotating users (default: 4).')
+    parser.add_argument('--password', type=str, default='benchmark',
+                    help='Password of newly created users (default: "benchmark").')
+    parser.add_argument('--golden_fraction', type=float, default=0.05,
+                    help='Fraction of images that are golden questions, annotated by all users (default: 0.05).')
+    parser.add_argument('--annotated_fraction', type=float, default=0.5,
+                    help='Fraction of the other images that are annotated by one user (default: 0.5).')
+    parser.add_argument('--image_size', type=int, nargs=2, default=[256, 192],
+                    help='Width and height of the images and segmentation masks (default: 256 192).')
+    parser.add_argument('--write_images', action='store_true',
+                    help='Write random images into the FileServer directory.')
+    parser.add_argument('--replace', action='store_true',
+                    help='Delete the project first if it exists.')
+    parser.add_argument('--seed', type=int, default=0,
+                    help='Random seed (default: 0).')
+    parser.add_argument('--json', action='store_true',
+                    help='Print results as JSON.')
+    args = parser.parse_args()
+
+    if not 'AIDE_CONFIG_PATH' in os.environ:
+        raise ValueError('Missing system environment variable "AIDE_CONFIG_PATH".')
+    if not 'AIDE_MODULES' in os.environ:
+        raise ValueError('Missing system environment variable "AIDE_MODULES".')
+
+    from util.configDef import Config
+    synthetic = SyntheticProject(Config(), args.project, args.annotation_type, args.prediction_type,
+                                args.num_users, args.password, args.seed)
+    synthetic.create(args.replace)
+    result = synthetic.populate(args.num_images, args.num_annotations, args.num_predictions, args.num_classes,
+                                args.golden_fraction, args.annotated_fraction, tuple(args.image_size))
+    if args.write_images:
+        synthetic.write_images(tuple(args.image_size))
+    result['project'] = args.project
+    result['users'] = synthetic.users
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print('Created project "{}" with {}.'.format(args.project,
+            ', '.join(f'{val} {key[4:].replace("_", " ")}' for key, val in result.items() if key.startswith('num_'))))
+        print('Users: {} (password of new users: "{}")'.format(', '.join(result['users']), args.password))
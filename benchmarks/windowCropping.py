@@ -0,0 +1,153 @@
+'''
+    Benchmark for the 'windowCropping' mode of
+    "ai.extras._functional.windowCropping.WindowCropper".
+
+    Generates synthetic images with many (clustered) bounding
+    boxes, runs the vectorized window search as well as the
+    original loop-based reference implementation (kept here for
+    comparison) and checks that both select the same patches.
+
+    Usage:
+        export PYTHONPATH=.
+        python benchmarks/windowCropping.py --num_boxes 500 1000
+
+    2021 Benjamin Kellenberger
+'''
+
+import time
+import argparse
+import numpy as np
+from ai.extras._functional.windowCropping import WindowCropper
+
+
+def reference_positions(cropper, bboxes, sz):
+    '''
+        Original (scalar) implementation of the window search, with boxes
+        in XYWH format. Clustering is identical to the vectorized version.
+    '''
+    from sklearn.cluster import KMeans
+    coordsX, coordsY = [], []
+    bboxes_covered = set()
+    bboxIndices = np.arange(len(bboxes))
+    numClusters = np.max([2, np.sqrt(len(bboxes))]).astype(int)
+    kmeans = KMeans(n_clusters=numClusters).fit(bboxes[:,0:2])
+    count = np.zeros(numClusters)
+    distances = np.zeros(len(bboxes))
+    for i in range(numClusters):
+        bboxes_cluster = bboxes[kmeans.labels_==i, 0:2]
+        count[i] = len(bboxes_cluster)
+        distances[kmeans.labels_==i] = np.sum((bboxes_cluster - kmeans.cluster_centers_[i, :]) ** 2, 1)
+    cluOrder = np.argsort(count)[::-1]
+    patchSize, searchStride = cropper.patchSize, cropper.searchStride
+
+    def _inside(b, x, y):
+        return max(0, bboxes[b, 0] - bboxes[b, 2]/2) >= x and \
+            min(sz[0]-1, bboxes[b, 0] + bboxes[b, 2]/2) < (x + patchSize[0]) and \
+            max(0, bboxes[b, 1] - bboxes[b, 3]/2) >= y and \
+            min(sz[1]-1, bboxes[b, 1] + bboxes[b, 3]/2) < (y + patchSize[1])
+
+    for clu in cluOrder:
+        cOrder = np.argsort(distances[kmeans.labels_==clu])
+        candidates = bboxIndices[kmeans.labels_==clu]
+        for can in cOrder:
+            if candidates[can] in bboxes_covered:
+                continue
+            nextBBox = bboxes[candidates[can], :]
+            minX = int(max(0, np.ceil(nextBBox[0] + nextBBox[2]/2) - patchSize[0] + 1))
+            maxX = int(max(minX, min(sz[0] - patchSize[0], np.floor(nextBBox[0] - nextBBox[2]/2))))
+            minY = int(max(0, np.ceil(nextBBox[1] + nextBBox[3]/2) - patchSize[1] + 1))
+            maxY = int(max(minY, min(sz[1] - patchSize[1], np.floor(nextBBox[1] - nextBBox[3]/2))))
+            bestNumCandidates = 0
+            argMax = (-1, -1,)
+            bestMeanCenterDist = 0
+            searchRangeX = np.arange(minX, maxX, searchStride[0])
+            if not len(searchRangeX) or searchRangeX[-1] != maxX:
+                searchRangeX = np.append(searchRangeX, maxX)
+            searchRangeY = np.arange(minY, maxY, searchStride[1])
+            if not len(searchRangeY) or searchRangeY[-1] != maxY:
+                searchRangeY = np.append(searchRangeY, maxY)
+            for x in searchRangeX:
+                for y in searchRangeY:
+                    numCandidates = 0
+                    meanCenterDist = 0
+                    for b in bboxIndices:
+                        if b in bboxes_covered:
+                            continue
+                        if _inside(b, x, y):
+                            numCandidates += 1
+                            meanCenterDist += np.sum((bboxes[b, 0:2] - [x + patchSize[0]/2, y + patchSize[1]/2]) ** 2)
+                    meanCenterDist /= float(numCandidates)
+                    if numCandidates > bestNumCandidates:
+                        bestNumCandidates = numCandidates
+                        bestMeanCenterDist = meanCenterDist
+                        argMax = (x, y,)
+                    elif numCandidates == bestNumCandidates and meanCenterDist < bestMeanCenterDist:
+                        bestMeanCenterDist = meanCenterDist
+                        argMax = (x, y,)
+            if bestNumCandidates == 1:
+                leftX = max(0, min(sz[0] - patchSize[0], nextBBox[0] - patchSize[0]/2))
+                topY = max(0, min(sz[1] - patchSize[1], nextBBox[1] - patchSize[1]/2))
+                argMax = (leftX, topY)
+            for b in bboxIndices:
+                if b not in bboxes_covered and _inside(b, argMax[0], argMax[1]):
+                    bboxes_covered.add(b)
+            coordsX.append(int(argMax[0]))
+            coordsY.append(int(argMax[1]))
+    return coordsX, coordsY
+
+
+def synthetic_boxes(numBoxes, sz, boxSize, seed):
+    '''
+        Returns boxes (XYWH, float32, as produced by the models) scattered
+        around a few centers, resembling dense herds in aerial images.
+    '''
+    rng = np.random.RandomState(seed)
+    numCenters = max(1, numBoxes // 50)
+    centers = rng.uniform(boxSize[1], np.array(sz) - boxSize[1], (numCenters, 2))
+    pos = centers[rng.randint(numCenters, size=numBoxes)] + rng.normal(0, sz[0]/20, (numBoxes, 2))
+    pos = np.clip(pos, boxSize[1], np.array(sz) - boxSize[1])
+    wh = rng.uniform(boxSize[0], boxSize[1], (numBoxes, 2))
+    return np.concatenate((pos, wh), 1).astype(np.float32)
+
+
+def run(numBoxes, sz, patchSize, searchStride, withReference, seed=0):
+    cropper = WindowCropper(patchSize, cropMode='windowCropping', searchStride=searchStride)
+    bboxes = synthetic_boxes(numBoxes, sz, (8, 24), seed)
+
+    np.random.seed(seed)    # KMeans initialization
+    tic = time.perf_counter()
+    coords = cropper._windowCroppingPositions(np.copy(bboxes), sz)
+    result = {
+        'num_boxes': numBoxes,
+        'num_patches': len(coords[0]),
+        'time_vectorized': time.perf_counter() - tic
+    }
+    if withReference:
+        np.random.seed(seed)
+        tic = time.perf_counter()
+        coords_ref = reference_positions(cropper, np.copy(bboxes), sz)
+        result['time_reference'] = time.perf_counter() - tic
+        result['speedup'] = result['time_reference'] / result['time_vectorized']
+        result['identical'] = (coords == coords_ref)
+    return result
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the window search of the WindowCropper.')
+    parser.add_argument('--num_boxes', type=int, nargs='+', default=[100, 500, 1000],
+                    help='Number(s) of bounding boxes per image (default: 100 500 1000).')
+    parser.add_argument('--image_size', type=int, nargs=2, default=[4000, 3000],
+                    help='Image width and height (default: 4000 3000).')
+    parser.add_argument('--patch_size', type=int, default=800,
+                    help='Patch size (default: 800).')
+    parser.add_argument('--search_stride', type=int, default=10,
+                    help='Search stride (default: 10).')
+    parser.add_argument('--skip_reference', action='store_true',
+                    help='Do not run the (slow) loop-based reference implementation.')
+    args = parser.parse_args()
+
+    for numBoxes in args.num_boxes:
+        result = run(numBoxes, tuple(args.image_size), args.patch_size, args.search_stride, not args.skip_reference)
+        print(', '.join('{}: {}'.format(key, (round(val, 4) if isinstance(val, float) else val)) for key, val in result.items()))
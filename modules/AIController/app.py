@@ -1,10 +1,12 @@
 '''
     Main Bottle and routings for the AIController instance.
 
-    2019-20 Benjamin Kellenberger
+    2019-21 Benjamin Kellenberger
 '''
 
 import html
+import json
+import time
 from bottle import post, request, response, abort
 from modules.AIController.backend.middleware import AIMiddleware
 from modules.AIController.backend import celery_interface
@@ -15,9 +17,16 @@ class AIController:
 
     #TODO: relay routings if AIController is on a different machine
 
+    # defaults for held status requests; both must stay well below the timeout of synchronous
+    # Gunicorn workers (30 seconds by default), which are blocked for the duration of a request
+    LONG_POLL_TIMEOUT = 10      # seconds
+    STREAM_DURATION = 20        # seconds
+
     def __init__(self, config, app, verbose_start=False):
         self.config = config
         self.app = app
+        self.longPollTimeout = self.config.getProperty('AIController', 'status_long_poll_timeout', type=float, fallback=self.LONG_POLL_TIMEOUT)
+        self.streamDuration = self.config.getProperty('AIController', 'status_stream_duration', type=float, fallback=self.STREAM_DURATION)
 
         if verbose_start:
             print('AIController'.ljust(18), end='')
@@ -222,25 +231,75 @@ class AIController:
         @self.app.get('/<project>/status')
         def check_status(project):
             '''
-                Queries the middleware for any ongoing training worker processes
-                and returns the status of each in a dict.
+                Returns the status of the project, its tasks and/or the workers
+                (depending on the query parameters "project", "tasks", "workers")
+                as collected in the background, together with its version num-
+                ber. If the query parameter "version" is provided, the request
+                is held until a newer status is available (long polling), or at
+                most "status_long_poll_timeout" seconds.
             '''
             if self.loginCheck(project=project):
                 try:
                     queryProject = 'project' in request.query
                     queryTasks = 'tasks' in request.query
                     queryWorkers = 'workers' in request.query
-                    status = self.middleware.check_status(
-                        project,
-                        queryProject, queryTasks, queryWorkers)
+                    version = request.query.get('version', None)
+                    if version is not None:
+                        version, status = self.middleware.get_status(project,
+                            queryProject, queryTasks, queryWorkers,
+                            int(version), self.longPollTimeout)
+                    else:
+                        version, status = self.middleware.get_status(project,
+                            queryProject, queryTasks, queryWorkers)
                 except Exception as e:
-                    status = str(e)
-                return { 'status' : status }
+                    return { 'status': str(e) }
+                return { 'status': status, 'version': version }
 
             else:
                 abort(401, 'unauthorized')
 
 
+        @self.app.get('/<project>/statusStream')
+        def stream_status(project):
+            '''
+                Server-sent events variant of the "status" route: sends the
+                status (same query parameters) whenever it changes. Streams
+                are closed after "status_stream_duration" seconds, upon which
+                clients (e.g. "EventSource") reconnect. Each open stream occu-
+                pies a synchronous web server worker; longer durations require
+                an asynchronous worker class (e.g. Gunicorn with gevent).
+            '''
+            if not self.loginCheck(project=project):
+                abort(401, 'unauthorized')
+
+            queryProject = 'project' in request.query
+            queryTasks = 'tasks' in request.query
+            queryWorkers = 'workers' in request.query
+            response.content_type = 'text/event-stream'
+            response.set_header('Cache-Control', 'no-cache')
+            response.set_header('X-Accel-Buffering', 'no')
+
+            def _stream():
+                yield 'retry: 2000\n\n'
+                version = None
+                tEnd = time.time() + self.streamDuration
+                while time.time() < tEnd:
+                    try:
+                        newVersion, status = self.middleware.get_status(project,
+                            queryProject, queryTasks, queryWorkers,
+                            version, min(self.longPollTimeout, max(0, tEnd - time.time())))
+                    except Exception as e:
+                        yield 'event: error\ndata: {}\n\n'.format(json.dumps(str(e)))
+                        return
+                    if newVersion != version:
+                        version = newVersion
+                        yield 'id: {}\ndata: {}\n\n'.format(version, json.dumps({ 'status': status, 'version': version }))
+                    else:
+                        # keep connection alive
+                        yield ': \n\n'
+            return _stream()
+
+
         #TODO: REPLACED WITH GENERIC FN OF ProjectAdministration
         # @self.app.get('/<project>/getAImodelSettings')
         # def get_ai_model_info(project):
@@ -0,0 +1,253 @@
+'''
+    Threadable class that launches model training (followed by inference)
+    for projects as soon as enough images have been annotated since the last
+    model state (project setting "numImages_autoTrain").
+
+    Instead of periodically counting the annotated images of every project,
+    the trigger listens to notifications (Postgres LISTEN/NOTIFY) that the
+    LabelUI sends upon each submission of annotations, with the number of
+    images submitted. Per project, a counter of images annotated since the
+    last model state is initialized with an exact count and incremented
+    with each notification. Since images may be submitted repeatedly, the
+    counter is an upper bound of the actual number; the exact number is
+    only queried once the counter reaches the threshold, and training is
+    launched right away if it is confirmed.
+
+    2021 Benjamin Kellenberger
+'''
+
+from threading import Thread, Event, Lock
+import select
+import json
+import time
+from psycopg2 import sql
+from modules.LabelUI.backend.middleware import ANNOTATIONS_NOTIFY_CHANNEL
+
+
+class AutoTrainingTrigger(Thread):
+
+    SETTINGS_MAX_AGE = 60       # seconds after which project settings are reloaded upon a notification
+    RECONNECT_INTERVAL = 10     # seconds
+
+    def __init__(self, config, dbConnector, middleware):
+        super(AutoTrainingTrigger, self).__init__(daemon=True)
+        self._stop_event = Event()
+        self._lock = Lock()
+
+        self.config = config
+        self.dbConnector = dbConnector
+        self.middleware = middleware
+
+        self.projects = {}      # project: dict with settings, count and time of settings retrieval
+
+
+    def stop(self):
+        self._stop_event.set()
+
+
+    def stopped(self):
+        return self._stop_event.is_set()
+
+
+    def _get_count_query(self, project, minNumAnno):
+        if minNumAnno > 0:
+            minNumAnnoString = sql.SQL('''
+                WHERE image IN (
+                    SELECT cntQ.image FROM (
+                        SELECT image, count(*) AS cnt FROM {id_anno}
+                        GROUP BY image
+                    ) AS cntQ WHERE cntQ.cnt > %s
+                )
+            ''').format(
+                id_anno=sql.Identifier(project, 'annotation')
+            )
+            queryVals = (minNumAnno,)
+        else:
+            minNumAnnoString = sql.SQL('')
+            queryVals = None
+        queryStr = sql.SQL('''
+            SELECT COUNT(image) AS count FROM (
+                SELECT image, MAX(last_checked) AS lastChecked FROM {id_iu}
+                {minNumAnnoString}
+                GROUP BY image
+            ) AS query
+            WHERE query.lastChecked > (
+                SELECT MAX(timeCreated) FROM (
+                    SELECT to_timestamp(0) AS timeCreated
+                    UNION (
+                        SELECT MAX(timeCreated) AS timeCreated FROM {id_cnnstate}
+                    )
+            ) AS tsQ);
+        ''').format(
+            id_iu=sql.Identifier(project, 'image_user'),
+            id_cnnstate=sql.Identifier(project, 'cnnstate'),
+            minNumAnnoString=minNumAnnoString)
+        return queryStr, queryVals
+
+
+    def _count(self, project):
+        entry = self.projects[project]
+        queryStr, queryVals = self._get_count_query(project, entry['minnumannoperimage'])
+        result = self.dbConnector.execute(queryStr, queryVals, 1)
+        return result[0]['count']
+
+
+    def _load_project(self, project, force=False):
+        '''
+            Loads (or reloads, if outdated or forced) the auto-training
+            settings of a project and initializes its counter with the exact
+            number of images annotated since the last model state. Returns
+            the project's entry, or None if the project does not exist.
+        '''
+        entry = self.projects.get(project, None)
+        if entry is not None and not force and time.time() - entry['loaded'] < self.SETTINGS_MAX_AGE:
+            return entry
+        properties = self.dbConnector.execute('''
+            SELECT ai_model_enabled, numimages_autotrain, minnumannoperimage,
+                maxnumimages_train, maxnumimages_inference
+            FROM aide_admin.project
+            WHERE shortname = %s;
+        ''', (project,), 1)
+        if properties is None or not len(properties):
+            self.projects.pop(project, None)
+            return None
+        properties = properties[0]
+        threshold = properties['numimages_autotrain']
+        newEntry = {
+            'enabled': bool(properties['ai_model_enabled']) and threshold is not None and threshold > 0,
+            'threshold': (threshold if threshold is not None and threshold > 0 else -1),
+            'minnumannoperimage': properties['minnumannoperimage'] or 0,
+            'maxnumimages_train': properties['maxnumimages_train'],
+            'maxnumimages_inference': properties['maxnumimages_inference'],
+            'loaded': time.time(),
+            'count': (entry['count'] if entry is not None else 0)
+        }
+        self.projects[project] = newEntry
+        if newEntry['enabled'] and (entry is None or not entry['enabled'] or \
+            entry['minnumannoperimage'] != newEntry['minnumannoperimage']):
+            newEntry['count'] = self._count(project)
+        return newEntry
+
+
+    def get_status(self, project):
+        '''
+            Returns the number of images annotated since the last model
+            state (upper bound) and the threshold for auto-training, or an
+            empty dict if auto-training is disabled for the project.
+        '''
+        with self._lock:
+            entry = self._load_project(project)
+            if entry is None or not entry['enabled']:
+                return {}
+            return {
+                'num_annotated': entry['count'],
+                'num_next_training': entry['threshold']
+            }
+
+
+    def notify(self, project, numImages):
+        '''
+            Registers the submission of annotations for a number of images
+            and launches training if the threshold is reached.
+        '''
+        with self._lock:
+            entry = self._load_project(project)
+            if entry is None or not entry['enabled']:
+                return
+            entry['count'] += numImages
+            if entry['count'] < entry['threshold']:
+                return
+
+            # threshold possibly reached; verify
+            entry['count'] = self._count(project)
+            if entry['count'] < entry['threshold']:
+                return
+            self._launch_training(project, entry)
+
+
+    def _launch_training(self, project, entry):
+        # only one AIController instance may launch the training
+        lockName = 'autotrain_' + project
+        with self.dbConnector._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT pg_try_advisory_lock(hashtext(%s));', (lockName,))
+            if not cursor.fetchone()[0]:
+                return
+            try:
+                queryStr = sql.SQL('''
+                    SELECT COUNT(*) AS cnt FROM {id_wHistory}
+                    WHERE timeFinished IS NULL;
+                ''').format(
+                    id_wHistory=sql.Identifier(project, 'workflowhistory')
+                )
+                cursor.execute(queryStr)
+                if cursor.fetchone()[0] > 0:
+                    # training (or another workflow) already running
+                    return
+
+                workflow = {
+                    'project': project,
+                    'tasks': [
+                        {
+                            'id': '0',
+                            'type': 'train',
+                            'kwargs': {
+                                'min_timestamp': 'lastState',
+                                'min_anno_per_image': entry['minnumannoperimage'],
+                                'max_num_images': entry['maxnumimages_train'],
+                                'max_num_workers': self.config.getProperty('AIController', 'maxNumWorkers_train', type=int, fallback=1)           #TODO: replace by project-specific argument
+                            }
+                        },
+                        {
+                            'id': '1',
+                            'type': 'inference',
+                            'kwargs': {
+                                'force_unlabeled': True,
+                                'max_num_images': entry['maxnumimages_inference'],
+                                'max_num_workers': self.config.getProperty('AIController', 'maxNumWorkers_inference', type=int, fallback=-1)      #TODO: replace by project-specific argument
+                            }
+                        }
+                    ],
+                    'options': {}
+                }
+                result = self.middleware.launch_task(project, workflow, None)
+                if result.get('status', 1) == 0:
+                    print(f'[{project}] {entry["count"]} images annotated since last model state; launched auto-training (task ID: {result["task_id"]}).')
+                    entry['count'] = 0
+                else:
+                    print(f'[{project}] Could not launch auto-training (message: "{result.get("message", "")}").')
+            finally:
+                cursor.execute('SELECT pg_advisory_unlock(hashtext(%s));', (lockName,))
+
+
+    def _listen(self):
+        conn = self.dbConnector.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(sql.SQL('LISTEN {};').format(sql.Identifier(ANNOTATIONS_NOTIFY_CHANNEL)))
+
+            # notifications may have been missed while disconnected; re-count
+            with self._lock:
+                self.projects.clear()
+            while not self.stopped():
+                if select.select([conn], [], [], 5) == ([], [], []):
+                    continue
+                conn.poll()
+                while len(conn.notifies):
+                    notification = conn.notifies.pop(0)
+                    try:
+                        payload = json.loads(notification.payload)
+                        self.notify(payload['project'], int(payload['num_images']))
+                    except Exception as e:
+                        print(f'Error processing annotation notification (message: "{str(e)}").')
+        finally:
+            conn.close()
+
+
+    def run(self):
+        while not self.stopped():
+            try:
+                self._listen()
+            except Exception as e:
+                print(f'Auto-training trigger lost database connection (message: "{str(e)}"); reconnecting...')
+                self._stop_event.wait(self.RECONNECT_INTERVAL)
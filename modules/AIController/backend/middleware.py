@@ -1,7 +1,7 @@
 '''
     Middleware for AIController: handles requests and updates to and from the database.
 
-    2019-20 Benjamin Kellenberger
+    2019-21 Benjamin Kellenberger
 '''
 
 from datetime import datetime
@@ -18,7 +18,8 @@ from kombu import Queue
 from psycopg2 import sql
 from util.helpers import current_time
 from .messageProcessor import MessageProcessor
-from .annotationWatchdog import Watchdog
+from .autoTrainingTrigger import AutoTrainingTrigger
+from .statusBroadcaster import StatusBroadcaster
 from modules.AIController.taskWorkflow.workflowDesigner import WorkflowDesigner
 from modules.AIController.taskWorkflow.workflowTracker import WorkflowTracker
 from modules.Database.app import Database
@@ -48,11 +49,19 @@ class AIMiddleware():
         #TODO: messageProcessor is now deprecated, in favor of workflowTracker
         self.messageProcessor = MessageProcessor(self.celery_app)
         if not self.passiveMode:
-            self.watchdogs = {}    # one watchdog per project. Note: watchdog only created if users poll status (i.e., if there's activity)
             self.workflowDesigner = WorkflowDesigner(self.dbConn, self.celery_app)
             self.workflowTracker = WorkflowTracker(self.dbConn, self.celery_app)
             self.messageProcessor.start()
 
+            # launches training as soon as enough images have been annotated
+            self.autoTrainingTrigger = AutoTrainingTrigger(self.config, self.dbConn, self)
+            self.autoTrainingTrigger.start()
+
+            # status collection shared among all clients (started upon first request)
+            self.statusBroadcaster = StatusBroadcaster(self,
+                        self.config.getProperty('AIController', 'status_update_interval', type=float, fallback=1.0),
+                        self.config.getProperty('AIController', 'worker_status_interval', type=float, fallback=10.0))
+
 
     def _init_available_ai_models(self):
         #TODO: 1. using regex to remove scripts is not failsave; 2. ugly code...
@@ -151,45 +160,6 @@ class AIMiddleware():
         self.aiModels = models
 
 
-    def _init_watchdog(self, project, nudge=False):
-        '''
-            Launches a thread that periodically polls the database for new
-            annotations. Once the required number of new annotations is reached,
-            this thread will initiate the training process through the middleware.
-            The thread will be terminated and destroyed; a new thread will only be
-            re-created once the training process has finished.
-        '''
-        if self.passiveMode:
-            return
-        if project in self.watchdogs and self.watchdogs[project] == False:
-                # project does not need a watchdog
-                #TODO: implement force re-check after e.g. settings update
-                return
-        
-        else:
-            # check if auto-training enabled
-            projSettings = self.dbConn.execute('''
-                SELECT ai_model_enabled, numImages_autoTrain
-                FROM aide_admin.project
-                WHERE shortname = %s
-                ''', (project,), 1)
-
-            if projSettings is None or not len(projSettings) or \
-                not (projSettings[0]['ai_model_enabled']) or \
-                    projSettings[0]['numimages_autotrain'] is None or projSettings[0]['numimages_autotrain'] <= 0:
-                # no watchdog to be configured; set flag to avoid excessive DB queries
-                #TODO: enable on-the-fly project settings updates to this end
-                self.watchdogs[project] = False
-                return
-
-        # init watchdog            
-        self.watchdogs[project] = Watchdog(project, self.config, self.dbConn, self)
-        self.watchdogs[project].start()
-
-        if nudge:
-            self.watchdogs[project].nudge()
-
-
     def _get_num_available_workers(self):
         #TODO: message + queue if no worker available
         #TODO: limit to n tasks per worker
@@ -900,20 +870,7 @@ class AIMiddleware():
 
         # project status
         if checkProject:
-            if self.training:
-                status['project'] = {}
-            else:
-                # notify watchdog that users are active
-                if not project in self.watchdogs or \
-                    (self.watchdogs[project] != False and self.watchdogs[project].stopped()):
-                    self._init_watchdog(project, True)
-                if self.watchdogs[project] != False:
-                    status['project'] = {
-                        'num_annotated': self.watchdogs[project].lastCount,
-                        'num_next_training': self.watchdogs[project].getThreshold()
-                    }
-                else:
-                    status['project'] = {}
+            status['project'] = self.autoTrainingTrigger.get_status(project)
 
 
         # running tasks status
@@ -928,6 +885,18 @@ class AIMiddleware():
 
 
 
+    def get_status(self, project, checkProject, checkTasks, checkWorkers, version=None, timeout=5.0):
+        '''
+            Returns the version number and status of a project as collected by
+            the "StatusBroadcaster", instead of querying the Celery workers and
+            results for each request. If "version" is provided, waits up to
+            "timeout" seconds for a status that is newer than that version.
+        '''
+        parts = [p for p, flag in (('project', checkProject), ('tasks', checkTasks), ('workers', checkWorkers)) if flag]
+        return self.statusBroadcaster.get_status(project, parts, version, timeout)
+
+
+
     #TODO
     def pollTaskStatus(self, project, taskID):
         return self.workflowTracker.pollTaskStatus(project, taskID)
@@ -1190,7 +1159,7 @@ class AIMiddleware():
 
         # get project-specific model states
         queryStr = sql.SQL('''
-            SELECT id, EXTRACT(epoch FROM timeCreated) AS time_created, model_library, alCriterion_library, num_pred
+            SELECT id, EXTRACT(epoch FROM timeCreated)::float8 AS time_created, model_library, alCriterion_library, num_pred
             FROM {id_cnnstate} AS cnnstate
             LEFT OUTER JOIN (
                 SELECT cnnstate, COUNT(cnnstate) AS num_pred
@@ -0,0 +1,146 @@
+'''
+    Threadable class that collects the status of projects (project, tasks
+    and/or workers; see "AIMiddleware.check_status") in the background and
+    shares it among all clients of the AIController instance.
+
+    Querying the status is expensive (one result backend request per task
+    and child task, plus a ping of all workers for the worker status).
+    Instead of doing so for every request of every client, the broadcaster
+    keeps one channel per project with the latest status and a version num-
+    ber, and refreshes it at a fixed interval for as long as clients are sub-
+    scribed to it (i.e., have requested it within the last "SUBSCRIPTION_
+    TIMEOUT" seconds). The load on the result backend and workers hence de-
+    pends on the number of active projects, not on the number of clients.
+    Clients may wait for a newer version than the one they have (long poll-
+    ing or server-sent events).
+
+    2021 Benjamin Kellenberger
+'''
+
+import time
+from threading import Thread, Event, Condition
+
+
+class StatusBroadcaster(Thread):
+
+    SUBSCRIPTION_TIMEOUT = 30       # seconds after the last request of a client until a channel is closed
+
+    def __init__(self, middleware, updateInterval=1.0, workerInterval=10.0):
+        super(StatusBroadcaster, self).__init__(daemon=True)
+        self._stop_event = Event()
+        self._wakeup = Event()
+        self._condition = Condition()
+
+        self.middleware = middleware
+        self.updateInterval = updateInterval
+        self.workerInterval = workerInterval
+
+        self.channels = {}      # project: dict with requested parts, status and version
+
+
+    def stop(self):
+        self._stop_event.set()
+        self._wakeup.set()
+
+
+    def stopped(self):
+        return self._stop_event.is_set()
+
+
+    def _new_channel(self):
+        return {
+            'parts': {},            # part: time of last request
+            'status': {},
+            'version': 0,
+            'workersPolled': 0
+        }
+
+
+    def get_status(self, project, parts, version=None, timeout=5.0):
+        '''
+            Subscribes to the given "parts" of the status of a project and
+            returns the current version number and status (dict of part:
+            status). Waits until the status of all requested parts has been
+            collected and, if "version" is provided, until the status is
+            newer than that version, but at most "timeout" seconds. Parts
+            whose status has not been collected by then (e.g. upon the first
+            request of a project) are queried directly, so that the status
+            of all requested parts is always returned.
+        '''
+        if not self.is_alive() and not self.stopped():
+            try:
+                self.start()
+            except RuntimeError:
+                # already started by another thread
+                pass
+
+        with self._condition:
+            if project not in self.channels:
+                self.channels[project] = self._new_channel()
+            channel = self.channels[project]
+            now = time.time()
+            if any(p not in channel['parts'] for p in parts):
+                self._wakeup.set()
+            for p in parts:
+                channel['parts'][p] = now
+
+            def _ready():
+                return all(p in channel['status'] for p in parts) and \
+                    (version is None or channel['version'] != version)
+            self._condition.wait_for(_ready, timeout)
+            currentVersion = channel['version']
+            status = dict((p, channel['status'][p]) for p in parts if p in channel['status'])
+
+        missing = [p for p in parts if p not in status]
+        if len(missing):
+            status.update(self.middleware.check_status(project,
+                            'project' in missing, 'tasks' in missing, 'workers' in missing))
+        return currentVersion, status
+
+
+    def _collect(self, project):
+        with self._condition:
+            channel = self.channels[project]
+            now = time.time()
+            for p in [p for p, t in channel['parts'].items() if now - t >= self.SUBSCRIPTION_TIMEOUT]:
+                del channel['parts'][p]
+                channel['status'].pop(p, None)
+            parts = set(channel['parts'].keys())
+            if not len(parts):
+                # no clients anymore
+                del self.channels[project]
+                self._condition.notify_all()
+                return
+            queryWorkers = 'workers' in parts and \
+                ('workers' not in channel['status'] or now - channel['workersPolled'] >= self.workerInterval)
+
+        try:
+            status = self.middleware.check_status(project,
+                                'project' in parts, 'tasks' in parts, queryWorkers)
+        except Exception as e:
+            status = dict((p, str(e)) for p in parts if p != 'workers' or queryWorkers)
+
+        with self._condition:
+            if queryWorkers:
+                channel['workersPolled'] = now
+            changed = False
+            for p in status:
+                if channel['status'].get(p, None) != status[p] or p not in channel['status']:
+                    channel['status'][p] = status[p]
+                    changed = True
+            if changed:
+                channel['version'] += 1
+                self._condition.notify_all()
+
+
+    def run(self):
+        while not self.stopped():
+            self._wakeup.clear()
+            with self._condition:
+                projects = list(self.channels.keys())
+            for project in projects:
+                try:
+                    self._collect(project)
+                except Exception as e:
+                    print(f'[{project}] Error collecting status (message: "{str(e)}").')
+            self._wakeup.wait(self.updateInterval)
@@ -5,13 +5,21 @@
     Launched workflows are also added to the workflow history
     table in the RDB.
 
-    2020 Benjamin Kellenberger
+    Task states are retrieved in bulk (one request to the result
+    backend for all unfinished (sub-) tasks of a workflow, if the
+    backend supports it). Terminal states are kept and never queried
+    again; once a workflow has finished, its tasks with their final
+    states are stored in the workflow history table.
+
+    2020-21 Benjamin Kellenberger
 '''
 
 from collections.abc import Iterable
 import json
 from psycopg2 import sql
-from celery.result import AsyncResult, GroupResult
+from celery import current_app, states
+from celery.result import GroupResult
+from celery.backends.base import KeyValueStoreBackend
 from celery.task.control import revoke
 
 
@@ -51,66 +59,135 @@ class WorkflowTracker:
 
 
     @staticmethod
-    def getTasksInfo(tasks, forgetIfFinished=True):
+    def _fetch_task_metas(taskIDs, backend=None):
+        '''
+            Returns a dict of task ID: task meta (dict with "status" and
+            "result") for the given task IDs. Key-value store backends (e.g.
+            Redis) are queried for all tasks in one request; other backends
+            once per task.
+        '''
+        if backend is None:
+            backend = current_app.backend
+        taskIDs = list(taskIDs)
+        if not len(taskIDs):
+            return {}
+        metas = {}
+        if isinstance(backend, KeyValueStoreBackend):
+            keys = [backend.get_key_for_task(taskID) for taskID in taskIDs]
+            values = backend.mget(keys)
+            if hasattr(values, 'items'):
+                values = [values.get(key, None) for key in keys]
+            for taskID, value in zip(taskIDs, values):
+                if value is None:
+                    metas[taskID] = {'status': states.PENDING, 'result': None}
+                else:
+                    metas[taskID] = backend.decode_result(value)
+        else:
+            for taskID in taskIDs:
+                metas[taskID] = backend.get_task_meta(taskID)
+        return metas
+
+
+
+    @staticmethod
+    def _is_final(task):
+        return task.get('status', None) in states.READY_STATES
+
+
+
+    @staticmethod
+    def _update_task(task, meta, errors):
+        '''
+            Updates a (sub-) task dict with the given task meta and appends
+            error messages of failed tasks to "errors".
+        '''
+        status = meta.get('status', states.PENDING)
+        if status in states.READY_STATES:
+            task['successful'] = (status == states.SUCCESS)
+            if task['successful']:
+                task['info'] = None
+            else:
+                error = str(meta.get('result', None))
+                errors.append(error)
+                task['info'] = {
+                    'message': error
+                }
+        elif meta.get('result', None) is not None:
+            task['info'] = meta['result']
+        task['status'] = status
+
+
+
+    @staticmethod
+    def getTasksInfo(tasks, forgetIfFinished=True, backend=None):
+        '''
+            Updates the status of all (sub-) tasks of a workflow in-place
+            and returns the tasks, whether the workflow has finished, and
+            a list of error messages. (Sub-) tasks that have already reached
+            a terminal state are not queried again.
+        '''
         if tasks is None:
             return None, False, None
         if isinstance(tasks, str):
             tasks = json.loads(tasks)
+        if backend is None:
+            backend = current_app.backend
+
+        # collect unfinished (sub-) tasks and query them all at once
+        pending = {}
+        for task in tasks:
+            if not WorkflowTracker._is_final(task):
+                pending[task['id']] = task
+            if 'children' in task:
+                for child in task['children'].values():
+                    if not WorkflowTracker._is_final(child):
+                        pending[child['id']] = child
+        metas = WorkflowTracker._fetch_task_metas(pending.keys(), backend)
+
         errors = []
-        for t in range(len(tasks)):
-            result = AsyncResult(tasks[t]['id'])
-            if result.ready():
-                tasks[t]['successful'] = result.successful()
-                if tasks[t]['successful']:
-                    tasks[t]['info'] = None
-                else:
-                    try:
-                        error = str(result.get())
-                        errors.append(error)
-                    except Exception as e:
-                        error = str(e)
-                        errors.append(error)
-                    tasks[t]['info'] = {}
-                    tasks[t]['info']['message'] = error
-                if forgetIfFinished:
-                    result.forget()
-            elif result.info is not None:
-                tasks[t]['info'] = result.info
-            if result.status is not None:
-                tasks[t]['status'] = result.status
-            if 'children' in tasks[t]:
+        for task in tasks:
+            if task['id'] in metas:
+                WorkflowTracker._update_task(task, metas[task['id']], errors)
+            elif not task.get('successful', True):
+                errors.append(task['info']['message'])
+            if 'children' in task:
                 numDone = 0
-                for key in tasks[t]['children']:
-                    cResult = AsyncResult(tasks[t]['children'][key]['id'])
-                    if cResult.ready():
+                for child in task['children'].values():
+                    if child['id'] in metas:
+                        WorkflowTracker._update_task(child, metas[child['id']], errors)
+                    elif not child.get('successful', True):
+                        errors.append(child['info']['message'])
+                    if WorkflowTracker._is_final(child):
                         numDone += 1
-                        tasks[t]['children'][key]['successful'] = cResult.successful()
-                        if tasks[t]['children'][key]['successful']:
-                            tasks[t]['children'][key]['info'] = None
-                        else:
-                            try:
-                                error = str(cResult.get())
-                                errors.append(error)
-                            except Exception as e:
-                                error = str(e)
-                                errors.append(error)
-                            tasks[t]['children'][key]['info'] = {}
-                            tasks[t]['children'][key]['info']['message'] = error
-                        if forgetIfFinished:
-                            cResult.forget()
-                    elif cResult.info is not None:
-                        tasks[t]['children'][key]['info'] = cResult.info
-                    if cResult.status is not None:
-                        tasks[t]['children'][key]['status'] = cResult.status
-                tasks[t]['num_done'] = numDone
-
-        lastResult = AsyncResult(tasks[-1]['id'])
-        hasFinished = lastResult.ready()
+                task['num_done'] = numDone
+
+        hasFinished = WorkflowTracker._is_final(tasks[-1])
+
+        if forgetIfFinished and hasFinished:
+            WorkflowTracker.forgetTasks(tasks, backend)
 
         return tasks, hasFinished, errors
 
 
 
+    @staticmethod
+    def forgetTasks(tasks, backend=None):
+        '''
+            Removes the results of all (sub-) tasks of a workflow from the
+            result backend.
+        '''
+        if backend is None:
+            backend = current_app.backend
+        for task in tasks:
+            try:
+                backend.forget(task['id'])
+                for child in task.get('children', {}).values():
+                    backend.forget(child['id'])
+            except Exception:
+                pass
+
+
+
     @staticmethod
     def _revoke_task(tasks):
         if isinstance(tasks, dict) and 'id' in tasks:
@@ -240,24 +317,25 @@ class WorkflowTracker:
             tasks = self.activeTasks[project][taskID]
 
         # poll for updates
-        tasks, hasFinished, errors = WorkflowTracker.getTasksInfo(tasks, False)
+        tasks, hasFinished, errors = WorkflowTracker.getTasksInfo(tasks, False, self.celeryApp.backend)
 
-        # commit missing details to database if finished
+        # commit final states to database if finished
         if hasFinished:
             queryStr = sql.SQL('''
                 UPDATE {id_wHistory}
                 SET timeFinished = NOW(),
                 succeeded = %s,
-                messages = %s
+                messages = %s,
+                tasks = %s
                 WHERE id = %s;
             ''').format(
                 id_wHistory=sql.Identifier(project, 'workflowhistory')
             )
             self.dbConnector.execute(queryStr,
-                (len(errors)==0, json.dumps(errors), taskID), None)
+                (len(errors)==0, json.dumps(errors), json.dumps(tasks), taskID), None)
 
             # remove from Celery and from local cache
-            WorkflowTracker.getTasksInfo(tasks, True)
+            WorkflowTracker.forgetTasks(tasks, self.celeryApp.backend)
             self._remove_from_cache(project, taskID)
 
         return tasks
@@ -354,6 +432,10 @@ class WorkflowTracker:
         activeTasks = self.getTasks(project, runningOrFinished='both')       #self.getActiveTaskIDs(project)
 
         for t in range(len(activeTasks)):
+            if activeTasks[t]['time_finished'] is not None:
+                # finished; final states are stored in the database
+                activeTasks[t]['children'] = activeTasks[t]['tasks']
+                continue
             taskID = activeTasks[t]['id']
             chainStatus = self.pollTaskStatus(project, taskID)
             if chainStatus is not None:
@@ -394,22 +476,34 @@ class WorkflowTracker:
         if isinstance(tasks, str):
             tasks = json.loads(tasks)
         if isinstance(tasks, list):
-            for task in tasks:
-                if not isinstance(task, dict):
-                    task = json.loads(task)
-            WorkflowTracker._revoke_task(task)
+            for t in range(len(tasks)):
+                if not isinstance(tasks[t], dict):
+                    tasks[t] = json.loads(tasks[t])
+                WorkflowTracker._revoke_task(tasks[t])
+                WorkflowTracker._revoke_task(list(tasks[t].get('children', {}).values()))
 
+            # store unfinished (sub-) tasks as revoked; they are not queried anymore
+            for task in tasks:
+                for subtask in [task] + list(task.get('children', {}).values()):
+                    if not WorkflowTracker._is_final(subtask):
+                        subtask['status'] = states.REVOKED
+                        subtask['successful'] = False
+                        subtask['info'] = {
+                            'message': 'aborted by {}'.format(username)
+                        }
 
         # commit to DB
         queryStr = sql.SQL('''
             UPDATE {id_wHistory}
             SET timeFinished = NOW(),
             succeeded = FALSE,
-            abortedBy = %s
+            abortedBy = %s,
+            tasks = %s
             WHERE id = %s;
         ''').format(
             id_wHistory=sql.Identifier(project, 'workflowhistory')
         )
-        self.dbConnector.execute(queryStr, (username, taskID), None)
+        self.dbConnector.execute(queryStr, (username, json.dumps(tasks), taskID), None)
+        self._remove_from_cache(project, taskID)
 
         #TODO: return value?
\ No newline at end of file
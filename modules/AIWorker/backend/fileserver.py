@@ -6,13 +6,21 @@
     An instance of this FileServer class may be provided to the AIModel instead,
     and serves as a gateway to the project's actual file server.
 
-    2019-20 Benjamin Kellenberger
+    If the file server runs on another machine, files are downloaded through
+    a pooled keep-alive HTTP session and (optionally) stored in a local disk
+    cache (see "imageCache.ImageCache"), so that subsequent epochs and infer-
+    ence passes read images from the local disk.
+
+    2019-21 Benjamin Kellenberger
 '''
 
 import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
-from urllib import request
-from urllib.error import HTTPError
+from requests.adapters import HTTPAdapter
+from modules.AIWorker.backend.imageCache import ImageCache
 from util.helpers import is_localhost
 
 
@@ -31,7 +39,49 @@ class FileServer:
         
         else:
             self.baseURI = self.config.getProperty('Server', 'dataServer_uri')
-            
+            self._init_remote()
+
+
+    def _init_remote(self):
+        '''
+            Sets up a pooled HTTP session for downloads from the remote file
+            server, a thread pool for concurrent downloads and prefetching,
+            and the local image cache (if enabled through parameter "image_
+            cache_size" in section [AIWorker] of the configuration file).
+        '''
+        numThreads = max(1, self.config.getProperty('AIWorker', 'num_download_threads', type=int, fallback=8))
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=numThreads, pool_maxsize=numThreads, max_retries=2)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=numThreads)
+        self._pending = {}      # (project, filename): Future of ongoing download
+        self._pendingLock = threading.Lock()
+
+        maxSize = self.config.getProperty('AIWorker', 'image_cache_size', type=float, fallback=0)
+        if maxSize > 0:
+            tempDir = self.config.getProperty('FileServer', 'tempfiles_dir', type=str, fallback=None)
+            if tempDir is None or not len(tempDir):
+                tempDir = tempfile.gettempdir()
+            maxAge = self.config.getProperty('AIWorker', 'image_cache_max_age', type=float, fallback=3600)
+            self.cache = ImageCache(os.path.join(tempDir, 'aide/imageCache'), maxSize * 1024**2, maxAge)
+        else:
+            self.cache = None
+
+
+    def __getstate__(self):
+        # sessions, threads and locks cannot be shared among processes; they
+        # are set up again upon unpickling
+        state = self.__dict__.copy()
+        for key in ('session', 'executor', '_pending', '_pendingLock', 'cache'):
+            state.pop(key, None)
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if not self.isLocal:
+            self._init_remote()
 
     
     def _check_running_local(self):
@@ -68,34 +118,93 @@ class FileServer:
 
     
 
+    def _query_path(self, project, filename):
+        localSpec = ('files' if not self.isLocal else '')
+        if project is not None:
+            queryPath = os.path.join(self.baseURI, project, localSpec, filename)
+        else:
+            queryPath = os.path.join(self.baseURI, filename)
+        
+        if '..' in queryPath or filename.startswith(os.sep):
+            # parent and absolute paths are not allowed (to protect the system and other projects)
+            raise Exception('Parent accessors ("..") and absolute paths ("{}path") are not allowed.'.format(os.sep))
+        return queryPath
+
+
+    def _download(self, project, filename):
+        '''
+            Downloads a file from the remote file server, or reads it from the
+            local cache if it is available and still valid. Cache entries that
+            are due for revalidation are requested conditionally; the server
+            then only returns the file if it has been modified.
+        '''
+        queryPath = self._query_path(project, filename)
+        entry = None
+        headers = {}
+        if self.cache is not None:
+            entry = self.cache.lookup(project, filename)
+            if self.cache.is_fresh(entry):
+                bytea = self.cache.read(entry)
+                if bytea is not None:
+                    return bytea
+                entry = None
+            elif entry is not None:
+                if entry.get('etag', None) is not None:
+                    headers['If-None-Match'] = entry['etag']
+                if entry.get('last_modified', None) is not None:
+                    headers['If-Modified-Since'] = entry['last_modified']
+
+        response = self.session.get(queryPath, headers=headers)
+        if response.status_code == 304 and entry is not None:
+            bytea = self.cache.read(entry)
+            if bytea is not None:
+                self.cache.touch(project, filename, entry)
+                return bytea
+            response = self.session.get(queryPath)
+        response.raise_for_status()
+        bytea = response.content
+        if self.cache is not None:
+            self.cache.put(project, filename, bytea,
+                            response.headers.get('ETag', None), response.headers.get('Last-Modified', None))
+        return bytea
+
+
+    def _download_shared(self, project, filename):
+        '''
+            Downloads a file, unless a download of the same file is already
+            ongoing (e.g. through "prefetch"), in which case it is awaited
+            and the file is read from the cache.
+        '''
+        key = (project, filename)
+        with self._pendingLock:
+            future = self._pending.get(key, None)
+            if future is not None and future.cancel():
+                # prefetch has not started yet; download directly instead of waiting in the queue
+                self._pending.pop(key, None)
+                future = None
+        if future is not None:
+            future.result()
+        return self._download(project, filename)
+
+
     def getFile(self, project, filename):
         '''
             Returns the file as a byte array.
             If FileServer module runs on same instance as AIWorker,
             the file is directly loaded from the local disk.
-            Otherwise an HTTP request is being sent.
+            Otherwise an HTTP request is being sent (or the file is
+            read from the local image cache, if enabled).
         '''
         try:
             #TODO: make generator that yields bytes?
-            localSpec = ('files' if not self.isLocal else '')
-            if project is not None:
-                queryPath = os.path.join(self.baseURI, project, localSpec, filename)
-            else:
-                queryPath = os.path.join(self.baseURI, filename)
-            
-            if '..' in queryPath or filename.startswith(os.sep):
-                # parent and absolute paths are not allowed (to protect the system and other projects)
-                raise Exception('Parent accessors ("..") and absolute paths ("{}path") are not allowed.'.format(os.sep))
-
             if self.isLocal:
                 # load file from disk
-                with open(queryPath, 'rb') as f:
+                with open(self._query_path(project, filename), 'rb') as f:
                     bytea = f.read()
             else:
-                response = request.urlopen(queryPath)
-                bytea = response.read()
+                bytea = self._download_shared(project, filename)
 
-        except HTTPError as httpErr:
+        except requests.HTTPError as httpErr:
             print('HTTP error')
             print(httpErr)
             bytea = None
@@ -107,6 +216,75 @@ class FileServer:
         return bytea
 
 
+    def getFileVersion(self, project, filename):
+        '''
+            Returns a string that identifies the current version of a file
+            (it changes whenever the file is replaced), or None if the file
+            cannot be accessed. For local files this is derived from their
+            size and modification time. For files on a remote file server,
+            this is the hash of the contents in the local image cache (which
+            revalidates them after "image_cache_max_age" seconds), resp. the
+            file's ETag if the image cache is disabled.
+        '''
+        try:
+            if self.isLocal:
+                stat = os.stat(self._query_path(project, filename))
+                return '{}-{}'.format(stat.st_size, stat.st_mtime_ns)
+
+            if self.cache is not None:
+                entry = self.cache.lookup(project, filename)
+                if not self.cache.is_fresh(entry):
+                    self._download_shared(project, filename)
+                    entry = self.cache.lookup(project, filename)
+                return (entry['hash'] if entry is not None else None)
+
+            response = self.session.head(self._query_path(project, filename))
+            response.raise_for_status()
+            return response.headers.get('ETag', None)
+
+        except Exception:
+            return None
+
+
+    def getFiles(self, project, filenames):
+        '''
+            Returns a list of byte arrays (or None for files that could not be
+            loaded) for a list of file names. Files on a remote file server
+            are downloaded concurrently.
+        '''
+        if self.isLocal:
+            return [self.getFile(project, filename) for filename in filenames]
+        return list(self.executor.map(lambda filename: self.getFile(project, filename), filenames))
+
+
+    def prefetch(self, project, filenames):
+        '''
+            Starts downloading files from a remote file server into the local
+            image cache in the background and returns immediately. Subsequent
+            calls to "getFile" then read the files from disk (or wait for the
+            ongoing download). Does nothing if the file server is running
+            locally or if the image cache is disabled.
+        '''
+        if self.isLocal or self.cache is None:
+            return
+
+        def _fetch(filename):
+            try:
+                self._download(project, filename)
+            except Exception:
+                pass    # errors are reported upon "getFile"
+            finally:
+                with self._pendingLock:
+                    self._pending.pop((project, filename), None)
+
+        with self._pendingLock:
+            for filename in filenames:
+                key = (project, filename)
+                if key in self._pending:
+                    continue
+                self._pending[key] = self.executor.submit(_fetch, filename)
+
+
     def putFile(self, project, bytea, filename):
         '''
             Saves a file to disk.
@@ -129,15 +307,36 @@ class FileServer:
     
     def get_secure_instance(self, project):
         '''
-            Returns a wrapper class to the "getFile" and "putFile"
-            functions that disallow access to other projects
+            Returns a wrapper class to the "getFile", "getFileVersion", "putFile",
+            "getFiles" and "prefetch" functions that disallow access to other projects
             than the one included.
         '''
-        this = self
-        class _secure_file_server:
-            def getFile(self, filename):
-                return this.getFile(project, filename)
-            def putFile(self, bytea, filename):
-                return this.putFile(project, bytea, filename)
-        
-        return _secure_file_server()
\ No newline at end of file
+        return _SecureFileServer(self, project)
+
+
+
+class _SecureFileServer:
+    '''
+        Project-bound wrapper returned by "FileServer.get_secure_instance".
+        Defined at module level so that it can be pickled along with the
+        models that hold it.
+    '''
+
+    def __init__(self, fileServer, project):
+        self._fileServer = fileServer
+        self._project = project
+
+    def getFile(self, filename):
+        return self._fileServer.getFile(self._project, filename)
+
+    def getFileVersion(self, filename):
+        return self._fileServer.getFileVersion(self._project, filename)
+
+    def putFile(self, bytea, filename):
+        return self._fileServer.putFile(self._project, bytea, filename)
+
+    def getFiles(self, filenames):
+        return self._fileServer.getFiles(self._project, filenames)
+
+    def prefetch(self, filenames):
+        return self._fileServer.prefetch(self._project, filenames)
@@ -0,0 +1,175 @@
+'''
+    Local, content-addressed disk cache for images that AIWorkers download
+    from a remote FileServer.
+
+    Image contents are stored once per SHA-1 hash of their bytes under
+    <cacheDir>/objects/, so that identical files (e.g. the same image in
+    multiple projects) only occupy space once. For each (project, filename)
+    pair, a small key file under <cacheDir>/keys/<project>/ records the hash
+    of the contents, together with the validators ("ETag" and "Last-Modi-
+    fied" headers) sent by the FileServer and the time of the last valida-
+    tion. Entries that have been validated less than "maxAge" seconds ago are
+    served from disk directly; older ones are revalidated through a condi-
+    tional request.
+
+    The total size of the cache is bounded; least recently used contents
+    are evicted first.
+
+    2021 Benjamin Kellenberger
+'''
+
+import os
+import json
+import time
+import hashlib
+import threading
+
+
+class ImageCache:
+
+    def __init__(self, cacheDir, maxSize, maxAge):
+        '''
+            - cacheDir:     root directory of the cache.
+            - maxSize:      maximum total size of the cached contents in
+                            bytes.
+            - maxAge:       number of seconds after which cached entries are
+                            revalidated with the FileServer.
+        '''
+        self.cacheDir = cacheDir
+        self.objectDir = os.path.join(cacheDir, 'objects')
+        self.keyDir = os.path.join(cacheDir, 'keys')
+        self.maxSize = maxSize
+        self.maxAge = maxAge
+        os.makedirs(self.objectDir, exist_ok=True)
+        os.makedirs(self.keyDir, exist_ok=True)
+
+        # running estimate of the cache size; only walk the directory when exceeded
+        self._lock = threading.Lock()
+        self._size = self._compute_size()
+
+
+    def _compute_size(self):
+        size = 0
+        for root, _, fileNames in os.walk(self.objectDir):
+            for fileName in fileNames:
+                try:
+                    size += os.path.getsize(os.path.join(root, fileName))
+                except OSError:
+                    pass
+        return size
+
+
+    def _key_path(self, project, filename):
+        keyHash = hashlib.sha1(filename.encode('utf-8')).hexdigest()
+        return os.path.join(self.keyDir, str(project), keyHash + '.json')
+
+
+    def _object_path(self, contentHash):
+        return os.path.join(self.objectDir, contentHash[:2], contentHash)
+
+
+    @staticmethod
+    def _write_atomic(filePath, bytea):
+        os.makedirs(os.path.dirname(filePath), exist_ok=True)
+        tempPath = '{}.{}.{}.tmp'.format(filePath, os.getpid(), threading.get_ident())
+        with open(tempPath, 'wb') as f:
+            f.write(bytea)
+        os.replace(tempPath, filePath)
+
+
+    def lookup(self, project, filename):
+        '''
+            Returns the key entry (dict with "hash", "etag", "last_modified"
+            and "validated") of a file, or None if the file is not cached
+            (or its contents have been evicted).
+        '''
+        try:
+            with open(self._key_path(project, filename), 'r') as f:
+                entry = json.load(f)
+            if os.path.isfile(self._object_path(entry['hash'])):
+                return entry
+        except Exception:
+            pass
+        return None
+
+
+    def is_fresh(self, entry):
+        '''
+            Returns True if the entry does not need to be revalidated yet.
+        '''
+        return entry is not None and time.time() - entry.get('validated', 0) < self.maxAge
+
+
+    def read(self, entry):
+        '''
+            Returns the contents of a cached entry as bytes, or None if they
+            are not available anymore.
+        '''
+        objectPath = self._object_path(entry['hash'])
+        try:
+            with open(objectPath, 'rb') as f:
+                bytea = f.read()
+            os.utime(objectPath)        # for LRU eviction
+            return bytea
+        except OSError:
+            return None
+
+
+    def touch(self, project, filename, entry):
+        '''
+            Marks an entry as validated now (e.g. after the FileServer
+            responded with "304 Not Modified").
+        '''
+        entry['validated'] = time.time()
+        self._write_atomic(self._key_path(project, filename), json.dumps(entry).encode('utf-8'))
+
+
+    def put(self, project, filename, bytea, etag=None, lastModified=None):
+        '''
+            Stores the contents of a file together with its validators.
+        '''
+        contentHash = hashlib.sha1(bytea).hexdigest()
+        objectPath = self._object_path(contentHash)
+        if not os.path.isfile(objectPath):
+            self._write_atomic(objectPath, bytea)
+            with self._lock:
+                self._size += len(bytea)
+        entry = {
+            'hash': contentHash,
+            'etag': etag,
+            'last_modified': lastModified,
+            'validated': time.time()
+        }
+        self._write_atomic(self._key_path(project, filename), json.dumps(entry).encode('utf-8'))
+        if self._size > self.maxSize:
+            self.prune()
+        return entry
+
+
+    def prune(self):
+        '''
+            Evicts least recently used contents until the cache is below 90%
+            of its size limit (to avoid pruning after every download).
+            Key files of evicted contents are left in place; they are
+            treated as cache misses and overwritten upon the next download.
+        '''
+        with self._lock:
+            files = []
+            for root, _, fileNames in os.walk(self.objectDir):
+                for fileName in fileNames:
+                    filePath = os.path.join(root, fileName)
+                    try:
+                        stat = os.stat(filePath)
+                        files.append((stat.st_mtime, stat.st_size, filePath))
+                    except OSError:
+                        pass
+            totalSize = sum(f[1] for f in files)
+            for _, size, filePath in sorted(files):
+                if totalSize <= 0.9 * self.maxSize:
+                    break
+                try:
+                    os.remove(filePath)
+                    totalSize -= size
+                except OSError:
+                    pass
+            self._size = totalSize
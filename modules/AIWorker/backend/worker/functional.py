@@ -19,47 +19,23 @@
        it calls the very same function the AIController instance delegated and
        processes it (functions below).
 
-    2019-20 Benjamin Kellenberger
+    2019-21 Benjamin Kellenberger
 '''
 
 import base64
 import numpy as np
-from celery import current_task, states
+from celery import states
 import psycopg2
 from psycopg2 import sql
 from util.helpers import current_time, array_split
+from util.predictionChunk import PredictionChunk
 from constants.dbFieldNames import FieldNames_annotation, FieldNames_prediction
+from .progressReporter import ProgressReporter
 
 
 
 def __get_message_fun(project, cumulatedTotal=None, epoch=None, numEpochs=None):
-    def __on_message(state, message, done=None, total=None):
-        meta = {
-            'project': project,
-            'epoch': epoch
-        }
-        if (isinstance(done, int) or isinstance(done, float)) and \
-            (isinstance(total, int) or isinstance(total, float)):
-            trueTotal = total
-            if isinstance(cumulatedTotal, int) or isinstance(cumulatedTotal, float):
-                trueTotal = max(trueTotal, total)
-            meta['done'] = min(done, trueTotal)
-            meta['total'] = max(done, trueTotal)
-
-        message_combined = ''
-        if isinstance(epoch, int) and isinstance(numEpochs, int):
-            message_combined += f'[Epoch {epoch}/{numEpochs}] '
-
-        if isinstance(message, str):
-            message_combined += message
-        
-        if len(message_combined):
-            meta['message'] = message_combined
-        current_task.update_state(
-            state=state,
-            meta=meta
-        )
-    return __on_message
+    return ProgressReporter(project, cumulatedTotal, epoch, numEpochs)
 
 
 def __load_model_state(project, dbConnector):
@@ -222,6 +198,8 @@ def _call_train(project, imageIDs, epoch, numEpochs, subset, trainingFun, dbConn
     update_state(state=states.SUCCESS, message='trained on {} images'.format(len(imageIDs)))
 
     print(f'[{project}] Epoch {epoch}: Training completed successfully.')
+    update_state.flush()
+    print(f'[{project}] Epoch {epoch}: stage timings: {update_state.format_timings()}')
     return
 
 
@@ -295,6 +273,8 @@ def _call_average_model_states(project, epoch, numEpochs, averageFun, dbConnecto
     update_state(state=states.SUCCESS, message=f'[Epoch {epoch}] averaged {len(queryResult)} model states')
 
     print(f'[{project}] Epoch {epoch}: Model averaging completed successfully.')
+    update_state.flush()
+    print(f'[{project}] Epoch {epoch}: stage timings: {update_state.format_timings()}')
     return
 
 
@@ -355,6 +335,11 @@ def _call_inference(project, imageIDs, epoch, numEpochs, inferenceFun, rankFun,
         if rankFun is not None:
             update_state(state='PREPARING', message=f'[Epoch {epoch}] calculating priorities (chunk {chunkStr})')
             try:
+                if getattr(getattr(rankFun, '__self__', None), 'supportsPredictionChunk', False):
+                    result = PredictionChunk.wrap(result, predType == 'segmentationMasks')
+                elif isinstance(result, PredictionChunk):
+                    # legacy AL criterion
+                    result = result.to_dict()
                 result = rankFun(data=result, updateStateFun=update_state, **{'stateDict':stateDict})
             except Exception as e:
                 print(e)
@@ -363,55 +348,39 @@ def _call_inference(project, imageIDs, epoch, numEpochs, inferenceFun, rankFun,
         # parse result
         try:
             update_state(state='FINALIZING', message=f'[Epoch {epoch}] saving predictions (chunk {chunkStr})')
+            result = PredictionChunk.wrap(result, predType == 'segmentationMasks')
             fieldNames = list(getattr(FieldNames_prediction, predType).value)
             fieldNames.append('image')      # image ID
             fieldNames.append('cnnstate')   # model state ID
             values_pred = []
-            values_img = []     # mostly for feature vectors
-            # ids_img = []        # to delete previous predictions
-            for imgID in result.keys():
-                for prediction in result[imgID]['predictions']:
-
-                    # if segmentation mask: encode
-                    if predType == 'segmentationMasks':
-                        segMask = np.array(result[imgID]['predictions'][0]['label']).astype(np.uint8)
-                        height, width = segMask.shape
-                        segMask = base64.b64encode(segMask.ravel()).decode('utf-8')
-                        segMaskDimensions = {
-                            'width': width,
-                            'height': height
-                        }
-
-                    nextResultValues = []
-                    # we expect a dict of values, so we can use the fieldNames directly
-                    for fn in fieldNames:
-                        if fn == 'image':
-                            nextResultValues.append(imgID)
-                            # ids_img.append(imgID)
-                        elif fn == 'cnnstate':
-                            nextResultValues.append(stateDictID)
-                        elif fn == 'segmentationmask':
-                            nextResultValues.append(segMask)
-                        elif fn == 'width' or fn == 'height':
-                            if predType == 'segmentationMasks':
-                                nextResultValues.append(segMaskDimensions[fn])
-                            elif fn in prediction:
-                                nextResultValues.append(prediction[fn])
-                            else:
-                                nextResultValues.append(None)
-                        else:
-                            if fn in prediction:
-                                #TODO: might need to do typecasts (e.g. UUID?)
-                                nextResultValues.append(prediction[fn])
-
-                            else:
-                                # field name is not in return value; might need to raise a warning, Exception, or set to None
-                                nextResultValues.append(None)
-                            
-                    values_pred.append(tuple(nextResultValues))
-
-                if 'fVec' in result[imgID] and len(result[imgID]['fVec']):
-                    values_img.append((imgID, psycopg2.Binary(result[imgID]['fVec']),))
+            values_img = [(imgID, psycopg2.Binary(fVec),) for imgID, fVec in result.fVecs.items()]     # mostly for feature vectors
+            
+            if predType == 'segmentationMasks':
+                for mask in result.masks:
+                    # encode segmentation mask
+                    segMask = mask['label'].astype(np.uint8)
+                    height, width = segMask.shape
+                    maskValues = {
+                        'image': mask['image'],
+                        'cnnstate': stateDictID,
+                        'segmentationmask': base64.b64encode(segMask.ravel()).decode('utf-8'),
+                        'width': width,
+                        'height': height,
+                        'priority': mask['priority']
+                    }
+                    values_pred.append(tuple(maskValues.get(fn, None) for fn in fieldNames))
+
+            elif len(result):
+                # we expect columns of values, so we can use the fieldNames directly
+                columns = []
+                for fn in fieldNames:
+                    if fn == 'cnnstate':
+                        columns.append([stateDictID] * len(result))
+                    else:
+                        # field name might not be in return value; set to None
+                        #TODO: might need to do typecasts (e.g. UUID?)
+                        columns.append(result.column_list(fn))
+                values_pred = list(zip(*columns))
         except Exception as e:
             print(e)
             raise Exception(f'[Epoch {epoch}] error during result parsing (chunk {chunkStr}, reason: {str(e)})')
@@ -449,4 +418,6 @@ def _call_inference(project, imageIDs, epoch, numEpochs, inferenceFun, rankFun,
     update_state(state=states.SUCCESS, message='predicted on {} images'.format(len(imageIDs)))
 
     print(f'[{project}] Epoch {epoch}: Inference completed successfully.')
+    update_state.flush()
+    print(f'[{project}] Epoch {epoch}: stage timings: {update_state.format_timings()}')
     return
\ No newline at end of file
@@ -0,0 +1,139 @@
+'''
+    Rate-limited reporting of task progress to the Celery result backend.
+
+    Models call the "updateStateFun" they receive for every batch, and each
+    call used to be a write to the result backend, which is then polled by
+    the AIController and LabelUI. The "ProgressReporter" is a drop-in
+    replacement of that function that only writes:
+    - immediately when the task state (e.g. "PREPARING", "PROGRESS") changes;
+    - otherwise at most once per "minInterval" seconds, and only if the
+      message changed or the progress advanced by at least a fraction of
+      "minDelta" of the total since the last write.
+    Updates that are held back are kept and written upon "flush" (e.g. at
+    the end of the task), so that the last state is never lost.
+
+    Also measures the time spent per stage (message) of the task. The tim-
+    ings are sent along with the regular writes (under "timings" in the
+    task meta) instead of separately.
+
+    2021 Benjamin Kellenberger
+'''
+
+import time
+from collections import OrderedDict
+from celery import current_task
+
+
+def _update_current_task(state, meta):
+    if not current_task or current_task.request.id is None:
+        # not called from within a Celery task (e.g. in benchmarks)
+        return
+    current_task.update_state(state=state, meta=meta)
+
+
+
+class ProgressReporter:
+
+    MIN_INTERVAL = 0.25     # seconds between writes of the same state
+    MIN_DELTA = 0.01        # fraction of total progress between writes
+    MAX_STAGES = 64         # further stages are summarized under "other"
+
+    def __init__(self, project, cumulatedTotal=None, epoch=None, numEpochs=None,
+                updateFun=_update_current_task, minInterval=MIN_INTERVAL, minDelta=MIN_DELTA):
+        self.project = project
+        self.cumulatedTotal = cumulatedTotal
+        self.epoch = epoch
+        self.numEpochs = numEpochs
+        self.updateFun = updateFun
+        self.minInterval = minInterval
+        self.minDelta = minDelta
+
+        self.prefix = ''
+        if isinstance(epoch, int) and isinstance(numEpochs, int):
+            self.prefix = f'[Epoch {epoch}/{numEpochs}] '
+
+        self.timings = OrderedDict()
+        self._stage = None
+        self._stageStart = None
+        self._lastState = None
+        self._lastMessage = None
+        self._lastDone = None
+        self._lastWrite = 0.0
+        self._pending = None
+
+
+    def _track_stage(self, stage, now):
+        if stage == self._stage:
+            return
+        if self._stage is not None:
+            key = self._stage
+            if key not in self.timings and len(self.timings) >= self.MAX_STAGES:
+                key = 'other'
+            self.timings[key] = self.timings.get(key, 0.0) + now - self._stageStart
+        self._stage = stage
+        self._stageStart = now
+
+
+    def _write(self, state, meta, now):
+        meta['timings'] = dict((key, round(val, 3)) for key, val in self.timings.items())
+        self.updateFun(state, meta)
+        self._lastState = state
+        self._lastMessage = meta.get('message', None)
+        self._lastDone = meta.get('done', None)
+        self._lastWrite = now
+        self._pending = None
+
+
+    def __call__(self, state, message, done=None, total=None):
+        now = time.perf_counter()
+        meta = {
+            'project': self.project,
+            'epoch': self.epoch
+        }
+        if (isinstance(done, int) or isinstance(done, float)) and \
+            (isinstance(total, int) or isinstance(total, float)):
+            trueTotal = total
+            if isinstance(self.cumulatedTotal, int) or isinstance(self.cumulatedTotal, float):
+                trueTotal = max(trueTotal, total)
+            meta['done'] = min(done, trueTotal)
+            meta['total'] = max(done, trueTotal)
+
+        message_combined = self.prefix
+        if isinstance(message, str):
+            message_combined += message
+        if len(message_combined):
+            meta['message'] = message_combined
+
+        self._track_stage(meta.get('message', None), now)
+
+        if state != self._lastState:
+            self._write(state, meta, now)
+            return
+
+        if now - self._lastWrite < self.minInterval:
+            self._pending = (state, meta)
+            return
+
+        if meta.get('message', None) == self._lastMessage and 'done' in meta and \
+            self._lastDone is not None and meta['done'] < meta['total'] and \
+            abs(meta['done'] - self._lastDone) < self.minDelta * meta['total']:
+            self._pending = (state, meta)
+            return
+
+        self._write(state, meta, now)
+
+
+    def flush(self):
+        '''
+            Writes the last held back update (if any) and returns the stage
+            timings in seconds.
+        '''
+        now = time.perf_counter()
+        self._track_stage(None, now)
+        if self._pending is not None:
+            self._write(self._pending[0], self._pending[1], now)
+        return self.timings
+
+
+    def format_timings(self):
+        return ', '.join('{}: {:.2f}s'.format(key, val) for key, val in self.timings.items())
@@ -4,7 +4,7 @@
     for downloading, or scanning directories for
     untracked images.
 
-    2020 Benjamin Kellenberger
+    2020-21 Benjamin Kellenberger
 '''
 
 import os
@@ -16,17 +16,54 @@ import tempfile
 import zipfile
 import zlib
 import math
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import pytz
 from uuid import UUID
-from celery import current_app
+from celery import current_app, current_task
 from kombu import Queue
 from PIL import Image
 from psycopg2 import sql
 from modules.Database.app import Database
 from modules.LabelUI.backend.annotation_sql_tokens import QueryStrings_annotation, QueryStrings_prediction
-from util.helpers import valid_image_extensions, listDirectory, base64ToImage
-from util.imageSharding import split_image
+from util.helpers import valid_image_extensions, base64ToImage, hexToRGB
+from util.folderManifest import FolderManifest
+from util.imageSharding import split_image_windowed, windowed_reads_supported, PatchWriter
+from .exportCache import ExportCache
+
+
+def _encode_segmentation_mask(segmentationmask, width, height, indexedColors=None):
+    '''
+        Decodes a segmentation mask as stored in the database and returns
+        it as a TIFF file (bytes). The TIFF is deflate-compressed already,
+        so that compression happens in parallel on the export workers.
+    '''
+    segmask = base64ToImage(segmentationmask, width, height)
+
+    if indexedColors is not None and len(indexedColors)>0:
+        # convert to indexed color and add color palette from label classes
+        segmask = segmask.convert('RGB').convert('P', palette=Image.ADAPTIVE, colors=3)
+        segmask.putpalette(indexedColors)
+
+    bio = io.BytesIO()
+    segmask.save(bio, 'TIFF', compression='tiff_deflate')
+    return bio.getvalue()
+
+
+
+def _update_task_progress(done, message):
+    '''
+        Reports progress of long-running tasks through the Celery task
+        state (if called from within a task).
+    '''
+    if not current_task or current_task.request.id is None:
+        return
+    current_task.update_state(state='PROGRESS', meta={
+        'done': done,
+        'message': message
+    })
 
 
 class DataWorker:
@@ -47,6 +84,11 @@ class DataWorker:
 
     NUM_IMAGES_LIMIT = 4096         # maximum number of images that can be queried at once (to avoid bottlenecks)
 
+    EXPORT_NUM_WORKERS = min(8, os.cpu_count() or 1)    # number of threads encoding segmentation masks for data downloads
+    EXPORT_MAX_PENDING = 64                             # maximum number of encoded masks held in memory during data downloads
+    EXPORT_SPOOL_SIZE = 16 * 1024 * 1024                # metadata of data downloads exceeding this size (bytes) are buffered on disk
+    EXPORT_PROGRESS_INTERVAL = 1.0                      # minimum time (seconds) between data download progress updates
+
     def __init__(self, config, passiveMode=False):
         self.config = config
         self.dbConnector = Database(config)
@@ -55,6 +97,10 @@ class DataWorker:
 
         self.tempDir = self.config.getProperty('FileServer', 'tempfiles_dir', type=str, fallback=tempfile.gettempdir())
 
+        # cache for data download requests (size given in MB)
+        self.exportCache = ExportCache(os.path.join(self.tempDir, 'aide/downloadRequests'),
+                            self.config.getProperty('FileServer', 'export_cache_size', type=float, fallback=1024) * 1024**2)
+
 
 
     def aide_internal_notify(self, message):
@@ -154,9 +200,9 @@ class DataWorker:
         queryArgs.append(limit)
         
         queryStr = sql.SQL('''
-            SELECT img.id, filename, EXTRACT(epoch FROM date_added) AS date_added,
+            SELECT img.id, filename, EXTRACT(epoch FROM date_added)::float8 AS date_added,
                 COALESCE(viewcount, 0) AS viewcount,
-                EXTRACT(epoch FROM last_viewed) AS last_viewed,
+                EXTRACT(epoch FROM last_viewed)::float8 AS last_viewed,
                 COALESCE(num_anno, 0) AS num_anno,
                 COALESCE(num_pred, 0) AS num_pred,
                 img.isGoldenQuestion
@@ -248,6 +294,15 @@ class DataWorker:
         imgs_valid = []
         imgs_warn = {}
         imgs_error = {}
+
+        # images (or patches thereof) are encoded and saved in parallel
+        writer = PatchWriter()
+        pendingWrites = []          # (absolute file path, key, image path)
+        reservedPaths = set()       # file paths assigned in this call, but possibly not yet written
+
+        def _path_taken(path):
+            return path in reservedPaths or os.path.exists(path)
+
         for key in images.keys():
             try:
                 nextUpload = images[key]
@@ -264,6 +319,13 @@ class DataWorker:
                 nextUpload.save(cache)
                 try:
                     image = Image.open(cache)
+                except Image.DecompressionBombError:
+                    # image too large to be loaded at once; can only be split in a windowed manner
+                    if not splitImages:
+                        raise Exception('Image is too large to be loaded at once; enable image splitting to upload it.')
+                    if not windowed_reads_supported(cache):
+                        raise Exception('Image is too large to be loaded at once and its format does not support splitting it region-wise (e.g. use a tiled GeoTIFF instead).')
+                    image = None
                 except Exception:
                     raise Exception('File is not a valid image.')
 
@@ -272,37 +334,30 @@ class DataWorker:
                 destFolder = os.path.join(self.config.getProperty('FileServer', 'staticfiles_dir'), project, parent)
                 os.makedirs(destFolder, exist_ok=True)
 
-                images = []
-                filenames = []
-
                 if not splitImages:
                     # upload the single image directly
-                    images.append(image)
-                    filenames.append(filename)
+                    subImages = [(image, filename)]
 
                 else:
-                    # split image into patches instead
-                    images, coords = split_image(image,
+                    # split image into patches instead; these are read lazily to limit memory usage
+                    bareFileName, ext = os.path.splitext(filename)
+                    subImages = ((patch, f'{bareFileName}_{c[0]}_{c[1]}{ext}') for patch, c in split_image_windowed(cache,
                                             splitProperties['patchSize'],
                                             splitProperties['stride'],
-                                            splitProperties['tight'])
-                    bareFileName, ext = os.path.splitext(filename)
-                    filenames = [f'{bareFileName}_{c[0]}_{c[1]}{ext}' for c in coords]
+                                            splitProperties['tight']))
 
                 # register and save all the images
-                for i in range(len(images)):
-                    subImage = images[i]
-                    subFilename = filenames[i]
+                for subImage, subFilename in subImages:
 
                     absFilePath = os.path.join(destFolder, subFilename)
 
                     # check if an image with the same name does not already exist
                     newFileName = subFilename
-                    fileExists = os.path.exists(absFilePath)
+                    fileExists = _path_taken(absFilePath)
                     if fileExists:
                         if existingFiles == 'keepExisting':
                             # rename new file
-                            while(os.path.exists(absFilePath)):
+                            while(_path_taken(absFilePath)):
                                 # rename file
                                 fn, ext = os.path.splitext(newFileName)
                                 match = self.countPattern.search(fn)
@@ -314,7 +369,7 @@ class DataWorker:
                                     newFileName = fn[:match.span()[0]] + '_' + str(number+1) + ext
 
                                 absFilePath = os.path.join(destFolder, newFileName)
-                                if not os.path.exists(absFilePath):
+                                if not _path_taken(absFilePath):
                                     imgs_warn[key] = 'An image with name "{}" already exists under given path on disk. Image has been renamed to "{}".'.format(
                                         subFilename, newFileName
                                     )
@@ -327,6 +382,10 @@ class DataWorker:
                             continue
 
                         elif existingFiles == 'replaceExisting':
+                            if absFilePath in reservedPaths:
+                                # image is still being written as part of this upload
+                                raise Exception(f'Image "{newFileName}" has been uploaded more than once.')
+
                             # overwrite new file; first remove metadata
                             queryStr = sql.SQL('''
                                 DELETE FROM {id_iu}
@@ -368,14 +427,22 @@ class DataWorker:
                     fileParent, _ = os.path.split(absFilePath)
                     if len(fileParent):
                         os.makedirs(fileParent, exist_ok=True)
-                    subImage.save(absFilePath)
-
-                    imgs_valid.append(key)
-                    imgPaths_valid.append(os.path.join(parent, newFileName))
+                    reservedPaths.add(absFilePath)
+                    writer.write(subImage, absFilePath)
+                    pendingWrites.append((absFilePath, key, os.path.join(parent, newFileName)))
 
             except Exception as e:
                 imgs_error[key] = str(e)
 
+        # wait for all images to be written; only register the ones that succeeded
+        writeErrors = writer.close()
+        for absFilePath, key, imgPath in pendingWrites:
+            if absFilePath in writeErrors:
+                imgs_error[key] = str(writeErrors[absFilePath])
+            else:
+                imgs_valid.append(key)
+                imgPaths_valid.append(imgPath)
+
         # register valid images in database
         if len(imgPaths_valid):
             queryStr = sql.SQL('''
@@ -397,35 +464,58 @@ class DataWorker:
         return result
 
 
-    def scanForImages(self, project):
+    def _scan_project_folder(self, project):
         '''
-            Searches the project image folder on disk for
-            files that are valid, but have not (yet) been added
-            to the database.
-            Returns a list of paths with files.
+            Incrementally scans the project image folder on disk and syncs
+            the set of file names registered in the database, using a per-
+            project manifest stored in the temporary files directory (see
+            "util.folderManifest").
+            The file names are only re-read from the database if the count
+            or latest addition date of the images has changed.
+            Returns the manifest (with fields "diskFiles" and "dbFiles"),
+            or None if no folder exists for the project.
         '''
-
-        # scan disk for files
         projectFolder = os.path.join(self.config.getProperty('FileServer', 'staticfiles_dir'), project)
         if (not os.path.isdir(projectFolder)) and (not os.path.islink(projectFolder)):
             # no folder exists for the project (should not happen due to broadcast at project creation)
-            return []
-        imgs_disk = listDirectory(projectFolder, recursive=True)
-        
-        # get all existing file paths from database
-        imgs_database = set()
-        queryStr = sql.SQL('''
-            SELECT filename FROM {id_img};
+            return None
+        manifest = FolderManifest(projectFolder,
+                        os.path.join(self.tempDir, 'aide/folderManifests', project + '.json'))
+        manifest.scan()
+
+        # check if database entries have changed since last scan
+        fingerprint = self.dbConnector.execute(sql.SQL('''
+            SELECT COUNT(*) AS num_img, EXTRACT(epoch FROM MAX(date_added))::float8 AS last_added
+            FROM {id_img};
         ''').format(
             id_img=sql.Identifier(project, 'image')
-        )
-        result = self.dbConnector.execute(queryStr, None, 'all')
-        for r in range(len(result)):
-            imgs_database.add(result[r]['filename'])
+        ), None, 1)[0]
+        fingerprint = [fingerprint['num_img'], (float(fingerprint['last_added']) if fingerprint['last_added'] is not None else None)]
 
-        # filter
-        imgs_candidates = imgs_disk.difference(imgs_database)
-        return list(imgs_candidates)
+        if manifest.dbFiles is None or manifest.dbFingerprint != fingerprint:
+            queryStr = sql.SQL('''
+                SELECT filename FROM {id_img};
+            ''').format(
+                id_img=sql.Identifier(project, 'image')
+            )
+            result = self.dbConnector.execute(queryStr, None, 'all')
+            manifest.set_database_files((r['filename'] for r in result), fingerprint)
+
+        manifest.save()
+        return manifest
+
+
+    def scanForImages(self, project):
+        '''
+            Searches the project image folder on disk for
+            files that are valid, but have not (yet) been added
+            to the database.
+            Returns a list of paths with files.
+        '''
+        manifest = self._scan_project_folder(project)
+        if manifest is None:
+            return []
+        return list(manifest.diskFiles.difference(manifest.dbFiles))
 
 
     def addExistingImages(self, project, imageList=None):
@@ -460,7 +550,8 @@ class DataWorker:
         # add to database
         queryStr = sql.SQL('''
             INSERT INTO {id_img} (filename)
-            VALUES %s;
+            VALUES %s
+            ON CONFLICT (filename) DO NOTHING;
         ''').format(
             id_img=sql.Identifier(project, 'image')
         )
@@ -595,24 +686,21 @@ class DataWorker:
             and returns those entries and all associated (meta-) data from the
             database.
         '''
-        imgs_DB = self.dbConnector.execute(sql.SQL('''
-            SELECT id, filename FROM {id_img};
-        ''').format(
-            id_img=sql.Identifier(project, 'image')
-        ), None, 'all')
-
-        projectFolder = os.path.join(self.config.getProperty('FileServer', 'staticfiles_dir'), project)
-        if (not os.path.isdir(projectFolder)) and (not os.path.islink(projectFolder)):
+        manifest = self._scan_project_folder(project)
+        if manifest is None:
             return []
-        imgs_disk = listDirectory(projectFolder, recursive=True)
-        imgs_disk = set(imgs_disk)
-        
+
         # get orphaned images
-        imgs_orphaned = []
-        for i in imgs_DB:
-            if i['filename'] not in imgs_disk:
-                imgs_orphaned.append(i['id'])
-        # imgs_orphaned = list(set(imgs_DB).difference(imgs_disk))
+        filenames_orphaned = manifest.dbFiles.difference(manifest.diskFiles)
+        if not len(filenames_orphaned):
+            return []
+        imgs_orphaned = self.dbConnector.execute(sql.SQL('''
+            SELECT id FROM {id_img}
+            WHERE filename IN %s;
+        ''').format(
+            id_img=sql.Identifier(project, 'image')
+        ), (tuple(filenames_orphaned),), 'all')
+        imgs_orphaned = [i['id'] for i in imgs_orphaned]
         if not len(imgs_orphaned):
             return []
         
@@ -743,7 +831,7 @@ class DataWorker:
                             indexedColors.extend([0,0,0])
                         else:
                             # convert to RGB format
-                            indexedColors.extend(helpers.hexToRGB(color))
+                            indexedColors.extend(hexToRGB(color))
 
                 except:
                     # an error occurred; don't convert segmentation mask to indexed colors
@@ -755,10 +843,26 @@ class DataWorker:
             is_segmentation = False
             fileExtension = '.txt'      #TODO: support JSON?
 
+        # check for an existing export of the same request
+        appendFrom = None
+        if self.exportCache.enabled:
+            cacheKey = ExportCache.make_key(project, dataType, userList, dateRange, extraFields, segmaskFilenameOptions, segmaskEncoding)
+            watermark = self._get_data_watermark(project, dataType)
+            cached = self.exportCache.get(cacheKey)
+            if cached is not None:
+                if cached['watermark'] == watermark:
+                    # data unchanged; serve existing file
+                    return cached['filename']
+                elif not is_segmentation and self._is_append_only(project, dataType, cached['watermark'], watermark):
+                    # only new entries have been added; append them to a copy of the existing file
+                    appendFrom = cached
+
         # prepare output file
         filename = 'aide_query_{}'.format(now.strftime('%Y-%m-%d_%H-%M-%S')) + fileExtension
         destPath = os.path.join(self.tempDir, 'aide/downloadRequests', project)
         os.makedirs(destPath, exist_ok=True)
+        if appendFrom is not None and appendFrom['filename'] != filename:
+            shutil.copyfile(os.path.join(destPath, appendFrom['filename']), os.path.join(destPath, filename))
         destPath = os.path.join(destPath, filename)
 
         # generate query
@@ -795,6 +899,15 @@ class DataWorker:
                 dateStr = sql.SQL('WHERE timecreated >= to_timestamp(%s) AND timecreated <= to_timestamp(%s)')
             queryArgs.extend(dateRange)
 
+        xminStr = sql.SQL('')
+        if appendFrom is not None:
+            # only query entries inserted after the existing export
+            if len(userStr.string) or len(dateStr.string):
+                xminStr = sql.SQL(' AND t.xmin::text::bigint > %s')
+            else:
+                xminStr = sql.SQL('WHERE t.xmin::text::bigint > %s')
+            queryArgs.append(appendFrom['watermark'][dataType][1])
+
         if not is_segmentation:
             # join label classes
             lcStr = sql.SQL('''
@@ -809,12 +922,11 @@ class DataWorker:
         else:
             lcStr = sql.SQL('')
 
-        # remove redundant query fields
-        queryFields = set(queryFields)
+        # remove redundant query fields (in a fixed order, so that appended exports stay consistent)
+        queryFields = list(dict.fromkeys(queryFields))
         for key in extraFields.keys():
-            if not extraFields[key]:
+            if not extraFields[key] and key in queryFields:
                 queryFields.remove(key)
-        queryFields = list(queryFields)
 
         queryStr = sql.SQL('''
             SELECT * FROM {tableID} AS t
@@ -826,65 +938,78 @@ class DataWorker:
             {iuStr}
             {userStr}
             {dateStr}
+            {xminStr}
         ''').format(
             tableID=tableID,
             id_img=sql.Identifier(project, 'image'),
             lcStr=lcStr,
             iuStr=iuStr,
             userStr=userStr,
-            dateStr=dateStr
+            dateStr=dateStr,
+            xminStr=xminStr
         )
 
-        # query and process data
+        # query and process data; rows are streamed from the database and written out incrementally
         if is_segmentation:
             mainFile = zipfile.ZipFile(destPath, 'w', zipfile.ZIP_DEFLATED)
+            metaFile = tempfile.SpooledTemporaryFile(max_size=self.EXPORT_SPOOL_SIZE, mode='w+')
+
+            # segmentation masks are encoded in parallel, but written to the archive in order
+            executor = ThreadPoolExecutor(max_workers=self.EXPORT_NUM_WORKERS)
+            pendingMasks = deque()
+        elif appendFrom is not None:
+            mainFile = open(destPath, 'a')
+            metaFile = mainFile
         else:
             mainFile = open(destPath, 'w')
-        metaStr = '; '.join(queryFields) + '\n'
-
-        with self.dbConnector.execute_cursor(queryStr, tuple(queryArgs)) as cursor:
-            while True:
-                b = cursor.fetchone()
-                if b is None:
-                    break
-
-                if is_segmentation:
-                    # convert and store segmentation mask separately
-                    segmask_filename = 'segmentation_masks/'
-
-                    if segmaskFilenameOptions['baseName'] == 'id':
-                        innerFilename = b['image']
-                        parent = ''
-                    else:
-                        innerFilename = b['filename']
-                        parent, innerFilename = os.path.split(innerFilename)
-                    finalFilename = os.path.join(parent, segmaskFilenameOptions['prefix'] + innerFilename + segmaskFilenameOptions['suffix'] +'.tif')
-                    segmask_filename += finalFilename
-
-                    segmask = base64ToImage(b['segmentationmask'], b['width'], b['height'])
-
-                    if indexedColors is not None and len(indexedColors)>0:
-                        # convert to indexed color and add color palette from label classes
-                        segmask = segmask.convert('RGB').convert('P', palette=Image.ADAPTIVE, colors=3)
-                        segmask.putpalette(indexedColors)
-
-                    # save
-                    bio = io.BytesIO()
-                    segmask.save(bio, 'TIFF')
-                    mainFile.writestr(segmask_filename, bio.getvalue())
-
-                # store metadata
-                metaLine = ''
-                for field in queryFields:
-                    if field.lower() == 'segmentationmask':
-                        continue
-                    metaLine += '{}; '.format(b[field.lower()])
-                metaStr += metaLine + '\n'
-        
+            metaFile = mainFile
+        metaFields = [field.lower() for field in queryFields if field.lower() != 'segmentationmask']
+        if appendFrom is None:
+            metaFile.write('; '.join(queryFields) + '\n')
+
+        def _write_masks(maxPending):
+            while len(pendingMasks) > maxPending:
+                segmask_filename, future = pendingMasks.popleft()
+                mainFile.writestr(segmask_filename, future.result(), compress_type=zipfile.ZIP_STORED)
+
+        numRows = 0
+        lastUpdate = time.time()
+        for b in self.dbConnector.execute_streaming(queryStr, tuple(queryArgs)):
+
+            if is_segmentation:
+                # convert and store segmentation mask separately
+                segmask_filename = 'segmentation_masks/'
+
+                if segmaskFilenameOptions['baseName'] == 'id':
+                    innerFilename = str(b['image'])
+                    parent = ''
+                else:
+                    innerFilename = b['filename']
+                    parent, innerFilename = os.path.split(innerFilename)
+                finalFilename = os.path.join(parent, segmaskFilenameOptions['prefix'] + innerFilename + segmaskFilenameOptions['suffix'] +'.tif')
+                segmask_filename += finalFilename
+
+                pendingMasks.append((segmask_filename, executor.submit(_encode_segmentation_mask,
+                                        b['segmentationmask'], b['width'], b['height'], indexedColors)))
+                _write_masks(self.EXPORT_MAX_PENDING)
+
+            # store metadata
+            metaFile.write(''.join('{}; '.format(b[field]) for field in metaFields) + '\n')
+
+            numRows += 1
+            if time.time() - lastUpdate >= self.EXPORT_PROGRESS_INTERVAL:
+                _update_task_progress(numRows, f'{numRows} entries exported')
+                lastUpdate = time.time()
+
         if is_segmentation:
-            mainFile.writestr('query.txt', metaStr)
-        else:
-            mainFile.write(metaStr)
+            _write_masks(0)
+            executor.shutdown(wait=True)
+
+            metaFile.seek(0)
+            with mainFile.open('query.txt', 'w') as f:
+                for line in metaFile:
+                    f.write(line.encode('utf-8'))
+            metaFile.close()
 
         if is_segmentation:
             # append separate text file for label classes
@@ -908,10 +1033,87 @@ class DataWorker:
 
         mainFile.close()
 
+        # register in cache if no data has been modified during the export
+        if self.exportCache.enabled and self._get_data_watermark(project, dataType) == watermark:
+            self.exportCache.put(cacheKey, project, filename, watermark)
+
         return filename
 
 
 
+    def _get_data_watermark(self, project, dataType):
+        '''
+            Returns a watermark of the state of the data that make up a data
+            download of the given type: the number of rows and the highest ID
+            of the transaction that inserted or last updated a row ("xmin")
+            of the data and label class tables, and the number of images,
+            the date the latest one was added, and the number of golden
+            question and corrupt images.
+            Columns that change whenever images are viewed (image "last_re-
+            quested" and the "image_user" table) are deliberately left out,
+            so that exports of active projects can still be reused; their
+            values are as of the time of the (first) export.
+        '''
+        queryStr = sql.SQL('''
+            SELECT data.*, lc.*, img.*
+            FROM (
+                SELECT COUNT(*) AS data_rows, COALESCE(MAX(xmin::text::bigint), 0) AS data_xmin
+                FROM {id_data}
+            ) AS data, (
+                SELECT COUNT(*) AS lc_rows, COALESCE(MAX(xmin::text::bigint), 0) AS lc_xmin
+                FROM {id_lc}
+            ) AS lc, (
+                SELECT COUNT(*) AS img_rows,
+                    COALESCE(EXTRACT(epoch FROM MAX(date_added))::float8, 0) AS img_added,
+                    COUNT(*) FILTER (WHERE isGoldenQuestion) AS img_golden,
+                    COUNT(*) FILTER (WHERE corrupt) AS img_corrupt
+                FROM {id_img}
+            ) AS img;
+        ''').format(
+            id_data=sql.Identifier(project, dataType),
+            id_lc=sql.Identifier(project, 'labelclass'),
+            id_img=sql.Identifier(project, 'image')
+        )
+        result = self.dbConnector.execute(queryStr, None, 1)[0]
+        return {
+            dataType: [result['data_rows'], result['data_xmin']],
+            'labelclass': [result['lc_rows'], result['lc_xmin']],
+            'image': [result['img_rows'], result['img_added'], result['img_golden'], result['img_corrupt']]
+        }
+
+
+
+    def _is_append_only(self, project, dataType, watermark_old, watermark_new):
+        '''
+            Returns True if, between two data watermarks, entries have only
+            been added to the data table (and label classes and existing
+            images are unchanged), so that an existing export can be extended
+            by the new entries.
+        '''
+        for table in watermark_old.keys():
+            if table == dataType:
+                continue
+            old, new = watermark_old[table], watermark_new.get(table, None)
+            if table == 'image' and new is not None and len(new) == len(old) and \
+                new[0] >= old[0] and new[1] >= old[1] and new[2:] == old[2:]:
+                # new images may have been added
+                continue
+            if old != new:
+                return False
+        if watermark_new[dataType][0] <= watermark_old[dataType][0]:
+            return False
+
+        # all entries that existed before must still be unmodified
+        numUnchanged = self.dbConnector.execute(sql.SQL('''
+            SELECT COUNT(*) AS num_rows FROM {id_table}
+            WHERE xmin::text::bigint <= %s;
+        ''').format(
+            id_table=sql.Identifier(project, dataType)
+        ), (watermark_old[dataType][1],), 1)[0]['num_rows']
+        return numUnchanged == watermark_old[dataType][0]
+
+
+
     def watchImageFolders(self):
         '''
             Queries all projects that have the image folder watch functionality
@@ -959,9 +1161,9 @@ class DataWorker:
             WHERE shortname = %s;
         ''', (project, project,), None)     # already done by DataAdministration.middleware, but we do it again to be sure
 
-        self.dbConnector.execute('''
+        self.dbConnector.execute(sql.SQL('''
             DROP SCHEMA IF EXISTS {} CASCADE;
-        '''.format(project), None, None)        #TODO: Identifier?
+        ''').format(sql.Identifier(project)), None, None)
 
         if deleteFiles:
             print('\tRemoving files...')
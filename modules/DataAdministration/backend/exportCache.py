@@ -0,0 +1,181 @@
+'''
+    Disk cache for data download requests.
+    Keeps track of the files generated by "DataWorker.prepareDataDownload"
+    together with the request parameters and a watermark of the project's
+    data at the time of export. Identical requests on unchanged data can
+    thus be served from the existing file. The total size of the cached
+    files is bounded; least recently used files are evicted first.
+    The cache index is shared between processes through a JSON file that
+    is protected by a file lock (on POSIX systems; elsewhere it is only
+    protected against concurrent access within the same process).
+    When an export is replaced by a newer one, the previous file is kept
+    until the one after is registered, so that downloads of it that are
+    still in progress are not interrupted.
+
+    2021 Benjamin Kellenberger
+'''
+
+import os
+import json
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # not available on non-POSIX systems
+    fcntl = None
+
+
+class ExportCache:
+
+    INDEX_FILENAME = 'exportCache.json'
+
+    _LOCK = threading.Lock()    # fallback if file locks are not available
+
+    def __init__(self, cacheDir, maxSize):
+        '''
+            - cacheDir:     root directory of the download request files
+                            (with one sub-directory per project).
+            - maxSize:      maximum total size of the cached files in bytes.
+                            Set to zero or a negative value to disable the
+                            cache.
+        '''
+        self.cacheDir = cacheDir
+        self.maxSize = maxSize
+        self.indexPath = os.path.join(self.cacheDir, self.INDEX_FILENAME)
+
+
+    @property
+    def enabled(self):
+        return self.maxSize > 0
+
+
+    @staticmethod
+    def make_key(project, dataType, userList, dateRange, extraFields,
+                segmaskFilenameOptions, segmaskEncoding):
+        '''
+            Returns a unique key for the parameters of a data download re-
+            quest.
+        '''
+        params = json.dumps([
+            project, dataType, sorted(userList),
+            [str(d) for d in dateRange],
+            extraFields, segmaskFilenameOptions, segmaskEncoding
+        ], sort_keys=True)
+        return hashlib.sha1(params.encode('utf-8')).hexdigest()
+
+
+    @contextmanager
+    def _index(self):
+        '''
+            Loads the cache index under an exclusive lock and writes it back
+            upon exiting the context.
+        '''
+        os.makedirs(self.cacheDir, exist_ok=True)
+        with self._LOCK, open(self.indexPath + '.lock', 'w') as lockFile:
+            if fcntl is not None:
+                fcntl.flock(lockFile, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self.indexPath, 'r') as f:
+                        index = json.load(f)
+                except Exception:
+                    index = {}
+                yield index
+                with open(self.indexPath, 'w') as f:
+                    json.dump(index, f)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+
+    def _file_path(self, entry, filename=None):
+        return os.path.join(self.cacheDir, entry['project'], (filename if filename is not None else entry['filename']))
+
+
+    def get(self, key):
+        '''
+            Returns the cache entry (dict with "project", "filename", "water-
+            mark", "size" and "last_access") for a given key, or None if there
+            is no entry or its file has been removed in the meantime.
+        '''
+        if not self.enabled:
+            return None
+        with self._index() as index:
+            entry = index.get(key, None)
+            if entry is None:
+                return None
+            if not os.path.isfile(self._file_path(entry)):
+                del index[key]
+                return None
+            entry['last_access'] = time.time()
+            return dict(entry)
+
+
+    def put(self, key, project, filename, watermark):
+        '''
+            Registers a newly exported file for a given key, replacing any
+            previous file for it. The previous file is only deleted once the
+            next one is registered (it may still be being downloaded). Evicts
+            least recently used files until the total size of the cache is
+            within limits again.
+        '''
+        if not self.enabled:
+            return
+        with self._index() as index:
+            entry = {
+                'project': project,
+                'filename': filename,
+                'previous': None,
+                'watermark': watermark,
+                'last_access': time.time()
+            }
+            entry['size'] = os.path.getsize(self._file_path(entry))
+
+            previous = index.get(key, None)
+            if previous is not None:
+                if previous['filename'] != filename:
+                    # keep the previous generation, remove the one before
+                    if previous.get('previous', None) not in (None, filename):
+                        self._remove_file(previous, previous['previous'])
+                    entry['previous'] = previous['filename']
+                else:
+                    entry['previous'] = previous.get('previous', None)
+                if entry['previous'] is not None:
+                    try:
+                        entry['size'] += os.path.getsize(self._file_path(entry, entry['previous']))
+                    except OSError:
+                        entry['previous'] = None
+            index[key] = entry
+
+            # evict least recently used files (except the new one)
+            totalSize = sum(e['size'] for e in index.values())
+            for oldKey in sorted(index.keys(), key=lambda k: index[k]['last_access']):
+                if totalSize <= self.maxSize:
+                    break
+                if oldKey == key:
+                    continue
+                totalSize -= index[oldKey]['size']
+                self._remove_file(index[oldKey])
+                del index[oldKey]
+
+
+    def _remove_file(self, entry, filename=None):
+        '''
+            Deletes a given file of an entry, or all of its files (current
+            and previous generation) if "filename" is None.
+        '''
+        if filename is not None:
+            filenames = [filename]
+        else:
+            filenames = [entry['filename'], entry.get('previous', None)]
+        for fn in filenames:
+            if fn is None:
+                continue
+            try:
+                os.remove(self._file_path(entry, fn))
+            except OSError:
+                pass
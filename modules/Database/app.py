@@ -1,12 +1,21 @@
 '''
     Database connection functionality.
+    The connection pool is only created upon first use (unless the instance
+    is launched with "verbose_start", in which case the connection is veri-
+    fied immediately), so that instantiating modules that may never access
+    the database (e.g. Celery interfaces of other roles) is cheap. This also
+    allows instances to be pickled (e.g. to be passed to training processes,
+    which then create their own pool).
 
-    2019-20 Benjamin Kellenberger
+    2019-21 Benjamin Kellenberger
 '''
 
 from contextlib import contextmanager
+from threading import Lock
+from uuid import uuid4
 import psycopg2
 from psycopg2.pool import ThreadedConnectionPool
+from psycopg2 import sql
 from psycopg2.extras import RealDictCursor, execute_values
 psycopg2.extras.register_uuid()
 from util.helpers import LogDecorator
@@ -32,19 +41,45 @@ class Database():
                 LogDecorator.print_status('fail')
             raise Exception(f'Incomplete database credentials provided in configuration file (message: "{str(e)}").')
 
-        try:
-            self._createConnectionPool()
-        except Exception as e:
-            if verbose_start:
-                LogDecorator.print_status('fail')
-            raise Exception(f'Could not connect to database (message: "{str(e)}").')
+        self._connectionPool = None
+        self._poolLock = Lock()
 
         if verbose_start:
+            try:
+                self._createConnectionPool()
+            except Exception as e:
+                LogDecorator.print_status('fail')
+                raise Exception(f'Could not connect to database (message: "{str(e)}").')
             LogDecorator.print_status('ok')
 
 
+    @property
+    def connectionPool(self):
+        if self._connectionPool is None:
+            with self._poolLock:
+                if self._connectionPool is None:
+                    try:
+                        self._createConnectionPool()
+                    except Exception as e:
+                        raise Exception(f'Could not connect to database (message: "{str(e)}").')
+        return self._connectionPool
+
+
+    def __getstate__(self):
+        # connections cannot be shared among processes
+        state = self.__dict__.copy()
+        state['_connectionPool'] = None
+        del state['_poolLock']
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._poolLock = Lock()
+
+
     def _createConnectionPool(self):
-        self.connectionPool = ThreadedConnectionPool(
+        self._connectionPool = ThreadedConnectionPool(
             1,
             self.config.getProperty('Database', 'max_num_connections', type=int, fallback=20),
             host=self.host,
@@ -56,6 +91,24 @@ class Database():
         )
 
 
+    def connect(self):
+        '''
+            Returns a new connection in autocommit mode that is not part of
+            the pool (e.g. for long-lived connections that LISTEN to notifi-
+            cations). The caller is responsible for closing it.
+        '''
+        conn = psycopg2.connect(
+            host=self.host,
+            database=self.database,
+            port=self.port,
+            user=self.user,
+            password=self.password,
+            connect_timeout=2
+        )
+        conn.autocommit = True
+        return conn
+
+
     def runServer(self):
         ''' Dummy function for compatibility reasons '''
         return
@@ -145,6 +198,56 @@ class Database():
                     print(e)
 
 
+    def execute_streaming(self, query, arguments, batchSize=2000):
+        '''
+            Executes a query through a server-side (named) cursor and
+            yields the resulting rows one by one. Rows are transferred
+            from the database in batches of "batchSize", so that large
+            result sets never have to be held in memory at once.
+        '''
+        with self._get_connection() as conn:
+            conn.autocommit = False     # named cursors require a transaction
+            success = False
+            try:
+                with conn.cursor(name='aide_' + uuid4().hex, cursor_factory=RealDictCursor) as cursor:
+                    cursor.itersize = batchSize
+                    cursor.execute(query, arguments)
+                    for row in cursor:
+                        yield row
+                conn.commit()
+                success = True
+            finally:
+                if not success and not conn.closed:
+                    conn.rollback()
+
+
+    def copy_from(self, query, dataFile, queryBefore=None, queryAfter=None):
+        '''
+            Executes a "COPY ... FROM STDIN" statement with the contents of a
+            file-like object. This is by far the fastest way to insert large
+            numbers of rows.
+            Optional statements "queryBefore" and "queryAfter" are executed
+            in the same transaction before and after the COPY (e.g. to copy
+            into a temporary table and insert its contents from there).
+        '''
+        with self._get_connection() as conn:
+            conn.autocommit = False     # all statements are committed at once
+            cursor = conn.cursor()
+            try:
+                if isinstance(query, sql.Composable):
+                    query = query.as_string(conn)
+                if queryBefore is not None:
+                    cursor.execute(queryBefore)
+                cursor.copy_expert(query, dataFile)
+                if queryAfter is not None:
+                    cursor.execute(queryAfter)
+                conn.commit()
+            except Exception:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+
+
     def insert(self, query, values):
         with self._get_connection() as conn:
             cursor = conn.cursor()
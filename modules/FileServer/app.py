@@ -1,13 +1,14 @@
 '''
     Serves files, such as images, from a local directory.
 
-    2019-20 Benjamin Kellenberger
+    2019-21 Benjamin Kellenberger
 '''
 
 import os
-from bottle import static_file
+from bottle import request
 from util.cors import enable_cors
 from util import helpers
+from .backend.staticFiles import send_file as send_static_file
 
 
 class FileServer():
@@ -27,6 +28,7 @@ class FileServer():
         try:
             self.staticDir = self.config.getProperty('FileServer', 'staticfiles_dir')
             self.staticAddressSuffix = self.config.getProperty('FileServer', 'staticfiles_uri_addendum', type=str, fallback='').strip()
+            self.cacheMaxAge = self.config.getProperty('FileServer', 'cache_max_age', type=int, fallback=3600)
 
             self._initBottle()
         except Exception as e:
@@ -50,4 +52,4 @@ class FileServer():
         @enable_cors
         @self.app.route(os.path.join('/', self.staticAddressSuffix, '/<project>/files/<path:path>'))
         def send_file(project, path):
-            return static_file(path, root=os.path.join(self.staticDir, project))
\ No newline at end of file
+            return send_static_file(request, os.path.join(self.staticDir, project), path, self.cacheMaxAge)
\ No newline at end of file
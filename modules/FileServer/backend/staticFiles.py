@@ -0,0 +1,180 @@
+'''
+    Serving path for static files (images) of the FileServer, as a replace-
+    ment of "bottle.static_file" that adds:
+    - strong ETags, derived from the identity of the file (device, inode,
+      size and modification time in nanoseconds);
+    - conditional requests ("If-None-Match", "If-Modified-Since") answered
+      with "304 Not Modified";
+    - "Cache-Control" headers: versioned URLs (query parameter "v" set to
+      the file's ETag) are immutable and may be cached indefinitely; all
+      other responses may be cached for a configurable number of seconds,
+      after which they are revalidated;
+    - single byte range requests ("Range", "If-Range");
+    - zero-copy transmission: the response body is a (range-limited) file
+      object, which the WSGI server transmits with "sendfile" if it supports
+      it (e.g. Gunicorn through "wsgi.file_wrapper").
+
+    2021 Benjamin Kellenberger
+'''
+
+import os
+import re
+import hashlib
+import mimetypes
+import email.utils
+from bottle import HTTPResponse, HTTPError
+
+
+IMMUTABLE_MAX_AGE = 31536000    # one year; maximum recommended by RFC 2616
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class _RangeFile:
+    '''
+        Read-only file object that ends after a given number of bytes. The
+        underlying file is positioned at the start of the range, so that
+        WSGI servers that use "sendfile" on the file descriptor (together
+        with the "Content-Length" header) only transmit the range.
+    '''
+    def __init__(self, fileHandle, length):
+        self.fileHandle = fileHandle
+        self.remaining = length
+
+    def fileno(self):
+        return self.fileHandle.fileno()
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fileHandle.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.fileHandle.close()
+
+
+
+def make_etag(stat):
+    '''
+        Returns a strong ETag (without quotes) for a file's "os.stat" result.
+    '''
+    identity = '{}-{}-{}-{}'.format(stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    return hashlib.sha1(identity.encode('utf-8')).hexdigest()[:20]
+
+
+def _etag_matches(header, etag):
+    if header is None:
+        return False
+    header = header.strip()
+    if header == '*':
+        return True
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag.strip('"') == etag:
+            return True
+    return False
+
+
+def _parse_range(header, size):
+    '''
+        Returns the (start, end) byte offsets (end exclusive) of a single
+        byte range, None if the header is not a single byte range (in which
+        case the full file is served), or False if it is not satisfiable.
+    '''
+    match = RANGE_PATTERN.match(header.strip().replace(' ', ''))
+    if match is None:
+        return None
+    start, end = match.groups()
+    if not len(start):
+        if not len(end):
+            return None
+        # suffix range: last N bytes
+        length = int(end)
+        if length == 0:
+            return False
+        return max(0, size - length), size
+    start = int(start)
+    end = (min(int(end) + 1, size) if len(end) else size)
+    if start >= size or start >= end:
+        return False
+    return start, end
+
+
+def send_file(request, root, path, maxAge=0):
+    '''
+        Returns an HTTPResponse with the file under "path" (relative to the
+        "root" directory), or raises an HTTPError.
+        "request" is the current bottle request; "maxAge" the number of
+        seconds unversioned responses may be cached by clients.
+    '''
+    root = os.path.join(os.path.abspath(root), '')
+    fileName = os.path.abspath(os.path.join(root, path.strip('/\\')))
+    if not fileName.startswith(root):
+        raise HTTPError(403, 'Access denied.')
+    try:
+        stat = os.stat(fileName)
+    except OSError:
+        raise HTTPError(404, 'File does not exist.')
+    if not os.path.isfile(fileName):
+        raise HTTPError(404, 'File does not exist.')
+    if not os.access(fileName, os.R_OK):
+        raise HTTPError(403, 'You do not have permission to access this file.')
+
+    size = stat.st_size
+    etag = make_etag(stat)
+    lastModified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+    headers = {
+        'ETag': '"{}"'.format(etag),
+        'Last-Modified': lastModified,
+        'Accept-Ranges': 'bytes'
+    }
+    if request.query.get('v', None) == etag:
+        headers['Cache-Control'] = 'public, max-age={}, immutable'.format(IMMUTABLE_MAX_AGE)
+    else:
+        headers['Cache-Control'] = 'public, max-age={}'.format(int(maxAge))
+
+    # conditional requests; "If-None-Match" takes precedence (RFC 7232)
+    ifNoneMatch = request.environ.get('HTTP_IF_NONE_MATCH', None)
+    if ifNoneMatch is not None:
+        notModified = _etag_matches(ifNoneMatch, etag)
+    else:
+        ifModifiedSince = request.environ.get('HTTP_IF_MODIFIED_SINCE', None)
+        notModified = False
+        if ifModifiedSince is not None:
+            since = email.utils.parsedate_tz(ifModifiedSince.split(';')[0].strip())
+            notModified = since is not None and email.utils.mktime_tz(since) >= int(stat.st_mtime)
+    if notModified:
+        return HTTPResponse(status=304, **headers)
+
+    mimetype, encoding = mimetypes.guess_type(fileName)
+    headers['Content-Type'] = mimetype or 'application/octet-stream'
+    if encoding:
+        headers['Content-Encoding'] = encoding
+
+    if request.method == 'HEAD':
+        headers['Content-Length'] = size
+        return HTTPResponse(status=200, **headers)
+
+    # byte ranges; "If-Range" must match the current version, else the full file is served
+    start, end, status = 0, size, 200
+    rangeHeader = request.environ.get('HTTP_RANGE', None)
+    ifRange = request.environ.get('HTTP_IF_RANGE', None)
+    if rangeHeader is not None and (ifRange is None or _etag_matches(ifRange, etag) or ifRange.strip() == lastModified):
+        byteRange = _parse_range(rangeHeader, size)
+        if byteRange is False:
+            headers['Content-Range'] = 'bytes */{}'.format(size)
+            return HTTPResponse(status=416, **headers)
+        if byteRange is not None:
+            start, end = byteRange
+            status = 206
+            headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, end-1, size)
+
+    headers['Content-Length'] = end - start
+    fileHandle = open(fileName, 'rb')
+    if start > 0:
+        fileHandle.seek(start)
+    body = (fileHandle if end == size else _RangeFile(fileHandle, end - start))
+    return HTTPResponse(body, status=status, **headers)
@@ -1,7 +1,7 @@
 '''
     Definition of the layer between the UI frontend and the database.
 
-    2019-20 Benjamin Kellenberger
+    2019-21 Benjamin Kellenberger
 '''
 
 import os
@@ -19,6 +19,10 @@ from .annotation_sql_tokens import QueryStrings_annotation, AnnotationParser
 from util import helpers
 
 
+# Postgres channel on which submissions of annotations are announced (see AIController's "AutoTrainingTrigger")
+ANNOTATIONS_NOTIFY_CHANNEL = 'aide_annotations'
+
+
 class DBMiddleware():
 
     def __init__(self, config):
@@ -699,6 +703,11 @@ class DBMiddleware():
         )
         self.dbConnector.insert(queryStr, viewcountValues)
 
+        # announce submission (for auto-training)
+        if len(viewcountValues):
+            self.dbConnector.execute('SELECT pg_notify(%s, %s);',
+                (ANNOTATIONS_NOTIFY_CHANNEL, json.dumps({'project': project, 'num_images': len(viewcountValues)})), None)
+
         return 0
 
 
@@ -757,7 +766,7 @@ class DBMiddleware():
             Returns a list of image UUIDs and file names that have been bookmarked by a
             given user, along with the timestamp at which the bookmarks got created.
         '''
-        queryStr = sql.SQL('''SELECT image, filename, EXTRACT(epoch FROM timeCreated) AS timeCreated
+        queryStr = sql.SQL('''SELECT image, filename, EXTRACT(epoch FROM timeCreated)::float8 AS timeCreated
             FROM {id_bookmark} AS bm
             JOIN {id_img} AS img
             ON bm.image = img.id
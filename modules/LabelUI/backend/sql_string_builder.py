@@ -2,7 +2,7 @@
     Factory that creates SQL strings for querying and submission,
     adjusted to the arguments specified.
 
-    2019-20 Benjamin Kellenberger
+    2019-21 Benjamin Kellenberger
 '''
 
 from psycopg2 import sql
@@ -74,7 +74,7 @@ class SQLStringBuilder:
             usernameString = ''
 
         queryStr = sql.SQL('''
-            SELECT id, image, cType, viewcount, EXTRACT(epoch FROM last_checked) as last_checked, filename, isGoldenQuestion,
+            SELECT id, image, cType, viewcount, EXTRACT(epoch FROM last_checked)::float8 as last_checked, filename, isGoldenQuestion,
             COALESCE(bookmark, false) AS isBookmarked, {allCols} FROM (
                 SELECT id AS image, filename, isGoldenQuestion FROM {id_img}
                 WHERE id IN %s
@@ -179,7 +179,7 @@ class SQLStringBuilder:
             )
 
         queryStr = sql.SQL('''
-            SELECT id, image, cType, viewcount, EXTRACT(epoch FROM last_checked) as last_checked, filename, isGoldenQuestion,
+            SELECT id, image, cType, viewcount, EXTRACT(epoch FROM last_checked)::float8 as last_checked, filename, isGoldenQuestion,
             COALESCE(bookmark, false) AS isBookmarked, {allCols} FROM (
             SELECT id AS image, filename, 0 AS viewcount, 0 AS annoCount, NULL AS last_checked, 1E9 AS score, NULL AS timeCreated, isGoldenQuestion FROM {id_img} AS img
             WHERE isGoldenQuestion = TRUE
@@ -345,7 +345,7 @@ class SQLStringBuilder:
             goldenQuestionsString = sql.SQL('')
 
         queryStr = sql.SQL('''
-            SELECT id, image, cType, username, viewcount, EXTRACT(epoch FROM last_checked) as last_checked, filename, isGoldenQuestion,
+            SELECT id, image, cType, username, viewcount, EXTRACT(epoch FROM last_checked)::float8 as last_checked, filename, isGoldenQuestion,
             COALESCE(bookmark, false) AS isBookmarked, {annoCols} FROM (
                 SELECT id AS image, filename, isGoldenQuestion FROM {id_image}
                 {goldenQuestionsString}
@@ -423,7 +423,7 @@ class SQLStringBuilder:
             goldenQuestionsString = sql.SQL('')
 
         queryStr = sql.SQL('''
-            SELECT EXTRACT(epoch FROM MIN(last_checked)) AS minTimestamp, EXTRACT(epoch FROM MAX(last_checked)) AS maxTimestamp
+            SELECT EXTRACT(epoch FROM MIN(last_checked))::float8 AS minTimestamp, EXTRACT(epoch FROM MAX(last_checked))::float8 AS maxTimestamp
             FROM (
                 SELECT iu.image AS id, last_checked FROM {id_iu} AS iu
                 {skipEmptyString}
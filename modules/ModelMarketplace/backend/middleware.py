@@ -2,7 +2,7 @@
     Handles administration (sharing, uploading, selecting, etc.)
     of model states through the model marketplace.
 
-    2020 Benjamin Kellenberger
+    2020-21 Benjamin Kellenberger
 '''
 
 from uuid import UUID
@@ -63,7 +63,7 @@ class ModelMarketplaceMiddleware:
         result = self.dbConnector.execute(
             '''
                 SELECT id, name, description, labelclasses, model_library,
-                    annotationType, predictionType, EXTRACT(epoch FROM timeCreated) AS time_created, alcriterion_library,
+                    annotationType, predictionType, EXTRACT(epoch FROM timeCreated)::float8 AS time_created, alcriterion_library,
                     public, anonymous, selectCount,
                     is_owner, shared, tags,
                     CASE WHEN NOT is_owner AND anonymous THEN NULL ELSE author END AS author,
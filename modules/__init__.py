@@ -2,52 +2,103 @@
     Register modules here. Module-specific parameters in the config .ini file
     can be added under a section with the same name as the module.
 
-    2019-2020 Benjamin Kellenberger
+    Modules are registered by name and only imported upon first access (e.g.
+    through "REGISTERED_MODULES['LabelUI']" or "from modules import LabelUI"),
+    so that processes only load the modules requested through the "AIDE_MO-
+    DULES" environment variable. Modules that dispatch or consume Celery
+    tasks set up the Celery configuration ("celery_worker") before they are
+    imported.
+
+    2019-21 Benjamin Kellenberger
 '''
 
-# set up Celery configuration
-import celery_worker
-
-from .LabelUI.app import LabelUI
-from .Database.app import Database
-from .FileServer.app import FileServer
-from .UserHandling.app import UserHandler
-from .Reception.app import Reception
-from .ProjectAdministration.app import ProjectConfigurator
-from .ProjectStatistics.app import ProjectStatistics
-from .DataAdministration.app import DataAdministrator
-from .StaticFiles.app import StaticFileServer
-from .AIDEAdmin.app import AIDEAdmin
-from .ModelMarketplace.app import ModelMarketplace
-
-
-#TODO
-from .AIController.app import AIController
-from .AIWorker.app import AIWorker
-
-
-REGISTERED_MODULES = {
-    'LabelUI': LabelUI,
-    'AIController': AIController,
-    'AIWorker': AIWorker,
-    'Database': Database,
-    'FileServer': FileServer,
-    'UserHandler': UserHandler,
-    'Reception': Reception,
-    'ProjectConfigurator': ProjectConfigurator,
-    'ProjectStatistics': ProjectStatistics,
-    'DataAdministrator': DataAdministrator,
-    'StaticFileServer': StaticFileServer,
-    'AIDEAdmin': AIDEAdmin,
-    'ModelMarketplace': ModelMarketplace
+import sys
+import types
+import importlib
+import threading
+from collections.abc import Mapping
+
+
+# module name: (package, requires Celery)
+_MODULE_DEFINITIONS = {
+    'LabelUI': ('LabelUI', False),
+    'AIController': ('AIController', True),
+    'AIWorker': ('AIWorker', True),
+    'Database': ('Database', False),
+    'FileServer': ('FileServer', False),
+    'UserHandler': ('UserHandling', False),
+    'Reception': ('Reception', False),
+    'ProjectConfigurator': ('ProjectAdministration', True),
+    'ProjectStatistics': ('ProjectStatistics', False),
+    'DataAdministrator': ('DataAdministration', True),
+    'StaticFileServer': ('StaticFiles', False),
+    'AIDEAdmin': ('AIDEAdmin', True),
+    'ModelMarketplace': ('ModelMarketplace', False)
 }
 
 
-# #TODO: dirty hack...
-# try:
-#     from .AIController.app import AIController
-#     from .AIWorker.app import AIWorker
-#     REGISTERED_MODULES['AIController'] = AIController
-#     REGISTERED_MODULES['AIWorker'] = AIWorker
-# except:
-#     pass
\ No newline at end of file
+
+class _ModuleRegistry(Mapping):
+    '''
+        Read-only mapping of module names to module classes that imports the
+        modules' packages upon first access.
+    '''
+
+    def __init__(self, definitions):
+        self._definitions = definitions
+        self._classes = {}
+        self._lock = threading.RLock()
+
+
+    def __getitem__(self, moduleName):
+        if moduleName in self._classes:
+            return self._classes[moduleName]
+        if moduleName not in self._definitions:
+            raise KeyError(moduleName)
+        package, requiresCelery = self._definitions[moduleName]
+        with self._lock:
+            if moduleName not in self._classes:
+                if requiresCelery:
+                    # set up Celery configuration
+                    importlib.import_module('celery_worker')
+                moduleApp = importlib.import_module(f'.{package}.app', __name__)
+                self._classes[moduleName] = getattr(moduleApp, moduleName)
+        return self._classes[moduleName]
+
+
+    def __iter__(self):
+        return iter(self._definitions)
+
+
+    def __len__(self):
+        return len(self._definitions)
+
+
+    def is_loaded(self, moduleName):
+        return moduleName in self._classes
+
+
+
+REGISTERED_MODULES = _ModuleRegistry(_MODULE_DEFINITIONS)
+
+
+class _ModulesPackage(types.ModuleType):
+    '''
+        Resolves the module names as attributes of this package (e.g. "from
+        modules import Database") through the registry. Module names take
+        precedence over the identically named sub-packages, which the import
+        system would otherwise bind to this package upon their import.
+    '''
+    pass
+
+
+def _module_property(moduleName):
+    return property(
+        lambda self: REGISTERED_MODULES[moduleName],
+        lambda self, value: None
+    )
+
+for _moduleName in _MODULE_DEFINITIONS:
+    setattr(_ModulesPackage, _moduleName, _module_property(_moduleName))
+
+sys.modules[__name__].__class__ = _ModulesPackage
@@ -69,6 +69,12 @@ if __name__ == '__main__':
                     help='Kind of the provided annotations. One of {"annotation", "prediction"} (default: annotation)')
     parser.add_argument('--al_criterion', type=str, default='TryAll', const=1, nargs='?',
                     help='Criterion for the priority field. One of {"BreakingTies", "MaxConfidence", "TryAll"} (default: TryAll)')
+    parser.add_argument('--checkpoint', type=str, default=None, const=1, nargs='?',
+                    help='Optional path of a file to record imported label files in. If the import is interrupted, running it again with the same checkpoint file resumes it.')
+    parser.add_argument('--batch_size', type=int, default=10000, const=1, nargs='?',
+                    help='Number of label files to parse and insert into the database at once (default: 10000).')
+    parser.add_argument('--num_workers', type=int, default=None, const=1, nargs='?',
+                    help='Number of threads to parse label files with (default: number of CPU cores, up to 8).')
     args = parser.parse_args()
     
 
@@ -80,8 +86,8 @@ if __name__ == '__main__':
     import glob
     from tqdm import tqdm
     import datetime
-    from PIL import Image
     from util.configDef import Config
+    from util.bulkImport import BulkImporter
     from modules import Database
 
     if args.label_folder == '':
@@ -110,6 +116,8 @@ if __name__ == '__main__':
     if not imgBaseDir.endswith(os.sep):
         imgBaseDir += os.sep
 
+    importer = BulkImporter(dbConn, args.project, args.checkpoint, args.batch_size, args.num_workers)
+
 
     # parse class names and indices
     if args.label_folder is not None:
@@ -138,10 +146,8 @@ if __name__ == '__main__':
             classdef[idx] = returnVal[0]['id']
 
 
-        # prepare insertion SQL string
+        # get username
         if args.annotation_type == 'annotation':
-
-            # get username
             usernames = dbConn.execute('''
                 SELECT username FROM aide_admin.authentication
                 WHERE project = %s
@@ -152,50 +158,15 @@ if __name__ == '__main__':
                 'all'
             )
             usernames = [u['username'] for u in usernames]
+            username = usernames[0]
             if args.username is not None:
-                username = usernames[0]
-                if args.username not in usernames:
+                if args.username in usernames:
+                    username = args.username
+                else:
                     print(f'WARNING: username "{args.username}" not found, using "{username}" instead.')
             
-            else:
-                username = usernames[0]
-            
             print(f'Inserting annotations under username "{username}".')
 
-            queryStr = sql.SQL('''
-            INSERT INTO {id_anno} (username, image, timeCreated, timeRequired, label, x, y, width, height)
-            VALUES(
-                %s,
-                (SELECT id FROM {id_img} WHERE filename = %s),
-                (TIMESTAMP %s),
-                -1,
-                %s,
-                %s,
-                %s,
-                %s,
-                %s
-            );''').format(
-                id_anno=sql.Identifier(args.project, 'annotation'),
-                id_img=sql.Identifier(args.project, 'image')
-            )
-        elif args.annotation_type == 'prediction':
-            queryStr = sql.Identifier('''
-            INSERT INTO {id_pred} (image, timeCreated, label, confidence, x, y, width, height, priority)
-            VALUES(
-                (SELECT id FROM {id_img} WHERE filename = %s),
-                (TIMESTAMP %s),
-                %s,
-                %s,
-                %s,
-                %s,
-                %s,
-                %s,
-                %s
-            );''').format(
-                id_pred=sql.Identifier(args.project, 'prediction'),
-                id_img=sql.Identifier(args.project, 'image')
-            )
-
     # locate all images and their base names
     print('\nAdding image paths...')
     imgs = {}
@@ -212,84 +183,73 @@ if __name__ == '__main__':
         baseName = basePath.replace(imgBaseDir, '')
         imgs[baseName] = i.replace(imgBaseDir, '')
 
-
-    # ignore images that are already in database
-    print('Filter images already in database...')
-    imgs_filenames = set(imgs.values())
-    imgs_existing = dbConn.execute(sql.SQL('''
-        SELECT filename FROM {id_img};
-    ''').format(id_img=sql.Identifier(args.project, 'image')), None, 'all')
-    imgs_existing = set([i['filename'] for i in imgs_existing])
-
-    imgs_filenames = list(imgs_filenames.difference(imgs_existing))
-    imgs_filenames = [(i,) for i in imgs_filenames]
-
-    # push image to database
+    # push images that are not yet in the database
     print('Adding to database...')
-    dbConn.insert(sql.SQL('''
-        INSERT INTO {id_img} (filename)
-        VALUES %s;
-    ''').format(id_img=sql.Identifier(args.project, 'image')),
-    imgs_filenames)
+    imageIDs = importer.register_images(imgs.values())
 
     
     # locate all label files
     if args.label_folder is not None:
         print('\nAdding labels...')
-        labelFiles = glob.glob(os.path.join(args.label_folder, '**'), recursive=True)
-        for l in tqdm(labelFiles):
-
+        labelFiles = []
+        for l in glob.glob(os.path.join(args.label_folder, '**'), recursive=True):
             if os.path.isdir(l) or 'classes.txt' in l:
                 continue
-
             basePath, _ = os.path.splitext(l)
             baseName = basePath.replace(args.label_folder, '')
 
-            # load matching image
-            if not baseName in imgs:
-                continue
+            # only consider label files with matching image
+            if baseName in imgs:
+                labelFiles.append(l)
 
-            img = Image.open(os.path.join(imgBaseDir,imgs[baseName]))
-            sz = img.size
+        def _parse_label_file(l):
+            basePath, _ = os.path.splitext(l)
+            imageID = imageIDs[imgs[basePath.replace(args.label_folder, '')]]
 
             # load labels
             with open(l, 'r') as f:
                 lines = f.readlines()
 
             # parse annotations
-            labels = []
-            bboxes = []
-            if len(lines):
-                for line in lines:
-                    tokens = line.strip().split(' ')
-                    label = int(tokens[0])
-                    labels.append(label)
-                    bbox = [float(t) for t in tokens[1:5]]
-                    bboxes.append(bbox)
-                
-                    # push to database
-                    if args.annotation_type == 'annotation':
-                        dbConn.execute(queryStr,
-                            (username, imgs[baseName], currentDT, classdef[label], bbox[0], bbox[1], bbox[2], bbox[3]))
-                            
-                    elif args.annotation_type == 'prediction':
-                        # calculate additional properties
-                        maxConf = None
-                        priority = None
-                        try:
-                            confidences = [float(t) for t in tokens[5:]]
-                            confidences.sort()
-                            maxConf = confidences[-1]
-                            if args.al_criterion is None or args.al_criterion == '' or args.al_criterion == 'none':
-                                priority = None
-                            elif args.al_criterion == 'BreakingTies':
-                                priority = 1 - (confidences[-1] - confidences[-2])
-                            elif args.al_criterion == 'MaxConfidence':
-                                priority = confidences[-1]
-                            elif args.al_criterion == 'TryAll':
-                                breakingTies = 1 - (confidences[-1] - confidences[-2])
-                                priority = max(maxConf, breakingTies)
-                        finally:
-                            # no values provided
-                            dbConn.execute(queryStr,
-                                (imgs[baseName], currentDT, classdef[label], maxConf, bbox[0], bbox[1], bbox[2], bbox[3], priority))
\ No newline at end of file
+            rows = []
+            for line in lines:
+                tokens = line.strip().split(' ')
+                if len(tokens) < 5:
+                    continue
+                label = int(tokens[0])
+                bbox = [float(t) for t in tokens[1:5]]
+
+                if args.annotation_type == 'annotation':
+                    rows.append((username, imageID, currentDT, -1, classdef[label], bbox[0], bbox[1], bbox[2], bbox[3]))
+
+                elif args.annotation_type == 'prediction':
+                    # calculate additional properties
+                    maxConf = None
+                    priority = None
+                    confidences = [float(t) for t in tokens[5:]]
+                    if len(confidences):
+                        confidences.sort()
+                        maxConf = confidences[-1]
+                        breakingTies = (1 - (confidences[-1] - confidences[-2]) if len(confidences) > 1 else None)
+                        if args.al_criterion is None or args.al_criterion == '' or args.al_criterion == 'none':
+                            priority = None
+                        elif args.al_criterion == 'BreakingTies':
+                            priority = breakingTies
+                        elif args.al_criterion == 'MaxConfidence':
+                            priority = confidences[-1]
+                        elif args.al_criterion == 'TryAll':
+                            priority = max(maxConf, (breakingTies if breakingTies is not None else maxConf))
+                    rows.append((imageID, currentDT, classdef[label], maxConf, bbox[0], bbox[1], bbox[2], bbox[3], priority))
+            return rows
+
+        if args.annotation_type == 'annotation':
+            table = 'annotation'
+            columns = ['username', 'image', 'timeCreated', 'timeRequired', 'label', 'x', 'y', 'width', 'height']
+        else:
+            table = 'prediction'
+            columns = ['image', 'timeCreated', 'label', 'confidence', 'x', 'y', 'width', 'height', 'priority']
+
+        with tqdm(total=len(labelFiles)) as pBar:
+            numRows = importer.import_rows(table, columns, labelFiles, _parse_label_file, pBar,
+                [c for c in columns if c != 'timeCreated'])
+        print(f'{numRows} bounding boxes added.')
\ No newline at end of file
@@ -22,7 +22,9 @@ from util.helpers import valid_image_extensions, listDirectory
 
 if __name__ == '__main__':
 
-    parser = argparse.ArgumentParser(description='Parse YOLO annotations and import into database.')
+    parser = argparse.ArgumentParser(description='Import images into database.')
+    parser.add_argument('--project', type=str, default=None, const=1, nargs='?',
+                    help='Project shortname to import the images into. If not provided, the legacy "schema" parameter in section [Database] of the settings file is used.')
     parser.add_argument('--settings_filepath', type=str, default='config/settings.ini', const=1, nargs='?',
                     help='Manual specification of the directory of the settings.ini file; only considered if environment variable unset (default: "config/settings.ini").')
     args = parser.parse_args()
@@ -33,21 +35,18 @@ if __name__ == '__main__':
     if not 'AIDE_CONFIG_PATH' in os.environ:
         os.environ['AIDE_CONFIG_PATH'] = str(args.settings_filepath)
 
-    import glob
     from tqdm import tqdm
-    import datetime
-    from PIL import Image
     from util.configDef import Config
+    from util.bulkImport import BulkImporter
     from modules import Database
 
-    currentDT = datetime.datetime.now()
-    currentDT = '{}-{}-{} {}:{}:{}'.format(currentDT.year, currentDT.month, currentDT.day, currentDT.hour, currentDT.minute, currentDT.second)
-
     config = Config()
     dbConn = Database(config)
     if dbConn.connectionPool is None:
         raise Exception('Error connecting to database.')
-    dbSchema = config.getProperty('Database', 'schema')
+    project = args.project
+    if project is None:
+        project = config.getProperty('Database', 'schema')
 
 
     # check if running on file server
@@ -75,22 +74,8 @@ if __name__ == '__main__':
         baseName = i.replace(imgBaseDir, '')
         imgs.add(baseName)
 
-    # ignore images that are already in database
-    print('Filter images already in database...')
-    imgs_existing = dbConn.execute('''
-        SELECT filename FROM {}.image;
-    '''.format(dbSchema), None, 'all')
-    imgs_existing = set([i['filename'] for i in imgs_existing])
-
-    imgs = list(imgs.difference(imgs_existing))
-    imgs = [(i,) for i in imgs]
-
-    # push image to database
+    # push images that are not yet in the database
     print('Adding to database...')
-    dbConn.insert('''
-        INSERT INTO {}.image (filename)
-        VALUES %s;
-    '''.format(dbSchema),
-    imgs)
+    numExisting = len(BulkImporter(dbConn, project).register_images(imgs))
 
-    print('Done.')
\ No newline at end of file
+    print(f'Done ({numExisting} images registered in total).')
@@ -21,6 +21,12 @@ if __name__ == '__main__':
                     help='Directory (absolute path) on this machine that contains the YOLO label text files.')
     parser.add_argument('--annotation_type', type=str, default='annotation', const=1, nargs='?',
                     help='Kind of the provided annotations. One of {"annotation", "prediction"} (default: annotation)')
+    parser.add_argument('--checkpoint', type=str, default=None, const=1, nargs='?',
+                    help='Optional path of a file to record imported segmentation masks in. If the import is interrupted, running it again with the same checkpoint file resumes it.')
+    parser.add_argument('--batch_size', type=int, default=1000, const=1, nargs='?',
+                    help='Number of segmentation masks to parse and insert into the database at once (default: 1000).')
+    parser.add_argument('--num_workers', type=int, default=None, const=1, nargs='?',
+                    help='Number of threads to parse segmentation masks with (default: number of CPU cores, up to 8).')
     args = parser.parse_args()
 
     
@@ -35,8 +41,8 @@ if __name__ == '__main__':
     import numpy as np
     from PIL import Image
     import base64
-    from io import BytesIO
     from util.configDef import Config
+    from util.bulkImport import BulkImporter
     from modules import Database
 
     if args.label_folder == '':
@@ -65,6 +71,8 @@ if __name__ == '__main__':
     if not imgBaseDir.endswith(os.sep):
         imgBaseDir += os.sep
 
+    importer = BulkImporter(dbConn, args.project, args.checkpoint, args.batch_size, args.num_workers)
+
 
     # parse class names and indices
     if args.label_folder is not None:
@@ -83,10 +91,8 @@ if __name__ == '__main__':
             ''').format(id_lc=sql.Identifier(args.project, 'labelclass')),
             (className,idx,))
 
-        # prepare insertion SQL string
+        # get username
         if args.annotation_type == 'annotation':
-
-            # get username
             usernames = dbConn.execute('''
                 SELECT username FROM aide_admin.authentication
                 WHERE project = %s
@@ -97,44 +103,15 @@ if __name__ == '__main__':
                 'all'
             )
             usernames = [u['username'] for u in usernames]
+            username = usernames[0]
             if args.username is not None:
-                username = usernames[0]
-                if args.username not in usernames:
+                if args.username in usernames:
+                    username = args.username
+                else:
                     print(f'WARNING: username "{args.username}" not found, using "{username}" instead.')
             
-            else:
-                username = usernames[0]
-            
             print(f'Inserting annotations under username "{username}".')
 
-            queryStr = sql.SQL('''
-            INSERT INTO {id_anno} (username, image, timeCreated, timeRequired, segmentationmask, width, height)
-            VALUES(
-                %s,
-                (SELECT id FROM {id_img} WHERE filename LIKE %s),
-                (TIMESTAMP %s),
-                -1,
-                %s,
-                %s,
-                %s
-            );''').format(
-                id_anno=sql.Identifier(args.project, 'annotation'),
-                id_img=sql.Identifier(args.project, 'image')
-            )
-        elif args.annotation_type == 'prediction':
-            queryStr = sql.SQL('''
-            INSERT INTO {id_pred} (image, timeCreated, segmentationmask, width, height)
-            VALUES(
-                (SELECT id FROM {id_img} WHERE filename = %s),
-                (TIMESTAMP %s),
-                %s,
-                %s,
-                %s
-            );''').format(
-                id_pred=sql.Identifier(args.project, 'prediction'),
-                id_img=sql.Identifier(args.project, 'image')
-            )
-
     # locate all images and their base names
     print('\nAdding image paths...')
     imgs = {}
@@ -152,54 +129,49 @@ if __name__ == '__main__':
         imgs[baseName] = i.replace(imgBaseDir, '')
 
 
-    # ignore images that are already in database
-    print('Filter images already in database...')
-    imgs_filenames = set(imgs.values())
-    imgs_existing = dbConn.execute(sql.SQL('''
-        SELECT filename FROM {id_img};
-    ''').format(id_img=sql.Identifier(args.project, 'image')), None, 'all')
-    imgs_existing = set([i['filename'] for i in imgs_existing])
-
-    imgs_filenames = list(imgs_filenames.difference(imgs_existing))
-    imgs_filenames = [(i,) for i in imgs_filenames]
-
-    # push image to database
+    # push images that are not yet in the database
     print('Adding to database...')
-    dbConn.insert(sql.SQL('''
-        INSERT INTO {id_img} (filename)
-        VALUES %s;
-    ''').format(id_img=sql.Identifier(args.project, 'image')),
-    imgs_filenames)
+    imageIDs = importer.register_images(imgs.values())
 
 
     # locate all segmentation masks
     if args.label_folder is not None:
         print('\nAdding segmentation masks...')
-        labelFiles = glob.glob(os.path.join(args.label_folder, '**'), recursive=True)
-        for l in tqdm(labelFiles):
-
+        labelFiles = []
+        for l in glob.glob(os.path.join(args.label_folder, '**'), recursive=True):
             if os.path.isdir(l) or 'classes.txt' in l:
                 continue
-
             basePath, _ = os.path.splitext(l)
             baseName = basePath.replace(args.label_folder, '')
 
-            # check if matching image exists
-            if not baseName in imgs:
-                continue
+            # only consider masks with matching image
+            if baseName in imgs:
+                labelFiles.append(l)
+
+        def _parse_mask(l):
+            basePath, _ = os.path.splitext(l)
+            imageID = imageIDs[imgs[basePath.replace(args.label_folder, '')]]
 
             # load mask
-            segMask = Image.open(l)
-            sz = segMask.size
+            with Image.open(l) as segMask:
+                sz = segMask.size
 
-            # convert
-            dataArray = np.array(segMask).astype(np.uint8)
+                # convert
+                dataArray = np.array(segMask).astype(np.uint8)
             b64str = base64.b64encode(dataArray.ravel()).decode('utf-8')
 
-            # add to database
             if args.annotation_type == 'annotation':
-                queryArgs = (username, imgs[baseName], currentDT, b64str, sz[0], sz[1])
+                return [(username, imageID, currentDT, -1, b64str, sz[0], sz[1])]
             else:
-                queryArgs = (imgs[baseName], currentDT, b64str, sz[0], sz[1])
-            dbConn.execute(queryStr,
-                queryArgs)
\ No newline at end of file
+                return [(imageID, currentDT, b64str, sz[0], sz[1])]
+
+        if args.annotation_type == 'annotation':
+            table = 'annotation'
+            columns = ['username', 'image', 'timeCreated', 'timeRequired', 'segmentationmask', 'width', 'height']
+        else:
+            table = 'prediction'
+            columns = ['image', 'timeCreated', 'segmentationmask', 'width', 'height']
+
+        with tqdm(total=len(labelFiles)) as pBar:
+            importer.import_rows(table, columns, labelFiles, _parse_mask, pBar,
+                [c for c in columns if c != 'timeCreated'])
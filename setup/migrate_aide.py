@@ -1,8 +1,21 @@
 '''
     Run this file whenever you update AIDE to bring your existing project setup up-to-date
     with respect to changes due to newer versions.
+
+    Modifications are applied once per scope (the "aide_admin" schema and each project
+    schema) and recorded in a ledger table ("aide_admin.migration") with the number of
+    entries of "MODIFICATIONS_sql" that have been processed for the scope. Subsequent
+    runs only apply entries that have been added since. Entries containing a "{schema}"
+    placeholder are applied to each project schema (concurrently across projects);
+    all others are applied once to the "aide_admin" schema, before the project schemata.
+    Hence, new modifications must always be appended to the end of the list; existing
+    entries must never be reordered or removed.
+
+    If multiple AIDE instances start at the same time, only one of them (the one that
+    obtains the migration lock in the database) applies the modifications; the others
+    wait for it and then find no pending modifications.
     
-    2019-20 Benjamin Kellenberger
+    2019-21 Benjamin Kellenberger
 '''
 
 import os
@@ -10,6 +23,7 @@ import argparse
 import json
 import secrets
 from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
 from constants.version import AIDE_VERSION
 
 
@@ -259,7 +273,110 @@ MODIFICATIONS_sql = [
 
 
 
-def migrate_aide():
+ADMIN_SCOPE = 'aide_admin'
+
+MIGRATION_LOCK_ID = 4704627904      # arbitrary key for the PostgreSQL advisory lock
+
+LEDGER_sql = '''
+    CREATE SCHEMA IF NOT EXISTS aide_admin;
+    CREATE TABLE IF NOT EXISTS aide_admin.migration (
+        scope VARCHAR NOT NULL,
+        version INTEGER NOT NULL,
+        aide_version VARCHAR,
+        timeApplied TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (scope)
+    );
+'''
+
+
+
+def _get_pending_scopes(dbConn):
+    '''
+        Returns a dict of scopes (project shortnames and "aide_admin") and their
+        current ledger version for all scopes that are not up-to-date, as well as
+        a list of warnings (e.g. for projects without a schema).
+    '''
+    warnings = []
+    projects = dbConn.execute('''
+        SELECT shortname, lower(shortname) IN (
+            SELECT lower(schema_name) FROM information_schema.schemata
+        ) AS schema_exists
+        FROM aide_admin.project;
+    ''', None, 'all')
+    if projects is None or not len(projects):
+        warnings.append('WARNING: no project registered within AIDE.')
+        projects = []
+
+    scopes = [ADMIN_SCOPE]
+    for p in projects:
+        pName = p['shortname']
+        if not p['schema_exists']:
+            warnings.append(f'WARNING: project "{pName}" is registered but does not exist in database.')
+            #TODO: option to auto-remove?
+            continue
+        scopes.append(pName)
+
+    versions = dbConn.execute('''
+        SELECT scope, version FROM aide_admin.migration
+        WHERE scope IN %s;
+    ''', (tuple(scopes),), 'all')
+    versions = dict([v['scope'], v['version']] for v in (versions if versions is not None else []))
+    pending = {}
+    for scope in scopes:
+        version = versions.get(scope, 0)
+        if version < len(MODIFICATIONS_sql):
+            pending[scope] = version
+    return pending, warnings
+
+
+
+def _migrate_scope(dbConn, scope, version):
+    '''
+        Applies all modifications of a scope from the given ledger version on, each
+        in its own transaction together with the ledger update. Failing modifica-
+        tions are reported, but do not stop the remaining ones (as modifications are
+        idempotent); the ledger is only advanced up to the first failure, so that
+        failed modifications are retried upon the next run. Returns a list of mes-
+        sages of failed modifications.
+    '''
+    isAdmin = (scope == ADMIN_SCOPE)
+    messages = []
+    conn = dbConn.connectionPool.getconn()
+    try:
+        conn.autocommit = False
+        cursor = conn.cursor()
+        for idx in range(version, len(MODIFICATIONS_sql)):
+            mod = MODIFICATIONS_sql[idx]
+            applies = (('{schema}' in mod) != isAdmin)
+            try:
+                if applies:
+                    cursor.execute(mod.format(schema=scope))
+                if not len(messages) and (applies or idx == len(MODIFICATIONS_sql)-1):
+                    # record progress (skipped modifications of the other kind are recorded with the next one)
+                    cursor.execute('''
+                        INSERT INTO aide_admin.migration (scope, version, aide_version)
+                        VALUES (%s, %s, %s)
+                        ON CONFLICT (scope) DO UPDATE
+                        SET version = EXCLUDED.version, aide_version = EXCLUDED.aide_version, timeApplied = NOW();
+                    ''', (scope, idx+1, AIDE_VERSION))
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                messages.append(f'WARNING: modification {idx} could not be applied to "{scope}" (message: "{str(e).strip()}").')
+        return messages
+    finally:
+        conn.autocommit = True
+        dbConn.connectionPool.putconn(conn, close=False)
+
+
+
+def migrate_aide(numWorkers=None):
+    '''
+        Applies all pending modifications to the "aide_admin" schema and all project
+        schemata. Project schemata are migrated concurrently with up to "numWorkers"
+        threads (default: bounded by the database connection pool size). Returns
+        lists of warnings and errors.
+    '''
     from modules import Database, UserHandling
     from util.configDef import Config
     
@@ -268,36 +385,42 @@ def migrate_aide():
     if dbConn.connectionPool is None:
         raise Exception('Error connecting to database.')
     
-    warnings = []
-    errors = []
-
-    # bring all projects up-to-date (if registered within AIDE)
-    projects = dbConn.execute('SELECT shortname FROM aide_admin.project;', None, 'all')
-    if projects is not None and len(projects):
-
-        # get all schemata and check if project still exists
-        schemata = dbConn.execute('SELECT schema_name FROM information_schema.schemata', None, 'all')
-        if schemata is not None and len(schemata):
-            schemata = set([s['schema_name'].lower() for s in schemata])
-            for p in projects:
-                try:
-                    pName = p['shortname']
-
-                    # check if project still exists
-                    if not pName.lower() in schemata:
-                        warnings.append(f'WARNING: project "{pName}" is registered but does not exist in database.')
-                        #TODO: option to auto-remove?
-                        continue
-
-                    # make modifications one at a time
-                    for mod in MODIFICATIONS_sql:
-                        dbConn.execute(mod.format(schema=pName), None, None)
-                except Exception as e:
-                    errors.append(str(e))
-        else:
-            warnings.append('WARNING: no project schemata found within database.')
-    else:
-        warnings.append('WARNING: no project registered within AIDE.')
+    # fast path: nothing to do if the ledger is up-to-date (e.g. migrated by another instance)
+    hasLedger = dbConn.execute('SELECT to_regclass(%s) IS NOT NULL AS has_ledger;',
+                    ('aide_admin.migration',), 1)
+    if hasLedger is not None and len(hasLedger) and hasLedger[0]['has_ledger']:
+        pending, warnings = _get_pending_scopes(dbConn)
+        if not len(pending):
+            return warnings, []
+
+    # acquire migration lock; waits if another instance is migrating
+    lockConn = dbConn.connectionPool.getconn()
+    lockConn.autocommit = True
+    lockCursor = lockConn.cursor()
+    lockCursor.execute('SELECT pg_advisory_lock(%s);', (MIGRATION_LOCK_ID,))
+    warnings, errors = [], []
+    try:
+        lockCursor.execute(LEDGER_sql)
+        pending, warnings = _get_pending_scopes(dbConn)
+
+        # admin schema first; project modifications may depend on it
+        if ADMIN_SCOPE in pending:
+            warnings.extend(_migrate_scope(dbConn, ADMIN_SCOPE, pending.pop(ADMIN_SCOPE)))
+
+        # bring all projects up-to-date (if registered within AIDE)
+        if len(pending):
+            if numWorkers is None:
+                maxConnections = config.getProperty('Database', 'max_num_connections', type=int, fallback=20)
+                numWorkers = min(8, max(1, maxConnections - 2))     # leave connections for lock and ledger
+            with ThreadPoolExecutor(max_workers=max(1, min(numWorkers, len(pending)))) as executor:
+                results = executor.map(lambda scope: _migrate_scope(dbConn, scope, pending[scope]), pending.keys())
+                for result in results:
+                    warnings.extend(result)
+    except Exception as e:
+        errors.append(str(e))
+    finally:
+        lockCursor.execute('SELECT pg_advisory_unlock(%s);', (MIGRATION_LOCK_ID,))
+        dbConn.connectionPool.putconn(lockConn, close=False)
 
     return warnings, errors
     
@@ -309,6 +432,8 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Update AIDE database structure.')
     parser.add_argument('--settings_filepath', type=str, default='config/settings.ini', const=1, nargs='?',
                     help='Manual specification of the directory of the settings.ini file; only considered if environment variable unset (default: "config/settings.ini").')
+    parser.add_argument('--num_workers', type=int,
+                    help='Maximum number of project schemata to update concurrently (default: bounded by the database connection pool size).')
     args = parser.parse_args()
 
     if not 'AIDE_CONFIG_PATH' in os.environ:
@@ -317,7 +442,7 @@ if __name__ == '__main__':
         os.environ['AIDE_MODULES'] = ''     # for compatibility with Celery worker import
 
     
-    warnings, errors = migrate_aide()
+    warnings, errors = migrate_aide(args.num_workers)
 
     if not len(warnings) and not len(errors):
         print(f'AIDE is now up-to-date with the latest version ({AIDE_VERSION})')
@@ -0,0 +1,189 @@
+'''
+    Bulk import of images, annotations and predictions into a project,
+    shared by the import scripts under "projectCreation".
+    Rows are collected in columnar buffers and transferred to the data-
+    base in large batches through Postgres' COPY command, which is much
+    faster than issuing one INSERT statement per row. Label files are
+    parsed in parallel on a thread pool.
+    Optionally, the label files that have been imported are recorded in a
+    checkpoint file after each batch, so that an interrupted import can be
+    resumed by running it again with the same checkpoint file. The batch
+    in progress is noted in a separate file; if the import is interrupted
+    before that batch is recorded, rows of it that have already reached
+    the database are skipped upon resuming.
+
+    2021 Benjamin Kellenberger
+'''
+
+import os
+import io
+import csv
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2 import sql
+
+
+class BulkImporter:
+
+    def __init__(self, dbConn, project, checkpointPath=None, batchSize=10000, numWorkers=None):
+        self.dbConn = dbConn
+        self.project = project
+        self.checkpointPath = checkpointPath
+        self.batchSize = max(1, batchSize)
+        if numWorkers is None:
+            numWorkers = min(8, os.cpu_count() or 1)
+        self.numWorkers = max(1, numWorkers)
+
+        # keys (e.g. label file paths) of items that have already been imported, resp.
+        # that were being imported when the last run got interrupted
+        self.pendingPath = (self.checkpointPath + '.pending' if self.checkpointPath is not None else None)
+        self.done = self._load_keys(self.checkpointPath)
+        self.pending = self._load_keys(self.pendingPath).difference(self.done)
+
+
+    @staticmethod
+    def _load_keys(filePath):
+        if filePath is None or not os.path.isfile(filePath):
+            return set()
+        with open(filePath, 'r') as f:
+            return set(line.rstrip('\n') for line in f if len(line.strip()))
+
+
+    @staticmethod
+    def _write_keys(filePath, keys, mode):
+        with open(filePath, mode) as f:
+            for key in keys:
+                f.write(key + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+    def _save_pending(self, keys):
+        if self.checkpointPath is None:
+            return
+        self._write_keys(self.pendingPath, keys, 'w')
+
+
+    def _save_checkpoint(self, keys):
+        if self.checkpointPath is None:
+            return
+        self._write_keys(self.checkpointPath, keys, 'a')
+        if os.path.isfile(self.pendingPath):
+            os.remove(self.pendingPath)
+
+
+    def copy_rows(self, table, columns, buffers, keyColumns=None):
+        '''
+            Inserts rows into a table of the project via COPY. "buffers" is a
+            list of columns (lists of equal length), in the order of "columns".
+            None values are inserted as NULL.
+            If "keyColumns" is provided, rows whose values in these columns
+            equal those of a row already present in the table are skipped.
+            This requires a full scan of the table and is therefore only
+            used for batches that might have been inserted before.
+        '''
+        if not len(buffers) or not len(buffers[0]):
+            return
+        data = io.StringIO()
+        csv.writer(data).writerows(zip(*buffers))
+        data.seek(0)
+        id_table = sql.Identifier(self.project, table)
+        cols = sql.SQL(', ').join([sql.Identifier(c.lower()) for c in columns])
+        if keyColumns is None:
+            self.dbConn.copy_from(sql.SQL('''
+                COPY {id_table} ({cols}) FROM STDIN WITH (FORMAT csv);
+            ''').format(id_table=id_table, cols=cols), data)
+            return
+
+        # copy into temporary table first and only insert new rows from there
+        def _row_key(alias):
+            return sql.SQL('ROW({})::text').format(
+                sql.SQL(', ').join([sql.Identifier(alias, c.lower()) for c in keyColumns]))
+
+        id_tmp = sql.Identifier('bulk_import_rows')
+        self.dbConn.copy_from(sql.SQL('''
+                COPY {id_tmp} ({cols}) FROM STDIN WITH (FORMAT csv);
+            ''').format(id_tmp=id_tmp, cols=cols), data,
+            queryBefore=sql.SQL('''
+                CREATE TEMPORARY TABLE {id_tmp} ON COMMIT DROP AS
+                SELECT {cols} FROM {id_table} LIMIT 0;
+            ''').format(id_tmp=id_tmp, cols=cols, id_table=id_table),
+            queryAfter=sql.SQL('''
+                INSERT INTO {id_table} ({cols})
+                SELECT {cols} FROM {id_tmp} AS n
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM {id_table} AS o
+                    WHERE {key_o} = {key_n}
+                );
+            ''').format(id_table=id_table, cols=cols, id_tmp=id_tmp,
+                key_o=_row_key('o'), key_n=_row_key('n')))
+
+
+    def register_images(self, filenames):
+        '''
+            Adds all file names that are not yet registered to the project's
+            image table. Returns a dict of all file names in the table and
+            their image IDs.
+        '''
+        def _get_images():
+            result = self.dbConn.execute(sql.SQL('''
+                SELECT id, filename FROM {id_img};
+            ''').format(id_img=sql.Identifier(self.project, 'image')), None, 'all')
+            return dict([r['filename'], r['id']] for r in result)
+
+        images = _get_images()
+        imgs_new = list(set(filenames).difference(set(images.keys())))
+        for idx in range(0, len(imgs_new), self.batchSize):
+            self.copy_rows('image', ['filename'], [imgs_new[idx:idx+self.batchSize]])
+        if len(imgs_new):
+            images = _get_images()
+        return images
+
+
+    def import_rows(self, table, columns, items, parseFun, progressBar=None, keyColumns=None):
+        '''
+            Parses items (e.g. label files) in parallel and inserts the resul-
+            ting rows into a table of the project in batches.
+            Inputs:
+                - table:        name of the table (e.g. "annotation")
+                - columns:      list of column names to be filled
+                - items:        iterable of keys (str) of the items to import.
+                                Items already recorded in the checkpoint file
+                                are skipped.
+                - parseFun:     function that receives a key and returns a
+                                list of row tuples (in the order of "columns")
+                - progressBar:  optional tqdm instance to be updated
+                - keyColumns:   columns that identify a row (default: all
+                                columns). Used to skip rows of an interrupted
+                                batch that have already been inserted; values
+                                that differ between runs (e.g. timestamps)
+                                must hence not be part of them.
+
+            Returns the number of rows parsed.
+        '''
+        if keyColumns is None:
+            keyColumns = columns
+
+        # items of an interrupted batch come first, so that only their batch needs to be de-duplicated
+        items = [i for i in items if i not in self.done]
+        items = [i for i in items if i in self.pending] + [i for i in items if i not in self.pending]
+        numRows = 0
+        with ThreadPoolExecutor(max_workers=self.numWorkers) as executor:
+            for idx in range(0, len(items), self.batchSize):
+                batch = items[idx:idx+self.batchSize]
+                buffers = [[] for _ in columns]
+                for rows in executor.map(parseFun, batch):
+                    for row in rows:
+                        for c, value in enumerate(row):
+                            buffers[c].append(value)
+                resumed = any(i in self.pending for i in batch)
+                self._save_pending(batch)
+                self.copy_rows(table, columns, buffers, (keyColumns if resumed else None))
+                numRows += len(buffers[0])
+
+                # record progress
+                self.done.update(batch)
+                self.pending.difference_update(batch)
+                self._save_checkpoint(batch)
+                if progressBar is not None:
+                    progressBar.update(len(batch))
+        return numRows
@@ -0,0 +1,165 @@
+'''
+    Incremental scanning of image folders.
+    Keeps an on-disk manifest of the directories of a
+    folder tree (inode, modification time and contents)
+    and only re-lists directories whose modification time
+    has changed since the last scan. Adding, removing or
+    renaming a file changes the modification time of its
+    parent directory, so unchanged subtrees only cost one
+    stat call per directory.
+    The manifest further stores the set of file names
+    registered in the database, together with a finger-
+    print of the database table, so that it only needs to
+    be re-read if the table has changed.
+
+    2021 Benjamin Kellenberger
+'''
+
+import os
+import json
+import time
+from util.helpers import valid_image_extensions
+
+
+class FolderManifest:
+
+    VERSION = 1
+
+    # directories modified less than this many nanoseconds before a scan are
+    # always re-listed next time (file system timestamps may be coarse)
+    MTIME_GRACE_NS = 2 * 10**9
+
+    def __init__(self, baseDir, manifestPath=None):
+        self.baseDir = baseDir.rstrip(os.sep)
+        self.manifestPath = manifestPath
+        self.directories = {}
+        self.diskFiles = None
+        self.dbFiles = None
+        self.dbFingerprint = None
+        self.numRescanned = 0
+        self._load()
+
+
+    def _load(self):
+        if self.manifestPath is None or not os.path.isfile(self.manifestPath):
+            return
+        try:
+            with open(self.manifestPath, 'r') as f:
+                meta = json.load(f)
+            if meta.get('version') != self.VERSION or meta.get('baseDir') != self.baseDir:
+                return
+            self.directories = meta['directories']
+            if meta.get('dbFiles') is not None:
+                self.dbFiles = set(meta['dbFiles'])
+                self.dbFingerprint = meta['dbFingerprint']
+        except Exception:
+            # corrupt manifest; start from scratch
+            self.directories = {}
+            self.dbFiles = None
+            self.dbFingerprint = None
+
+
+    def save(self):
+        '''
+            Writes the manifest to disk (atomically, so that concurrent
+            scans never encounter a partially written file).
+        '''
+        if self.manifestPath is None:
+            return
+        parent, _ = os.path.split(self.manifestPath)
+        if len(parent):
+            os.makedirs(parent, exist_ok=True)
+        tempPath = f'{self.manifestPath}.{os.getpid()}.tmp'
+        with open(tempPath, 'w') as f:
+            json.dump({
+                'version': self.VERSION,
+                'baseDir': self.baseDir,
+                'directories': self.directories,
+                'dbFiles': (list(self.dbFiles) if self.dbFiles is not None else None),
+                'dbFingerprint': self.dbFingerprint
+            }, f)
+        os.replace(tempPath, self.manifestPath)
+
+
+    def _list_directory(self, absDir):
+        '''
+            Lists the image files and sub-directories of a single directory.
+            Symlinks that point back into the base directory are skipped to
+            avoid cycles (analogous to "util.helpers.listDirectory").
+        '''
+        files, dirs = [], []
+        with os.scandir(absDir) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file():
+                        if os.path.splitext(entry.name)[1].lower() in valid_image_extensions:
+                            files.append(entry.name)
+                    elif entry.is_symlink():
+                        if os.readlink(entry.path) in self.baseDir + os.sep:
+                            # circular link; avoid
+                            continue
+                        elif entry.is_dir():
+                            dirs.append(entry.name)
+                    elif entry.is_dir():
+                        dirs.append(entry.name)
+                except OSError:
+                    # broken link or file removed in the meantime
+                    continue
+        return files, dirs
+
+
+    def scan(self):
+        '''
+            Scans the folder tree for image files, re-listing only those di-
+            rectories that have changed since the last scan.
+            Returns a set of file paths relative to the base directory (same
+            format as "util.helpers.listDirectory").
+        '''
+        scanTime = int(time.time() * 1e9)     # time.time_ns() requires Python 3.7
+        directories = {}
+        diskFiles = set()
+        self.numRescanned = 0
+
+        stack = ['']
+        while len(stack):
+            relDir = stack.pop()
+            absDir = os.path.join(self.baseDir, relDir)
+            try:
+                stat = os.stat(absDir)
+            except OSError:
+                continue
+            cached = self.directories.get(relDir)
+            if cached is not None and cached['inode'] == stat.st_ino and \
+                cached['mtime'] == stat.st_mtime_ns and \
+                cached['mtime'] < cached['scanned'] - self.MTIME_GRACE_NS:
+                # directory unchanged
+                entry = cached
+            else:
+                try:
+                    files, dirs = self._list_directory(absDir)
+                except OSError:
+                    continue
+                entry = {
+                    'inode': stat.st_ino,
+                    'mtime': stat.st_mtime_ns,
+                    'scanned': scanTime,
+                    'files': files,
+                    'dirs': dirs
+                }
+                self.numRescanned += 1
+            directories[relDir] = entry
+
+            for f in entry['files']:
+                diskFiles.add(os.path.join(relDir, f))
+            for d in entry['dirs']:
+                stack.append(os.path.join(relDir, d))
+
+        self.directories = directories
+        self.diskFiles = diskFiles
+        return diskFiles
+
+
+    def set_database_files(self, files, fingerprint):
+        self.dbFiles = set(files)
+        self.dbFingerprint = fingerprint
+
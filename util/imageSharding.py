@@ -2,42 +2,54 @@
     Contains functionality to split a (PIL) image into
     shards (patches) on a regular grid.
 
-    2020 Benjamin Kellenberger
+    Very large images (e.g. orthomosaics) can alternatively
+    be split in a windowed manner: patches are then read from
+    disk one region at a time and yielded lazily, so that the
+    full image never has to be decoded at once. Windowed reads
+    of tiled TIFFs, BigTIFFs and JPEG2000 files require the
+    optional "rasterio" package; without it, images are decoded
+    in full as before.
+
+    2020-21 Benjamin Kellenberger
 '''
 
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 import numpy as np
 
+try:
+    import rasterio
+    from rasterio.windows import Window
+except ImportError:
+    rasterio = None
 
-def split_image(image, patchSize, stride=None, tight=True):
+
+# GDAL drivers that support efficient (tile-/block-wise) region reads
+WINDOWED_DRIVERS = (
+    'GTiff',
+    'COG',
+    'JP2OpenJPEG',
+    'JP2KAK',
+    'JP2ECW',
+    'JPEG2000'
+)
+
+
+def get_split_positions(imageSize, patchSize, stride=None, tight=True):
     '''
-        Receives a PIL image and splits it into patches on a regular grid.
-        The splitting raster can be customized through the parameters.
-        Inputs:
-            - image:        The PIL image to be split into patches.
-            - patchSize:    Either an int or a tuple of (width, height) of
-                            the patch dimensions.
-            - stride:       The offsets of each patch with respect to its
-                            immediate neighbor. Can be one of the following:
-                            - None: strides are set to the values in "patchSize"
-                            - int:  equal stride in both x and y direction
-                            - tuple of (x, y) ints for both direction
-            - tight:        If True, the last patches in x and y direction might
-                            be shifted towards the left (resp. top) if needed, so
-                            that none of the patches exceeds the image boundaries.
-                            If False, patches might exceed the image boundaries and
-                            contain black borders (filled with all-zeros).
-        
+        Calculates the raster of patch positions for an image of given
+        size (width, height). See "split_image" for the meaning of the
+        parameters.
+
         Returns:
-            - patches:      A list of N PIL images containing all the patches cropped
-                            from the input "image".
-            - coords:       A list of N tuples containing the (x, y) pixel coordinates
-                            of the top left corner of the patches.
+            - patchSize:    A tuple of (width, height) of the (sanitized)
+                            patch dimensions.
+            - xLoc:         A list of left pixel coordinates of the patches.
+            - yLoc:         A list of top pixel coordinates of the patches.
     '''
-
-    # assertions
-    assert isinstance(image, Image.Image), 'Input is not a PIL Image.'
-    sz = image.size
+    sz = imageSize
     if isinstance(patchSize, int):
         patchSize = min(patchSize, max(sz[0], sz[1]))
         patchSize = (patchSize, patchSize)
@@ -58,7 +70,7 @@ def split_image(image, patchSize, stride=None, tight=True):
         assert isinstance(stride[0], int), f'"{str(stride[0])}" is not an integer value.'
         assert isinstance(stride[1], int), f'"{str(stride[1])}" is not an integer value.'
         stride = (max(1,min(stride[0], sz[0])), max(1,min(stride[1], sz[1])))
-    
+
     # define crop locations
     xLoc = list(range(0, sz[0], stride[0]))
     yLoc = list(range(0, sz[1], stride[1]))
@@ -74,11 +86,45 @@ def split_image(image, patchSize, stride=None, tight=True):
             xLoc.append(xLoc[-1] + stride[0])
         while yLoc[-1] + patchSize[1] < sz[1]:
             yLoc.append(yLoc[-1] + stride[1])
-    
+
+    return patchSize, xLoc, yLoc
+
+
+
+def split_image(image, patchSize, stride=None, tight=True):
+    '''
+        Receives a PIL image and splits it into patches on a regular grid.
+        The splitting raster can be customized through the parameters.
+        Inputs:
+            - image:        The PIL image to be split into patches.
+            - patchSize:    Either an int or a tuple of (width, height) of
+                            the patch dimensions.
+            - stride:       The offsets of each patch with respect to its
+                            immediate neighbor. Can be one of the following:
+                            - None: strides are set to the values in "patchSize"
+                            - int:  equal stride in both x and y direction
+                            - tuple of (x, y) ints for both direction
+            - tight:        If True, the last patches in x and y direction might
+                            be shifted towards the left (resp. top) if needed, so
+                            that none of the patches exceeds the image boundaries.
+                            If False, patches might exceed the image boundaries and
+                            contain black borders (filled with all-zeros).
+
+        Returns:
+            - patches:      A list of N PIL images containing all the patches cropped
+                            from the input "image".
+            - coords:       A list of N tuples containing the (x, y) pixel coordinates
+                            of the top left corner of the patches.
+    '''
+
+    # assertions
+    assert isinstance(image, Image.Image), 'Input is not a PIL Image.'
+    patchSize, xLoc, yLoc = get_split_positions(image.size, patchSize, stride, tight)
+
     if len(xLoc) <= 1 and len(yLoc) <= 1:
         # patch size is greater than image size; return image
         return [image], [(0,0)]
-    
+
     # do the cropping
     patches = []
     coords = []
@@ -88,5 +134,207 @@ def split_image(image, patchSize, stride=None, tight=True):
             patch = image.crop((pos[0], pos[1], pos[0]+patchSize[0], pos[1]+patchSize[1]))
             patches.append(patch)
             coords.append(pos)
-    
-    return patches, coords
\ No newline at end of file
+
+    return patches, coords
+
+
+
+class _RasterioReader:
+    '''
+        Reads image regions through rasterio (GDAL), decoding only the
+        internal tiles (or strips) that intersect with the region.
+    '''
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.size = (dataset.width, dataset.height)
+        self.bands = ([1,2,3] if dataset.count >= 3 else [1])     # RGB or grayscale
+
+    def read(self, box):
+        # regions exceeding the image boundaries are zero-padded (like PIL's crop)
+        arr = np.zeros((len(self.bands), box[3]-box[1], box[2]-box[0]), dtype=np.uint8)
+        x0, y0 = max(box[0], 0), max(box[1], 0)
+        x1, y1 = min(box[2], self.size[0]), min(box[3], self.size[1])
+        if x1 > x0 and y1 > y0:
+            arr[:, y0-box[1]:y1-box[1], x0-box[0]:x1-box[0]] = self.dataset.read(self.bands,
+                        window=Window(x0, y0, x1-x0, y1-y0))
+        if arr.shape[0] == 1:
+            return Image.fromarray(arr[0,...])
+        return Image.fromarray(np.ascontiguousarray(np.moveaxis(arr, 0, -1)))
+
+    def close(self):
+        self.dataset.close()
+
+
+
+class _PILReader:
+    '''
+        Fallback reader for formats or environments that do not support
+        windowed reads: decodes the image once and crops patches from it.
+    '''
+    def __init__(self, image):
+        self.image = image
+        self.size = image.size
+
+    def read(self, box):
+        return self.image.crop(box)
+
+    def close(self):
+        self.image.close()
+
+
+
+def _open_windowed(source):
+    '''
+        Opens an image source through rasterio if its format supports
+        windowed reads. Returns the rasterio dataset, or None otherwise.
+    '''
+    if rasterio is None:
+        return None
+    try:
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        dataset = rasterio.open(source)
+        if dataset.driver in WINDOWED_DRIVERS and \
+            all(d == 'uint8' for d in dataset.dtypes):
+            return dataset
+        dataset.close()
+    except Exception:
+        # not readable by GDAL
+        pass
+    return None
+
+
+
+def _open_reader(source):
+    '''
+        Returns the most memory-efficient reader available for a given
+        image source (file path or seekable file-like object).
+    '''
+    dataset = _open_windowed(source)
+    if dataset is not None:
+        return _RasterioReader(dataset)
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    return _PILReader(Image.open(source))
+
+
+
+def windowed_reads_supported(source=None):
+    '''
+        Returns True if the optional dependencies for windowed (region-
+        wise) image reads are installed. If an image source (file path or
+        seekable file-like object) is provided, it is additionally checked
+        whether its format supports windowed reads (e.g. tiled GeoTIFF);
+        other formats have to be decoded in full.
+    '''
+    if source is None:
+        return rasterio is not None
+    dataset = _open_windowed(source)
+    if dataset is None:
+        return False
+    dataset.close()
+    return True
+
+
+
+def get_image_size(source):
+    '''
+        Returns the (width, height) of an image (file path or seekable
+        file-like object) without decoding its pixels. Note that file-like
+        objects may be closed afterwards.
+    '''
+    reader = _open_reader(source)
+    try:
+        return reader.size
+    finally:
+        reader.close()
+
+
+
+def split_image_windowed(source, patchSize, stride=None, tight=True):
+    '''
+        Generator version of "split_image" for very large images. Instead
+        of a decoded PIL image, it receives a file path or a (seekable)
+        file-like object and yields patches one by one as tuples of
+        (patch, (x, y)), with the PIL image of the patch and the pixel
+        coordinates of its top left corner.
+        Patches are yielded row by row (unlike "split_image", which pro-
+        ceeds column-wise) to minimize the number of times internal image
+        blocks (tiles or strips) have to be decoded.
+        For tiled TIFFs, BigTIFFs and JPEG2000 images, only the region of
+        the current patch is read from disk if the optional "rasterio"
+        package is installed, which bounds memory usage by the patch size
+        regardless of the image size. All other images are decoded once.
+
+        See "split_image" for the other parameters.
+    '''
+    reader = _open_reader(source)
+    try:
+        patchSize, xLoc, yLoc = get_split_positions(reader.size, patchSize, stride, tight)
+
+        if len(xLoc) <= 1 and len(yLoc) <= 1:
+            # patch size is greater than image size; return image
+            yield reader.read((0, 0, reader.size[0], reader.size[1])), (0,0)
+            return
+
+        for y in range(len(yLoc)):
+            for x in range(len(xLoc)):
+                pos = (int(xLoc[x]), int(yLoc[y]))
+                patch = reader.read((pos[0], pos[1], pos[0]+patchSize[0], pos[1]+patchSize[1]))
+                yield patch, pos
+    finally:
+        reader.close()
+
+
+
+class PatchWriter:
+    '''
+        Encodes and saves (PIL) images to disk on a pool of worker threads.
+        At most "maxPending" images are held in memory at any time; calls
+        to "write" block until a slot becomes available.
+        Errors are not raised, but collected per file path and returned
+        upon closing the writer.
+    '''
+    def __init__(self, numWorkers=None, maxPending=None):
+        if numWorkers is None:
+            numWorkers = min(8, os.cpu_count() or 1)
+        self.numWorkers = max(1, numWorkers)
+        if maxPending is None:
+            maxPending = 2 * self.numWorkers
+        self.maxPending = max(1, maxPending)
+        self.executor = ThreadPoolExecutor(max_workers=self.numWorkers)
+        self.pending = deque()
+        self.errors = {}
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def _collect(self):
+        filePath, future = self.pending.popleft()
+        try:
+            future.result()
+        except Exception as e:
+            self.errors[filePath] = e
+
+
+    def write(self, image, filePath):
+        while len(self.pending) >= self.maxPending:
+            self._collect()
+        self.pending.append((filePath, self.executor.submit(image.save, filePath)))
+
+
+    def close(self):
+        '''
+            Waits for all pending images to be saved and returns a dict
+            of file paths and exceptions for those that could not be.
+        '''
+        while len(self.pending):
+            self._collect()
+        self.executor.shutdown(wait=True)
+        return self.errors
@@ -3,10 +3,12 @@
     JSON-formatted AI and AL model options.
     Some of these functions are analogous to the "optionsEngine.js".
 
-    2020 Benjamin Kellenberger
+    2020-21 Benjamin Kellenberger
 '''
 
+from collections import namedtuple
 from collections.abc import Iterable
+from functools import lru_cache
 
 
 RESERVED_KEYWORDS = [
@@ -216,4 +218,53 @@ def update_hierarchical_value(sourceOptions, targetOptions, sourceKeys, targetKe
     sourceVal = get_hierarchical_value(sourceOptions, sourceKeys)
     if sourceVal is None:
         return
-    set_hierarchical_value(targetOptions, targetKeys, sourceVal)
\ No newline at end of file
+    set_hierarchical_value(targetOptions, targetKeys, sourceVal)
+
+
+
+@lru_cache(maxsize=None)
+def _compiled_options_type(fieldNames):
+    return namedtuple('CompiledOptions', fieldNames)
+
+
+def _cast_value(value, valueType, fallback):
+    if value is None:
+        return fallback
+    if valueType is None:
+        return value
+    if isinstance(value, (dict, list)):
+        # key not found; "get_hierarchical_value" returns the enclosing entry
+        return fallback
+    if valueType is bool:
+        if isinstance(value, bool):
+            return value
+        elif isinstance(value, str):
+            return value.strip().lower() in ('true', '1', 'yes', 'on')
+        elif isinstance(value, (int, float)):
+            return bool(value)
+        return fallback
+    try:
+        return valueType(value)
+    except Exception:
+        return fallback
+
+
+
+def compile_options(options, spec):
+    '''
+        Resolves the values of the (substituted) "options" that are listed
+        in the "spec" once and returns them as an immutable object with one
+        attribute per entry, so that they can be read without traversing
+        the options (e.g. in inference loops).
+        "spec" is a dict of attribute name: (keys, type, fallback), where
+        "keys" are the hierarchical keys (see "get_hierarchical_value"),
+        "type" is the type the value is converted to (or None to keep the
+        value as is) and "fallback" the value used if the value could not
+        be found or converted.
+    '''
+    fieldNames = tuple(spec.keys())
+    values = {}
+    for name in fieldNames:
+        keys, valueType, fallback = spec[name]
+        values[name] = _cast_value(get_hierarchical_value(options, list(keys), fallback=fallback), valueType, fallback)
+    return _compiled_options_type(fieldNames)(**values)
\ No newline at end of file
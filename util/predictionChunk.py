@@ -0,0 +1,235 @@
+'''
+    Columnar container for the predictions of a chunk of images, passed from
+    a model's "inference" function through the AL criterion ("rank") to the
+    AIWorker, which stores them in the database.
+
+    Instead of one dict per prediction with class confidences ("logits") as
+    Python lists, predictions are stored as arrays per field: one value per
+    prediction for scalar fields (label, confidence, x, y, etc.) and one
+    N x C array for the logits of all N predictions. Segmentation masks are
+    stored as one (label, logits, confidence) array triplet per image. Dense
+    logits are thus never converted to Python objects.
+
+    Models add their predictions per image:
+
+        chunk = PredictionChunk()
+        chunk.add(imgID, logits=confs, label=labelNames, x=..., y=..., ...)
+        chunk.add_mask(imgID, label=argmaxMap, logits=probs)
+        return chunk
+
+    Arrays, lists and PyTorch tensors are accepted. The legacy dict format
+    (see "doc/custom_model.md") is still supported for third-party models
+    and AL criteria through "PredictionChunk.from_dict" and "to_dict".
+
+    2021 Benjamin Kellenberger
+'''
+
+import numpy as np
+
+
+def _to_numpy(values, dtype=None):
+    if hasattr(values, 'detach'):
+        # PyTorch tensor
+        values = values.detach().cpu().numpy()
+    return np.asarray(values, dtype=dtype)
+
+
+def _to_list(values):
+    '''
+        Converts a column to a list of Python primitives; NaN values become
+        None.
+    '''
+    if values.dtype.kind == 'f':
+        nan = np.isnan(values)
+        if np.any(nan):
+            values = values.astype(object)
+            values[nan] = None
+    return values.tolist()
+
+
+
+class PredictionChunk:
+
+    def __init__(self):
+        self._records = []          # (imageID, number of predictions, fields, logits) per call of "add"
+        self._columns = None        # consolidated columns (created on demand)
+        self.masks = []             # segmentation masks: dicts of imageID, label, logits, confidence, priority
+        self.fVecs = {}             # image ID: feature vector (bytes)
+
+
+    def add(self, imageID, logits=None, **fields):
+        '''
+            Adds the predictions of one image. Keyword arguments are columns
+            (arrays, tensors or lists of equal length N), such as "label"
+            (label class UUIDs as strings), "confidence", "x", "y", "width"
+            and "height". "logits" is an N x C array of class confidences.
+        '''
+        fields = dict((key, _to_numpy(val)) for key, val in fields.items())
+        if logits is not None:
+            logits = _to_numpy(logits, np.float32)
+            num = len(logits)
+        elif len(fields):
+            num = len(next(iter(fields.values())))
+        else:
+            num = 0
+        if not num:
+            return
+        self._records.append((imageID, num, fields, logits))
+        self._columns = None
+
+
+    def add_mask(self, imageID, label, logits=None, confidence=None):
+        '''
+            Adds the segmentation mask of an image: "label" is an H x W array
+            of label class indices, "logits" an optional C x H x W array of
+            class confidences and "confidence" an optional H x W array.
+        '''
+        self.masks.append({
+            'image': imageID,
+            'label': _to_numpy(label),
+            'logits': (_to_numpy(logits, np.float32) if logits is not None else None),
+            'confidence': (_to_numpy(confidence) if confidence is not None else None),
+            'priority': None
+        })
+
+
+    def set_feature_vector(self, imageID, fVec):
+        self.fVecs[imageID] = fVec
+
+
+    def __len__(self):
+        return sum(r[1] for r in self._records)
+
+
+    def _consolidate(self):
+        if self._columns is not None:
+            return self._columns
+        columns = {
+            'image': np.concatenate([np.full(r[1], r[0], dtype=object) for r in self._records]) \
+                        if len(self._records) else np.empty(0, dtype=object)
+        }
+        fieldNames = set()
+        for r in self._records:
+            fieldNames.update(r[2].keys())
+        for fn in fieldNames:
+            columns[fn] = np.concatenate([
+                (r[2][fn] if fn in r[2] else np.full(r[1], None, dtype=object)) for r in self._records
+            ])
+
+        # logits; predictions without logits (or with a different number of classes) are NaN
+        numClasses = set(r[3].shape[1] for r in self._records if r[3] is not None and r[3].ndim == 2)
+        if len(numClasses) == 1:
+            numClasses = numClasses.pop()
+            columns['logits'] = np.concatenate([
+                (r[3] if r[3] is not None and r[3].ndim == 2 and r[3].shape[1] == numClasses \
+                    else np.full((r[1], numClasses), np.nan, dtype=np.float32)) for r in self._records
+            ])
+        else:
+            columns['logits'] = None
+        self._columns = columns
+        return columns
+
+
+    @property
+    def logits(self):
+        '''
+            Returns the logits of all predictions as an N x C array (or None
+            if no prediction has logits).
+        '''
+        return self._consolidate()['logits']
+
+
+    def column(self, name):
+        '''
+            Returns a field of all predictions as an array of length N (or
+            None if no prediction has this field).
+        '''
+        return self._consolidate().get(name, None)
+
+
+    def set_column(self, name, values):
+        '''
+            Sets a field (e.g. "priority") of all predictions from an array
+            of length N.
+        '''
+        columns = self._consolidate()
+        values = _to_numpy(values)
+        assert len(values) == len(columns['image']), 'Number of values does not match number of predictions.'
+        columns[name] = values
+
+
+    def column_list(self, name):
+        '''
+            Returns a field of all predictions as a list of Python primitives,
+            with None for missing and NaN values.
+        '''
+        values = self.column(name)
+        if values is None:
+            return [None] * len(self)
+        return _to_list(values)
+
+
+    def to_dict(self):
+        '''
+            Converts the chunk to the legacy dict format (image ID: dict with
+            a list of prediction dicts).
+        '''
+        result = {}
+        columns = self._consolidate()
+        fieldNames = [fn for fn in columns.keys() if fn not in ('image', 'logits')]
+        values = dict((fn, self.column_list(fn)) for fn in fieldNames)
+        logits = columns['logits']
+        for p, imgID in enumerate(columns['image'].tolist()):
+            prediction = dict((fn, values[fn][p]) for fn in fieldNames if values[fn][p] is not None)
+            if logits is not None and not np.isnan(logits[p,0]):
+                prediction['logits'] = logits[p,:].tolist()
+            result.setdefault(imgID, {'predictions': []})['predictions'].append(prediction)
+        for mask in self.masks:
+            prediction = dict((key, val) for key, val in mask.items() if key != 'image' and val is not None)
+            result.setdefault(mask['image'], {'predictions': []})['predictions'].append(prediction)
+        for imgID, fVec in self.fVecs.items():
+            result.setdefault(imgID, {'predictions': []})['fVec'] = fVec
+        return result
+
+
+    @staticmethod
+    def from_dict(result, segmentation=False):
+        '''
+            Creates a chunk from predictions in the legacy dict format. If
+            "segmentation" is True, predictions are treated as segmentation
+            masks.
+        '''
+        chunk = PredictionChunk()
+        for imgID in result.keys():
+            predictions = result[imgID].get('predictions', [])
+            if segmentation:
+                for prediction in predictions:
+                    chunk.add_mask(imgID, prediction['label'], prediction.get('logits', None),
+                                    prediction.get('confidence', None))
+                    chunk.masks[-1]['priority'] = prediction.get('priority', None)
+            elif len(predictions):
+                fieldNames = set()
+                for prediction in predictions:
+                    fieldNames.update(prediction.keys())
+                fieldNames.discard('logits')
+                fields = dict((fn, np.array([prediction.get(fn, None) for prediction in predictions],
+                                    dtype=object)) for fn in fieldNames)
+                logits = None
+                if all('logits' in prediction for prediction in predictions) and \
+                    len(set(len(prediction['logits']) for prediction in predictions)) == 1:
+                    logits = [prediction['logits'] for prediction in predictions]
+                chunk.add(imgID, logits=logits, **fields)
+            if 'fVec' in result[imgID] and result[imgID]['fVec'] is not None and len(result[imgID]['fVec']):
+                chunk.set_feature_vector(imgID, result[imgID]['fVec'])
+        return chunk
+
+
+    @staticmethod
+    def wrap(result, segmentation=False):
+        '''
+            Returns "result" if it is a chunk already, else converts it from
+            the legacy dict format.
+        '''
+        if isinstance(result, PredictionChunk):
+            return result
+        return PredictionChunk.from_dict(result, segmentation)